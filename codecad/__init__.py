@@ -8,6 +8,7 @@ from . import grid_eval
 
 from .assemblies import assembly
 
-from .mass_properties import mass_properties
+from .mass_properties import mass_properties, surface_area
+from .interference import interferences
 
 # pylama:ignore=W0611
@@ -6,7 +6,40 @@ from . import util
 
 
 Part = collections.namedtuple("Part", "name data attributes")
-Assembly = collections.namedtuple("Assembly", "name instances attributes")
+
+
+class Assembly(
+    collections.namedtuple("Assembly", "name instances attributes flattened")
+):
+    """ Immutable storage of assembly contents.
+    `flattened` is the tuple of all part instances, see `all_instances`. """
+
+    __slots__ = ()
+
+    def all_instances(self):
+        """ Return tuple of all individual part instances in this assembly,
+        recursively descending into subassemblies, with transformations relative
+        to this assembly.
+
+        Assemblies are immutable, so the tuple is built only once together with
+        the assembly and shared by all instances of this assembly. """
+        return self.flattened
+
+
+def _flatten(instances):
+    """ Build the tuple of all part instances for Assembly.flattened from direct
+    instances of an assembly, using the already flattened subassemblies. """
+    flattened = []
+    for instance in instances:
+        if hasattr(instance, "all_instances"):
+            transform = instance.transform
+            flattened.extend(
+                inner_instance._transformed(transform)  # noqa
+                for inner_instance in instance.part.all_instances()
+            )
+        else:
+            flattened.append(instance)
+    return tuple(flattened)
 
 
 class PartTransformBase(
@@ -95,50 +128,65 @@ class AssemblyInterfaceMixin:
 
         Transforms for nested parts are merged so that the part can be added to
         the same place with a single step. """
-
-        for instance in self:
-            if hasattr(instance, "all_instances"):
-                for inner_instance in instance.all_instances():
-                    yield inner_instance._transformed(instance.transform)  # noqa
-            else:
-                yield instance
+        return iter(self.part.all_instances())
 
     def bom(self, recursive=True, visible_only=False):
         """ Iterates over a bill of materials for this assembly, as BomItem instances.
         If recursive is True, goes through all parts in sub assemblies,
-        otherwise only lists parts and assemblies directly added to this asm. """
-        bom = collections.OrderedDict()
+        otherwise only lists parts and assemblies directly added to this asm.
+
+        Items are grouped by name, different parts sharing a name get a numeric
+        suffix. """
+        by_name = collections.OrderedDict()
+        by_part = {}
 
         for instance in self.all_instances() if recursive else self:
             if visible_only and not instance.visible:
                 continue
 
-            name = instance.part.name
-
-            same_names = bom.setdefault(name, [])
+            part = instance.part
+            item = by_part.get(id(part))
+            if item is not None:
+                item.count += 1
+                continue
 
-            for item in same_names:
-                if item.part is instance.part:
-                    item.count += 1
-                    break
-            else:
-                name = instance.part.name
-                if len(same_names) > 1:
-                    name += "-{}".format(len(same_names) + 1)
-                same_names.append(BomItem(name, instance.part))
+            same_names = by_name.setdefault(part.name, [])
+            name = part.name
+            if same_names:
+                name += "-{}".format(len(same_names) + 1)
+            item = BomItem(name, part)
+            same_names.append(item)
+            by_part[id(part)] = item
 
-        for same_names in bom.values():
+        for same_names in by_name.values():
             yield from same_names
 
     def shape(self):
         """ Return single shape for the whole assembly put together.
-        Parts that are not visible are not included. """
+        Parts that are not visible are not included.
+        Parts used more than once are combined using instancing, so that
+        each part is only evaluated by a single shared sub-program. """
+        transforms_by_part = collections.OrderedDict()
+        for instance in self.all_instances():
+            if instance.visible:
+                transforms_by_part.setdefault(
+                    id(instance.part), (instance.part, [])
+                )[1].append(instance.transform)
+
         return shapes.union(
-            instance.part.data.transformed(instance.transform)
-            for instance in self.all_instances()
-            if instance.visible
+            part.data.transformed(transforms[0])
+            if len(transforms) == 1
+            else shapes.instances(part.data, transforms)
+            for part, transforms in transforms_by_part.values()
         ).transformed(self.transform)
 
+    def interferences(self, resolution, clearance=0, grid_size=None):
+        """ Return list of pairs of visible parts that overlap or are closer than
+        clearance to each other. See `codecad.interference.interferences`. """
+        from . import interference
+
+        return interference.interferences(self, resolution, clearance, grid_size)
+
     def __iter__(self):
         """ Iterate over part instances of this assembly, not entering subassemblies
         recursively. """
@@ -173,7 +221,7 @@ def assembly(name, instances, attributes=None):
     if attributes is None:
         attributes = []
 
-    asm = Assembly(name, instances, attributes)
+    asm = Assembly(name, tuple(instances), attributes, _flatten(instances))
 
     if dimension == 2:
         return AssemblyTransform2D(asm, util.Transformation.zero(), True)
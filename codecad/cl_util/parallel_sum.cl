@@ -23,4 +23,29 @@ uint indexing_prefix_sum_helper(uint value, __local uint* buffer)
     return buffer[get_local_id(0)];
 }
 
+/** First step of indexing prefix sum over a whole buffer.
+Replaces each of the first `count` values with an exclusive permuted prefix sum
+within its work group and stores the work group totals into `groupSums`. */
+__kernel void indexing_prefix_sum_local(__global uint* values, uint count,
+                                        __global uint* groupSums)
+{
+    __local uint buffer[INDEXING_PREFIX_SUM_GROUP_SIZE];
+
+    uint input = get_global_id(0) < count ? values[get_global_id(0)] : 0;
+    uint summed = indexing_prefix_sum_helper(input, buffer);
+    if (get_local_id(0) == 0)
+        groupSums[get_group_id(0)] = summed;
+    if (get_global_id(0) < count)
+        values[get_global_id(0)] = summed - input;
+}
+
+/** Second step of indexing prefix sum over a whole buffer.
+Adds the (already prefix summed) group offsets to values. */
+__kernel void indexing_prefix_sum_add(__global uint* values, uint count,
+                                      __global const uint* groupOffsets)
+{
+    if (get_global_id(0) < count)
+        values[get_global_id(0)] += groupOffsets[get_group_id(0)];
+}
+
 // vim: filetype=c
@@ -1,4 +1,10 @@
+import numpy
+import pyopencl
+
 from .opencl_manager import instance as opencl_manager
+from . import cl_buffer
+
+INDEXING_PREFIX_SUM_GROUP_SIZE = 256
 
 
 def generate_sum_helper(h_file, c_file, type_name, op="a + b", name=None):
@@ -74,7 +80,72 @@ with floating point precision. */""".format(
     )
 
 
+class IndexingPrefixSum:
+    """ Calculates indexing prefix sums of uint buffers of arbitrary length in place.
+
+    The result has the same properties as the one of `indexing_prefix_sum_helper`,
+    except that it is exclusive: Every value is replaced by an offset at which
+    `value` items can be stored without overlapping any other item, but the
+    offsets are not necessarily increasing.
+    Temporary buffers are allocated once in constructor for up to `max_count` items. """
+
+    def __init__(self, max_count, queue=None):
+        self._levels = []
+        count = max_count
+        while True:
+            count = -(-count // INDEXING_PREFIX_SUM_GROUP_SIZE)
+            self._levels.append(
+                cl_buffer.Buffer(
+                    numpy.uint32, count, pyopencl.mem_flags.READ_WRITE, queue=queue
+                )
+            )
+            if count == 1:
+                break
+
+        self.total = self._levels[-1]
+        """ Buffer with the sum of all values as its only item, valid once the
+        event returned from enqueue is finished. """
+
+    def enqueue(self, values, count, wait_for=None):
+        """ Enqueue calculation of the prefix sum of the first `count` items
+        in `values` buffer. Returns event. """
+        return self._enqueue(values, count, 0, wait_for)
+
+    def _enqueue(self, values, count, level, wait_for):
+        group_sums = self._levels[level]
+        group_count = -(-count // INDEXING_PREFIX_SUM_GROUP_SIZE)
+        assert group_count <= len(group_sums)
+
+        global_size = (group_count * INDEXING_PREFIX_SUM_GROUP_SIZE,)
+        local_size = (INDEXING_PREFIX_SUM_GROUP_SIZE,)
+
+        ev = opencl_manager.k.indexing_prefix_sum_local(
+            global_size,
+            local_size,
+            values,
+            numpy.uint32(count),
+            group_sums,
+            wait_for=wait_for,
+        )
+
+        if level + 1 < len(self._levels):
+            ev = self._enqueue(group_sums, group_count, level + 1, [ev])
+            ev = opencl_manager.k.indexing_prefix_sum_add(
+                global_size,
+                local_size,
+                values,
+                numpy.uint32(count),
+                group_sums,
+                wait_for=[ev],
+            )
+
+        return ev
+
+
 parallel_sum_c = opencl_manager.add_compile_unit()
+parallel_sum_c.append_define(
+    "INDEXING_PREFIX_SUM_GROUP_SIZE", INDEXING_PREFIX_SUM_GROUP_SIZE
+)
 parallel_sum_c.append_resource("parallel_sum.cl")
 opencl_manager.common_header.append_resource("parallel_sum.h")
 
@@ -32,4 +32,60 @@ __kernel void grid_eval(__constant float* scene,
 
     output[INDEX3_GG] = evaluate(scene, point);
 }
+
+/** Evaluate the scene on several XY planes at once.
+ * Z coordinate of each layer is taken from zValues, indexed by the third
+ * global id. Layers are stored one after another in the output, each in the
+ * same layout as a 2D grid_eval */
+__kernel void grid_eval_layers(__constant float* scene,
+                               float2 boxCorner, float boxStep,
+                               __global const float* zValues,
+                               __global float4* output)
+{
+    uint layer = get_global_id(2);
+    float3 point = (float3)(boxCorner + boxStep * (float2)(get_global_id(0),
+                                                           get_global_id(1)),
+                            zValues[layer]);
+
+    size_t layerSize = get_global_size(0) * get_global_size(1);
+    output[layer * layerSize + INDEX2_GG] = evaluate(scene, point);
+}
+
+/** Version of grid_eval that only stores the distance */
+__kernel void grid_eval_distance(__constant float* scene,
+                                 float4 boxCorner, float boxStep,
+                                 __global float* output)
+{
+    uint3 coords = (uint3)(get_global_id(0),
+                           get_global_id(1),
+                           get_global_id(2));
+
+    float3 point = as_float3(boxCorner) + boxStep * convert_float3(coords);
+
+    output[INDEX3_GG] = evaluate(scene, point).w;
+}
+
+/** Evaluate the scene at points given as an array of float triplets */
+__kernel void points_eval(__constant float* scene,
+                          __global const float* points,
+                          __global float4* output)
+{
+    output[get_global_id(0)] = evaluate(scene, vload3(get_global_id(0), points));
+}
+
+/** Move points given as an array of float triplets onto the surface
+ * using Newton steps p -= d * n */
+__kernel void project_to_surface(__constant float* scene,
+                                 __global float* points,
+                                 uint iterations)
+{
+    float3 point = vload3(get_global_id(0), points);
+    for (uint i = 0; i < iterations; ++i)
+    {
+        float4 value = evaluate(scene, point);
+        point -= value.w * value.xyz;
+    }
+    vstore3(point, get_global_id(0), points);
+}
+
 // vim: filetype=c
@@ -0,0 +1,61 @@
+/** Evaluate intersection of two transformed shapes at a given point.
+ * First shape is expanded by the clearance. */
+float interference_value(__constant float* shape1, float4 quaternion1, float4 offset1,
+                         __constant float* shape2, float4 quaternion2, float4 offset2,
+                         float clearance, float3 point)
+{
+    float3 point1 = quaternion_transform(quaternion1, point) + offset1.xyz;
+    float3 point2 = quaternion_transform(quaternion2, point) + offset2.xyz;
+    return fmax(evaluate(shape1, point1).w - clearance,
+                evaluate(shape2, point2).w);
+}
+
+/** Classify cells of a grid by intersection of two shapes.
+ * Shapes are given with transformations from the common space into their own
+ * coordinates.
+ * Cells whose center is deeper than distanceThreshold inside of both shapes are
+ * counted in `insideCounter`, cells that might contain surface of the intersection
+ * are appended to `list` for further splitting.
+ * On the last level distanceThreshold is zero and only cells with center strictly
+ * inside are counted, so that touching surfaces don't count as interference. */
+__kernel void interference(__constant float* shape1, float4 quaternion1, float4 offset1,
+                           __constant float* shape2, float4 quaternion2, float4 offset2,
+                           float clearance,
+                           float4 boxCorner, float boxStep,
+                           float distanceThreshold,
+                           __global uint* insideCounter,
+                           __global uint* intersectingCounter,
+                           __global uchar4* list)
+{
+    // Using local counter to decrease global atomic contention
+    __local uint localInsideCounter;
+
+    bool isFirstInWorkgroup = get_local_id(0) == 0 && get_local_id(1) == 0 && get_local_id(2) == 0;
+    if (isFirstInWorkgroup)
+        localInsideCounter = 0;
+    barrier(CLK_LOCAL_MEM_FENCE);
+
+    float3 point = as_float3(boxCorner) + boxStep * (float3)(get_global_id(0),
+                                                             get_global_id(1),
+                                                             get_global_id(2));
+
+    float value = interference_value(shape1, quaternion1, offset1,
+                                     shape2, quaternion2, offset2,
+                                     clearance, point);
+
+    if (value < -distanceThreshold)
+        atomic_inc(&localInsideCounter);
+    else if (value < distanceThreshold)
+        // Possibly intersecting the surface, needs to be split again
+        list[atomic_inc(intersectingCounter)] = (uchar4)(get_global_id(0),
+                                                         get_global_id(1),
+                                                         get_global_id(2),
+                                                         0);
+
+    // flush the counter into the global result
+    barrier(CLK_LOCAL_MEM_FENCE);
+    if (isFirstInWorkgroup)
+        atomic_add(insideCounter, localInsideCounter);
+}
+
+// vim: filetype=c
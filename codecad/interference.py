@@ -0,0 +1,191 @@
+""" Checking interference and clearance between parts of an assembly. """
+
+import collections
+import math
+
+import numpy
+import pyopencl
+import pyopencl.cltypes
+
+from . import util
+from . import cl_util
+from . import subdivision
+from .cl_util import opencl_manager
+from . import nodes
+
+_c_file = opencl_manager.add_compile_unit()
+_c_file.append_resource("shapes/common.h")
+_c_file.append_resource("interference.cl")
+
+
+class Interference(collections.namedtuple("Interference", "first second volume")):
+    """ Pair of interfering part instances and approximate volume of their overlap.
+    If clearance was requested, the volume is of the overlap of the first part
+    expanded by the clearance with the second part. """
+
+    __slots__ = ()
+
+    def __str__(self):
+        return "{} x {}: {:g}".format(self.first.name, self.second.name, self.volume)
+
+
+def _candidate_pairs(boxes):
+    """ Yield pairs of indices (i, j), i < j of boxes that overlap.
+    Uses sweep and prune along the X axis. """
+    order = sorted(range(len(boxes)), key=lambda i: boxes[i].a.x)
+    active = []
+    for i in order:
+        box = boxes[i]
+        active = [j for j in active if boxes[j].b.x >= box.a.x]
+        for j in active:
+            other = boxes[j]
+            if all(
+                a1 <= b2 and a2 <= b1
+                for a1, b1, a2, b2 in zip(box.a, box.b, other.a, other.b)
+            ):
+                yield (min(i, j), max(i, j))
+        active.append(i)
+
+
+def _instance_args(program_buffer, transform):
+    """ Kernel arguments for evaluating a part instance """
+    inverse = transform.inverse()
+    return (
+        program_buffer,
+        numpy.array(
+            tuple(inverse.quaternion.as_list()), dtype=pyopencl.cltypes.float4
+        ),
+        inverse.offset.as_float4(),
+    )
+
+
+def _overlap_volume(args1, args2, box, resolution, clearance, grid_size):
+    """ Subdivide the box level by level, stopping at the first level that has any
+    cells completely inside of the intersection.
+    Returns approximate overlap volume, cells that might contain the surface of
+    the intersection count as half full. Returns zero if no such level exists. """
+    block_sizes = [
+        (resolution * cell_size, level_size)
+        for cell_size, level_size in subdivision.calculate_block_sizes(
+            box, 3, resolution, grid_size, overlap=False
+        )
+    ]
+
+    blocks = [box.a]
+    for level, (box_step, grid_dimensions) in enumerate(block_sizes):
+        last_level = level == len(block_sizes) - 1
+        if last_level:
+            distance_threshold = 0
+        else:
+            distance_threshold = box_step * math.sqrt(3) / 2
+
+        started = []
+        for block_corner in blocks:
+            inside_counter = cl_util.Buffer(
+                numpy.uint32, 1, pyopencl.mem_flags.READ_WRITE
+            )
+            intersecting_counter = cl_util.Buffer(
+                numpy.uint32, 1, pyopencl.mem_flags.READ_WRITE
+            )
+            intersecting_list = cl_util.Buffer(
+                pyopencl.cltypes.uchar4, grid_size ** 3, pyopencl.mem_flags.WRITE_ONLY
+            )
+            # Enqueue write instead of fill to work around pyopencl bug #168
+            fill_events = [
+                counter.enqueue_write(numpy.zeros(1, counter.dtype))
+                for counter in (inside_counter, intersecting_counter)
+            ]
+            ev = opencl_manager.k.interference(
+                grid_dimensions,
+                None,
+                *args1,
+                *args2,
+                numpy.float32(clearance),
+                (block_corner + util.Vector.splat(box_step / 2)).as_float4(),
+                numpy.float32(box_step),
+                numpy.float32(distance_threshold),
+                inside_counter,
+                intersecting_counter,
+                intersecting_list,
+                wait_for=fill_events,
+            )
+            started.append(
+                (
+                    block_corner,
+                    inside_counter,
+                    intersecting_counter,
+                    intersecting_list,
+                    ev,
+                )
+            )
+
+        inside_count = 0
+        next_blocks = []
+        for (
+            block_corner,
+            inside_counter,
+            intersecting_counter,
+            intersecting_list,
+            ev,
+        ) in started:
+            inside_count += int(inside_counter.read(wait_for=[ev])[0])
+            intersecting_count = int(intersecting_counter.read(wait_for=[ev])[0])
+            if intersecting_count:
+                intersecting_list.read(wait_for=[ev])
+                next_blocks.extend(
+                    util.Vector(i, j, k) * box_step + block_corner
+                    for i, j, k, _ in intersecting_list[:intersecting_count]
+                )
+
+        if inside_count:
+            # Early exit, this is enough to know that the parts interfere
+            return (inside_count + len(next_blocks) / 2) * box_step ** 3
+        if not next_blocks:
+            break
+        blocks = next_blocks
+
+    return 0
+
+
+def interferences(asm, resolution, clearance=0, grid_size=None):
+    """ Find pairs of visible parts of an assembly that overlap or are closer than
+    `clearance` to each other.
+
+    Candidate pairs are selected by overlap of their bounding boxes, then the
+    intersection of each candidate pair is subdivided down to `resolution`,
+    stopping at the first level that contains a cell completely inside of both
+    parts. Parts that only touch are not reported.
+
+    Returns list of Interference tuples. """
+
+    if grid_size is None:
+        grid_size = 16
+
+    assert resolution > 0, "Non-positive resolution makes no sense"
+    assert clearance >= 0, "Negative clearance makes no sense"
+    assert 1 < grid_size <= 256, "Grid size must fit into uchar coordinates"
+
+    instances = [instance for instance in asm.all_instances() if instance.visible]
+    if any(instance.dimension() != 3 for instance in instances):
+        raise ValueError("2D assemblies are not supported")
+
+    boxes = [instance.shape().bounding_box() for instance in instances]
+    expanded_boxes = [box.expanded_additive(clearance / 2) for box in boxes]
+
+    program_buffers = {}
+    ret = []
+    for i, j in sorted(_candidate_pairs(expanded_boxes)):
+        args = []
+        for instance in (instances[i], instances[j]):
+            part = instance.part
+            if id(part) not in program_buffers:
+                program_buffers[id(part)] = nodes.make_program_buffer(part.data)
+            args.append(_instance_args(program_buffers[id(part)], instance.transform))
+
+        # Only the first part is expanded by the clearance
+        box = boxes[i].expanded_additive(clearance).intersection(boxes[j])
+        volume = _overlap_volume(*args, box, resolution, clearance, grid_size)
+        if volume > 0:
+            ret.append(Interference(instances[i], instances[j], volume))
+
+    return ret
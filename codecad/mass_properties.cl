@@ -55,5 +55,55 @@ __kernel void mass_properties(__constant float* shape,
     }
 }
 
+/** Accumulate weights for surface area calculation using a smoothed delta function
+ * of the distance field.
+ * Cells with |value| < distanceThreshold are appended to the list for further
+ * splitting (the threshold already includes the band), unless distanceThreshold
+ * is zero, in which case this is the leaf level and the cells within bandWidth
+ * from the surface contribute
+ * a raised cosine weight (scaled to SURFACE_AREA_WEIGHT_SCALE fixed point) to `weightSum`.
+ * Care must be taken when calling this not to overflow the 32bit counter. */
+__kernel void surface_area(__constant float* shape,
+                           float4 boxCorner, float boxStep,
+                           float distanceThreshold, float bandWidth,
+                           __global uint* weightSum,
+                           __global uint* intersectingCounter,
+                           __global uchar4* list)
+{
+    // Using local buffer to decrease global atomic contention
+    __local uint localWeightSum;
+
+    bool isFirstInWorkgroup = get_local_id(0) == 0 && get_local_id(1) == 0 && get_local_id(2) == 0;
+    if (isFirstInWorkgroup)
+        localWeightSum = 0;
+    barrier(CLK_LOCAL_MEM_FENCE);
+
+    float3 point = as_float3(boxCorner) + boxStep * (float3)(get_global_id(0),
+                                                             get_global_id(1),
+                                                             get_global_id(2));
+
+    float value = evaluate(shape, point).w;
+
+    if (distanceThreshold > 0)
+    {
+        if (fabs(value) < distanceThreshold)
+            // Possibly within the band around surface, needs to be split again
+            list[atomic_inc(intersectingCounter)] = (uchar4)(get_global_id(0),
+                                                             get_global_id(1),
+                                                             get_global_id(2),
+                                                             0);
+    }
+    else if (fabs(value) < bandWidth)
+    {
+        float weight = (1 + cos(M_PI_F * value / bandWidth)) / 2;
+        atomic_add(&localWeightSum,
+                   convert_uint_rte(weight * SURFACE_AREA_WEIGHT_SCALE));
+    }
+
+    // flush the buffer into the global result
+    barrier(CLK_LOCAL_MEM_FENCE);
+    if (isFirstInWorkgroup)
+        atomic_add(weightSum, localWeightSum);
+}
 
 // vim: filetype=c
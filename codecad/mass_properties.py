@@ -1,6 +1,4 @@
 import collections
-import functools
-import operator
 import math
 
 import numpy
@@ -13,7 +11,14 @@ from . import subdivision
 from .cl_util import opencl_manager
 from . import nodes
 
-opencl_manager.add_compile_unit().append_resource("mass_properties.cl")
+SURFACE_AREA_WEIGHT_SCALE = 1024
+
+# TODO: Determine default grid size
+_DEFAULT_GRID_SIZE = 64
+
+_c_file = opencl_manager.add_compile_unit()
+_c_file.append_define("SURFACE_AREA_WEIGHT_SCALE", SURFACE_AREA_WEIGHT_SCALE)
+_c_file.append_resource("mass_properties.cl")
 
 
 class MassProperties(
@@ -27,13 +32,89 @@ class MassProperties(
     __slots__ = ()
 
 
+def _integrate_blocks(box, block_sizes, grid_size, band, enqueue_kernel, process_block):
+    """ Block pipeline shared by the integrators in this module.
+
+    Starts with a single block at `box.a` and walks down the levels of `block_sizes`
+    (already scaled to real units), splitting every cell whose center is closer than
+    half of the cell diagonal plus `band` to the surface.
+    On the last level the distance threshold is set to zero and the kernel is
+    expected to do the actual integration.
+
+    `enqueue_kernel(grid_dimensions, shifted_corner, box_step, distance_threshold,
+    intersecting_counter, intersecting_list, wait_for)` must enqueue the kernel and
+    return tuple `(event, state)`. `process_block(box_corner, level, state)` is
+    called when the event is finished. """
+
+    def job(job_id):
+        box_corner, level = job_id
+
+        intersecting_counter = cl_util.Buffer(
+            numpy.uint32, 1, pyopencl.mem_flags.READ_WRITE
+        )
+        intersecting_list = cl_util.Buffer(
+            pyopencl.cltypes.uchar4, grid_size ** 3, pyopencl.mem_flags.WRITE_ONLY
+        )
+
+        box_step = block_sizes[level][0]
+        grid_dimensions = block_sizes[level][1]
+        assert all(x <= grid_size for x in grid_dimensions)
+        shifted_corner = box_corner + util.Vector.splat(box_step / 2)
+        if level < len(block_sizes) - 1:
+            distance_threshold = box_step * math.sqrt(3) / 2 + band
+        else:
+            distance_threshold = 0
+
+        # Enqueue write instead of fill to work around pyopencl bug #168
+        fill_ev = intersecting_counter.enqueue_write(
+            numpy.zeros(1, intersecting_counter.dtype)
+        )
+
+        ev, state = enqueue_kernel(
+            grid_dimensions,
+            shifted_corner,
+            box_step,
+            distance_threshold,
+            intersecting_counter,
+            intersecting_list,
+            [fill_ev],
+        )
+        yield ev
+
+        intersecting_count = intersecting_counter.read()[0]
+        intersecting_event = intersecting_list.enqueue_read()
+
+        process_block(box_corner, level, state)
+
+        s = block_sizes[level][0]
+        level = level + 1
+        assert level < len(block_sizes) or intersecting_count == 0
+
+        intersecting_event.wait()
+        return (
+            (util.Vector(i, j, k) * s + box_corner, level)
+            for i, j, k, l in intersecting_list[:intersecting_count]
+        )
+
+    cl_util.interleave2(job, [(box.a, 0)])
+
+
+def _real_block_sizes(box, resolution, grid_size):
+    """ Calculate block sizes for the integrators, with block steps in real units. """
+    block_sizes = subdivision.calculate_block_sizes(
+        box, 3, resolution, grid_size, overlap=False
+    )
+    return [
+        (resolution * cell_size, level_size) for cell_size, level_size in block_sizes
+    ]
+
+
 def mass_properties(shape, resolution, grid_size=None):
     # Inertia tensor info:
     # http://farside.ph.utexas.edu/teaching/336k/Newtonhtml/node64.html
 
     if grid_size is None:
-        # TODO: Determine default grid size
-        grid_size = 64
+        grid_size = _DEFAULT_GRID_SIZE
 
     assert shape.dimension() == 3, "2D objects are not supported yet"
     assert resolution > 0, "Non-positive resolution makes no sense"
@@ -44,13 +125,7 @@ def mass_properties(shape, resolution, grid_size=None):
     program_buffer = nodes.make_program_buffer(shape)
 
     box = shape.bounding_box()
-    block_sizes = subdivision.calculate_block_sizes(
-        box, shape.dimension(), resolution, grid_size, overlap=False
-    )
-
-    block_sizes = [
-        (resolution * cell_size, level_size) for cell_size, level_size in block_sizes
-    ]
+    block_sizes = _real_block_sizes(box, resolution, grid_size)
 
     integral_one = util.KahanSummation()
     integral_x = util.KahanSummation()
@@ -63,39 +138,21 @@ def mass_properties(shape, resolution, grid_size=None):
     integral_xz = util.KahanSummation()
     integral_yz = util.KahanSummation()
 
-    kernel_invocations = 0
-    function_evaluations = 0
-
-    def job(job_id):
-        nonlocal integral_one, integral_x, integral_y, integral_z, integral_xx, integral_yy, integral_zz, integral_xy, integral_xz, integral_yz
-        nonlocal kernel_invocations, function_evaluations
-
-        box_corner, level = job_id
-
+    def enqueue_kernel(
+        grid_dimensions,
+        shifted_corner,
+        box_step,
+        distance_threshold,
+        intersecting_counter,
+        intersecting_list,
+        wait_for,
+    ):
         index_sums = cl_util.Buffer(numpy.uint32, 10, pyopencl.mem_flags.READ_WRITE)
-        intersecting_counter = cl_util.Buffer(
-            numpy.uint32, 1, pyopencl.mem_flags.READ_WRITE
-        )
-        intersecting_list = cl_util.Buffer(
-            pyopencl.cltypes.uchar4, grid_size ** 3, pyopencl.mem_flags.WRITE_ONLY
-        )
-
-        box_step = block_sizes[level][0]
-        grid_dimensions = block_sizes[level][1]
-        assert all(x <= grid_size for x in grid_dimensions)
-        shifted_corner = box_corner + util.Vector.splat(box_step / 2)
-        if level < len(block_sizes) - 1:
-            distance_threshold = box_step * math.sqrt(3) / 2
-        else:
-            distance_threshold = 0
-
-        # Enqueue write instead of fill to work around pyopencl bug #168
-        fill_ev = index_sums.enqueue_write(numpy.zeros(10, index_sums.dtype))
-        fill_ev = intersecting_counter.enqueue_write(
-            numpy.zeros(1, intersecting_counter.dtype), wait_for=[fill_ev]
+        fill_ev = index_sums.enqueue_write(
+            numpy.zeros(10, index_sums.dtype), wait_for=wait_for
         )
 
-        yield opencl_manager.k.mass_properties(
+        ev = opencl_manager.k.mass_properties(
             grid_dimensions,
             None,
             program_buffer,
@@ -107,11 +164,10 @@ def mass_properties(shape, resolution, grid_size=None):
             intersecting_list,
             wait_for=[fill_ev],
         )
-        kernel_invocations += 1
-        function_evaluations += functools.reduce(operator.mul, grid_dimensions)
+        return ev, index_sums
 
-        intersecting_count = intersecting_counter.read()[0]
-        intersecting_event = intersecting_list.enqueue_read()
+    def process_block(box_corner, level, index_sums):
+        nonlocal integral_one, integral_x, integral_y, integral_z, integral_xx, integral_yy, integral_zz, integral_xy, integral_xz, integral_yz
 
         # For all the functions in question, convert `sum f(I)` (where I are indices
         # of occupied cells) to `integral f(X)` over all occupied cells.
@@ -147,16 +203,7 @@ def mass_properties(shape, resolution, grid_size=None):
         integral_xz += s3 * (n * b.x * b.z + b.x * tmp_z + b.z * tmp_x + tmp_xz)
         integral_yz += s3 * (n * b.y * b.z + b.y * tmp_z + b.z * tmp_y + tmp_yz)
 
-        level = level + 1
-        assert level < len(block_sizes) or intersecting_count == 0
-
-        intersecting_event.wait()
-        return (
-            (util.Vector(i, j, k) * s + box_corner, level)
-            for i, j, k, l in intersecting_list[:intersecting_count]
-        )
-
-    cl_util.interleave2(job, [(box.a, 0)])
+    _integrate_blocks(box, block_sizes, grid_size, 0, enqueue_kernel, process_block)
 
     # Unwrap the integral values from the KahanSummation objects
     integral_one = integral_one.result
@@ -170,12 +217,6 @@ def mass_properties(shape, resolution, grid_size=None):
     integral_xz = integral_xz.result
     integral_yz = integral_yz.result
 
-    # Relative speedup compared to just blindly dividing the bounding box to the
-    # final resolution in one step
-    # direct_evaluations = functools.reduce(operator.mul, (box.size() / resolution).applyfunc(math.ceil))
-    # speedup = 1 - function_evaluations / direct_evaluations
-    # print("speedup:", speedup)
-
     volume = integral_one
     if volume == 0:
         return MassProperties(0, util.Vector.splat(0), numpy.zeros((3, 3)))
@@ -227,3 +268,82 @@ def mass_properties(shape, resolution, grid_size=None):
     )
 
     return MassProperties(volume, centroid, inertia_tensor)
+
+
+def surface_area(shape, resolution, grid_size=None, band_width=None):
+    """ Calculate surface area of a 3D shape.
+
+    Integrates a smoothed delta function of the distance field over the leaf cells
+    of the subdivision (only cells near the surface are ever evaluated), this
+    needs the distance field to be close to exact within `band_width` from the surface.
+    Uses the same block pipeline as `mass_properties`.
+
+    :param resolution: Size of the leaf cells.
+    :param grid_size: Size of the evaluated blocks, None means a reasonable default.
+    :param band_width: Half width of the smoothed delta function, defaults to
+        `2 * resolution`. Whole multiples of resolution work best. """
+
+    if grid_size is None:
+        grid_size = _DEFAULT_GRID_SIZE
+
+    if band_width is None:
+        band_width = 2 * resolution
+
+    assert shape.dimension() == 3, "2D objects are not supported yet"
+    assert resolution > 0, "Non-positive resolution makes no sense"
+    assert band_width > 0, "Non-positive band width makes no sense"
+    assert grid_size > 1, "Grid needs to be at least 2x2x2"
+    assert (
+        grid_size ** 3 * SURFACE_AREA_WEIGHT_SCALE <= 2 ** 32
+    ), "Weight sum would overflow"
+
+    program_buffer = nodes.make_program_buffer(shape)
+
+    # The band reaches outside of the shape
+    box = shape.bounding_box().expanded_additive(band_width)
+    block_sizes = _real_block_sizes(box, resolution, grid_size)
+
+    weight_sum = 0
+
+    def enqueue_kernel(
+        grid_dimensions,
+        shifted_corner,
+        box_step,
+        distance_threshold,
+        intersecting_counter,
+        intersecting_list,
+        wait_for,
+    ):
+        block_weight_sum = cl_util.Buffer(
+            numpy.uint32, 1, pyopencl.mem_flags.READ_WRITE
+        )
+        fill_ev = block_weight_sum.enqueue_write(
+            numpy.zeros(1, block_weight_sum.dtype), wait_for=wait_for
+        )
+
+        ev = opencl_manager.k.surface_area(
+            grid_dimensions,
+            None,
+            program_buffer,
+            shifted_corner.as_float4(),
+            numpy.float32(box_step),
+            numpy.float32(distance_threshold),
+            numpy.float32(band_width),
+            block_weight_sum,
+            intersecting_counter,
+            intersecting_list,
+            wait_for=[fill_ev],
+        )
+        return ev, block_weight_sum
+
+    def process_block(box_corner, level, block_weight_sum):
+        nonlocal weight_sum
+        if level == len(block_sizes) - 1:
+            weight_sum += int(block_weight_sum.read()[0])
+
+    _integrate_blocks(
+        box, block_sizes, grid_size, band_width, enqueue_kernel, process_block
+    )
+
+    s = block_sizes[-1][0]
+    return s ** 3 * weight_sum / (SURFACE_AREA_WEIGHT_SCALE * band_width)
@@ -1,4 +1,4 @@
-from .program import make_program, make_program_buffer
+from .program import make_program, make_program_buffer, get_shape_hash
 
 from . import node
 from . import codegen
@@ -10,14 +10,18 @@ def generate_eval_source_code(node_class, register_count):
 
     c = opencl_manager.add_compile_unit()
     c.append_define("EVAL_REGISTER_COUNT", register_count)
+    c.append_define("EVAL_INSTANCING_DEPTH", node.MAX_INSTANCING_DEPTH)
     for name, (params, arity, _code) in node_class.node_types.items():
         _generate_op_decl(c, name, params, arity)
+    c.append_resource("instancing.cl")
     c.append(
         """
 float4 evaluate(__constant float* program, float3 point)
 {
     float4 registers[EVAL_REGISTER_COUNT];
     float4 lastValue;
+    InstancingState instancing[EVAL_INSTANCING_DEPTH];
+    uint instancingDepth = 0;
 
     while (true)
     {
@@ -54,6 +58,27 @@ float4 evaluate(__constant float* program, float3 point)
             node_class.node_types["_load"][2]
         )
     )
+    c.append(
+        """
+            case {}:
+                // _instances_to
+                lastValue = instancing_begin(instancing + instancingDepth++,
+                                             &program, lastValue);
+                break;""".format(
+            node_class.node_types["_instances_to"][2]
+        )
+    )
+    c.append(
+        """
+            case {}:
+                // _instances_from
+                if (!instancing_end(instancing + instancingDepth - 1,
+                                    &program, &lastValue))
+                    --instancingDepth;
+                break;""".format(
+            node_class.node_types["_instances_from"][2]
+        )
+    )
     for name, (params, arity, code) in node_class.node_types.items():
         _generate_op_handler(c, name, params, arity, code)
     c.append(
@@ -166,6 +191,8 @@ float4 evaluate(__constant float*, float3 point)
                     n.dependencies[0].register
                 )
             )
+        elif n.name == "_instances_to" or n.name == "_instances_from":
+            raise ValueError("Fixed evaluator doesn't support instancing")
         elif n.name == "_store" or n.name == "_load":
             c.append(
                 """
@@ -0,0 +1,113 @@
+// Evaluation of a shared sub-program for a table of instance transformations.
+//
+// Parameters of _instances_to node are:
+// node count, instance count,
+// bounding volume hierarchy nodes (box corner a, box corner b, skip index, instance index),
+// instances (inverse quaternion, inverse offset, quaternion).
+// Program between _instances_to and _instances_from nodes (the loop body)
+// is executed once for every instance whose bounding box is not farther than
+// the nearest surface found so far.
+
+#define INSTANCING_NODE_SIZE 8
+#define INSTANCING_INSTANCE_SIZE 11
+
+typedef struct
+{
+    __constant float* nodes;
+    __constant float* instances;
+    __constant float* body;
+    uint nodeCount;
+    uint current;
+    float4 point;
+    float4 result;
+} InstancingState;
+
+float instancing_box_distance(__constant float* node, float3 point)
+{
+    float3 a = vload3(0, node);
+    float3 b = vload3(1, node);
+    return length(fmax(fmax(a - point, point - b), 0));
+}
+
+// Return index of the first leaf node starting at `index` whose box might contain
+// a surface closer than current result, or node count if there is no such node.
+// Instances whose box contains the point are always evaluated, to get the
+// same value as union of the instances.
+uint instancing_find(const InstancingState* state, uint index)
+{
+    float limit = fmax(state->result.w, 0);
+    while (index < state->nodeCount)
+    {
+        __constant float* node = state->nodes + INSTANCING_NODE_SIZE * index;
+        if (instancing_box_distance(node, state->point.xyz) <= limit)
+        {
+            if (node[7] >= 0)
+                return index;
+            ++index;
+        }
+        else
+            index = (uint)node[6];
+    }
+    return index;
+}
+
+__constant float* instancing_current_instance(const InstancingState* state)
+{
+    uint instance = (uint)state->nodes[INSTANCING_NODE_SIZE * state->current + 7];
+    return state->instances + INSTANCING_INSTANCE_SIZE * instance;
+}
+
+float4 instancing_local_point(const InstancingState* state)
+{
+    __constant float* instance = instancing_current_instance(state);
+    return transformation_to_op(instance[0], instance[1], instance[2], instance[3],
+                                instance[4], instance[5], instance[6],
+                                state->point);
+}
+
+// Start evaluating instances at `point`, reads the instancing parameters
+// and returns point transformed to the first instance.
+float4 instancing_begin(InstancingState* state,
+                        __constant float* restrict* restrict program,
+                        float4 point)
+{
+    state->nodeCount = (uint)**program;
+    uint instanceCount = (uint)*(*program + 1);
+    state->nodes = *program + 2;
+    state->instances = state->nodes + INSTANCING_NODE_SIZE * state->nodeCount;
+    state->body = state->instances + INSTANCING_INSTANCE_SIZE * instanceCount;
+    state->point = point;
+    state->result = (float4)(0, 0, 0, INFINITY);
+    state->current = instancing_find(state, 0);
+
+    *program = state->body;
+    return instancing_local_point(state);
+}
+
+// Merge result of the current instance and move to the next one.
+// Returns true and sets program to the start of the loop body and value to the
+// transformed point if there is another instance to evaluate,
+// otherwise sets value to the result of the whole instancing and returns false.
+bool instancing_end(InstancingState* state,
+                    __constant float* restrict* restrict program,
+                    float4* value)
+{
+    __constant float* instance = instancing_current_instance(state) + 7;
+    float4 result = transformation_from_op(instance[0], instance[1], instance[2], instance[3],
+                                           *value);
+    if (result.w < state->result.w)
+        state->result = result;
+
+    state->current = instancing_find(state, state->current + 1);
+    if (state->current < state->nodeCount)
+    {
+        *program = state->body;
+        *value = instancing_local_point(state);
+        return true;
+    }
+
+    *value = state->result;
+    return false;
+}
+
+// vim: filetype=c
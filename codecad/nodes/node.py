@@ -5,6 +5,9 @@ import collections
 
 VARIABLE_COUNT = object()
 
+# Maximal nesting depth of _instances_to / _instances_from loops in a program
+MAX_INSTANCING_DEPTH = 4
+
 
 class Node:
     # Mapping of node name to tuple (number of parameters, number of input nodes, instruction code)
@@ -17,12 +20,15 @@ class Node:
                 ("_return", 0, 1),
                 ("_store", 0, 1),
                 ("_load", 0, 1),
+                ("_instances_to", VARIABLE_COUNT, 1),
+                ("_instances_from", 0, 1),
                 # Unary nodes:
                 # 2D shapes:
                 ("rectangle", 2, 1),
                 ("circle", 1, 1),
                 ("regular_polygon2d", 2, 1),
                 ("polygon2d", VARIABLE_COUNT, 1),
+                ("polygon2d_bvh", VARIABLE_COUNT, 1),
                 # 3D shapes:
                 ("sphere", 1, 1),
                 ("half_space", 0, 1),
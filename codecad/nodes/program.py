@@ -1,3 +1,6 @@
+import hashlib
+import struct
+
 import numpy
 import pyopencl
 import pyopencl.cltypes
@@ -36,6 +39,37 @@ def get_shape_nodes(shape):
     return return_node
 
 
+def get_shape_hash(shape):
+    """ Return a hex digest identifying the geometry of a shape.
+
+    The digest is calculated from the node graph of the shape (node names,
+    parameters and dependencies), so it is stable across runs and two shapes
+    constructed the same way get the same hash. """
+    digests = {}
+
+    stack = [get_shape_nodes(shape)]
+    while stack:
+        n = stack[-1]
+        if id(n) in digests:
+            stack.pop()
+            continue
+        missing = [dep for dep in n.dependencies if id(dep) not in digests]
+        if missing:
+            stack.extend(missing)
+            continue
+        stack.pop()
+
+        h = hashlib.sha256()
+        h.update(n.name.encode("utf-8"))
+        h.update(struct.pack("<I", len(n.params)))
+        h.update(struct.pack("<{}d".format(len(n.params)), *n.params))
+        for dep in n.dependencies:
+            h.update(digests[id(dep)])
+        digests[id(n)] = h.digest()
+
+    return digests[id(n)].hex()
+
+
 def get_opcode(n):
     opcode = node.Node.node_types[n.name][2]
     if n.name == "_load":
@@ -59,9 +93,21 @@ def _make_program_pieces(shape):
 
     assert registers_needed <= opencl_manager.max_register_count
 
+    instancing_depth = 0
     for n in schedule:
         assert len(n.dependencies) <= 2
 
+        if n.name == "_instances_to":
+            instancing_depth += 1
+            if instancing_depth > node.MAX_INSTANCING_DEPTH:
+                raise ValueError(
+                    "Instances can only be nested {} levels deep".format(
+                        node.MAX_INSTANCING_DEPTH
+                    )
+                )
+        elif n.name == "_instances_from":
+            instancing_depth -= 1
+
         opcode, secondary_register = get_opcode(n)
         instruction = opcode * opencl_manager.max_register_count + secondary_register
 
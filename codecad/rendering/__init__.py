@@ -3,10 +3,16 @@ import os
 import argparse
 import importlib
 import re
+import io
+import contextlib
+import time
+import multiprocessing
 
 import flags
 import PIL.Image
 
+from . import cache
+
 
 class AssemblyMode(flags.Flags):
     """ Determining how assemblies are treated by the renderer """
@@ -20,6 +26,10 @@ class AssemblyMode(flags.Flags):
 def commandline_render(obj, default_renderer=None, **kwargs):
     """ Reads commandline arguments, chooses a renderer and passes the parameters to it. """
 
+    if _capture_hook is not None:
+        _capture_hook(obj)
+        return
+
     parser = argparse.ArgumentParser(description="Render an object")
     parser.add_argument(
         "--output",
@@ -45,6 +55,34 @@ def commandline_render(obj, default_renderer=None, **kwargs):
         dest="assembly_mode",
         help="Render all assembly parts from its BoM",
     )
+    parser.add_argument(
+        "--jobs",
+        "-j",
+        type=int,
+        default=1,
+        help="Number of processes used for rendering assembly parts.",
+    )
+    parser.add_argument(
+        "--cache",
+        metavar="DIR",
+        help="Directory with cached renders. "
+        "Outputs of shapes that were rendered before with the same parameters "
+        "are copied from the cache instead of rendering them again.",
+    )
+    parser.add_argument(
+        "--cache-size",
+        type=float,
+        metavar="MB",
+        help="Maximal size of the render cache, least recently used files "
+        "are removed when it is exceeded.",
+    )
+    parser.add_argument(
+        "--watch",
+        action="store_true",
+        help="Keep running and render the image again whenever the model script "
+        "changes. The script is executed again up to its commandline_render call, "
+        "which provides the new object. Camera position is kept between renders.",
+    )
 
     args = parser.parse_args()
 
@@ -71,21 +109,53 @@ def commandline_render(obj, default_renderer=None, **kwargs):
     else:
         assembly_mode = _renderers[renderer][2]
 
+    if args.watch:
+        _watch(obj, renderer, output, **kwargs)
+        return
+
+    if args.cache is not None and output is not None:
+        render_cache = cache.RenderCache(
+            args.cache,
+            None if args.cache_size is None else int(args.cache_size * 2 ** 20),
+        )
+    else:
+        render_cache = None
+
     if hasattr(obj, "bom"):
         if assembly_mode == AssemblyMode.parts:
             pattern = _parse_name_format(output)
-            for item in obj.bom(visible_only=True):
-                _render_one(renderer, item.shape(), item.name.join(pattern), **kwargs)
+            parts = [
+                (item.shape(), item.name.join(pattern))
+                for item in obj.bom(visible_only=True)
+            ]
+            _render_parts(renderer, parts, args.jobs, render_cache, **kwargs)
         elif assembly_mode == AssemblyMode.disabled:
             raise ValueError("Renderer {} does not allow assemblies".format(renderer))
+        elif assembly_mode == AssemblyMode.whole:
+            _render_parts(renderer, [(obj.shape(), output)], 1, render_cache, **kwargs)
         else:
-            if assembly_mode == AssemblyMode.whole:
-                obj = obj.shape()
-            elif assembly_mode == AssemblyMode.raw:
-                pass
             _render_one(renderer, obj, output, **kwargs)
     else:
-        _render_one(renderer, obj.shape(), output, **kwargs)
+        _render_parts(renderer, [(obj.shape(), output)], 1, render_cache, **kwargs)
+
+    if render_cache is not None:
+        print("Render cache: " + render_cache.stats())
+
+
+def _watch(obj, renderer, output, **kwargs):
+    """ Start watch mode for the main script that called commandline_render.
+    The object is rendered right away, the script is only executed again when
+    it changes. """
+    from . import watch
+
+    if renderer != "image":
+        raise ValueError("Watch mode only works with the image renderer")
+
+    path = getattr(sys.modules["__main__"], "__file__", None)
+    if path is None:
+        raise ValueError("Watch mode needs commandline_render called from a script")
+
+    watch.watch(path, output, obj=obj, **kwargs)
 
 
 def _render_one(renderer, shape, output, **kwargs):
@@ -97,6 +167,71 @@ def _render_one(renderer, shape, output, **kwargs):
     _renderers[renderer][0](shape, filename=output, **kwargs)
 
 
+def _render_parts(renderer, parts, jobs, render_cache=None, **kwargs):
+    """ Render a list of (shape, output) tuples, using a pool of `jobs` processes
+    if jobs > 1.
+    If render_cache is given, outputs are copied from it when possible and
+    newly rendered outputs are added to it. """
+    if render_cache is not None:
+        keys = {}
+        missing = []
+        for shape, output in parts:
+            key = render_cache.key(shape, renderer, output, **kwargs)
+            if render_cache.get(key, output):
+                print("Copied {} from render cache".format(output))
+            else:
+                keys[output] = key
+                missing.append((shape, output))
+
+        _render_parts(renderer, missing, jobs, **kwargs)
+
+        for output, key in keys.items():
+            render_cache.put(key, output)
+        return
+
+    if not parts:
+        return
+
+    if jobs <= 1:
+        for shape, output in parts:
+            _render_one(renderer, shape, output, **kwargs)
+        return
+
+    print(
+        "Rendering {} parts with renderer {} using {} processes".format(
+            len(parts), renderer, jobs
+        )
+    )
+
+    context = multiprocessing.get_context("spawn")
+    tasks = [(renderer, shape, output, kwargs) for shape, output in parts]
+    with context.Pool(jobs, initializer=_worker_init) as pool:
+        results = pool.imap_unordered(_worker_render, tasks)
+        for i, (output, elapsed) in enumerate(results):
+            print("[{}/{}] {} ({:0.2f} s)".format(i + 1, len(parts), output, elapsed))
+
+
+def _worker_init():
+    """ Initialize a worker process for _render_parts.
+    The OpenCL context is created when codecad is imported, so this only needs
+    to build the program once for all renders in this process. """
+    from ..cl_util import opencl_manager
+
+    with contextlib.redirect_stdout(io.StringIO()):
+        opencl_manager.get_program()
+
+
+def _worker_render(args):
+    """ Render a single part in a worker process, `args` is a tuple
+    (renderer, shape, output, kwargs).
+    Output of the renderer is suppressed, progress is reported by the parent. """
+    renderer, shape, output, kwargs = args
+    start = time.perf_counter()
+    with contextlib.redirect_stdout(io.StringIO()):
+        _renderers[renderer][0](shape, filename=output, **kwargs)
+    return output, time.perf_counter() - start
+
+
 def _parse_name_format(string):
     split = re.split(r"(?<!{){}|{}(?!})", string)
     if len(split) != 2:
@@ -128,13 +263,21 @@ def _register(name, module_name, extensions, assembly_mode, default_extension=No
 _renderers = {}
 _extensions = {}
 
+# Called with the object by commandline_render instead of rendering it,
+# used by watch mode to get the object from a reloaded script
+_capture_hook = None
+
 PIL.Image.init()
 
 _register("image", "image", PIL.Image.EXTENSION.keys(), AssemblyMode.whole, ".png")
 _register("stl", "stl_renderer", [".stl"], AssemblyMode.parts)
+_register("ply", "mesh_formats", [".ply"], AssemblyMode.parts)
+_register("obj", "mesh_formats", [".obj"], AssemblyMode.parts)
+_register("3mf", "mesh_formats", [".3mf"], AssemblyMode.parts)
 _register("slice", "matplotlib_slice", [], AssemblyMode.disabled)
 _register("mesh", "matplotlib_mesh", [], AssemblyMode.disabled)
-_register("svg", "svg", [".svg"], AssemblyMode.disabled)
+_register("svg", "polyline_formats", [".svg"], AssemblyMode.disabled)
+_register("dxf", "polyline_formats", [".dxf"], AssemblyMode.disabled)
 _register("nodes_graph", "schedule", [".dot"], AssemblyMode.disabled)
 _register("c_evaluator", "schedule", [".c"], AssemblyMode.disabled)
 _register("bom", "bom", [".csv"], AssemblyMode.raw)
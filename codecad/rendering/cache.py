@@ -0,0 +1,104 @@
+""" Content addressed cache of rendered files. """
+
+import hashlib
+import os
+import shutil
+
+from .. import nodes
+
+
+class RenderCache:
+    """ Directory of rendered files keyed by shape hash, renderer and its parameters.
+
+    Files are evicted in least recently used order once the total size of the
+    cache exceeds `max_size` bytes (None means unlimited). """
+
+    def __init__(self, directory, max_size=None):
+        self.directory = directory
+        self.max_size = max_size
+
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+        os.makedirs(directory, exist_ok=True)
+
+    @staticmethod
+    def key(shape, renderer, output, **kwargs):
+        """ Return cache key for rendering shape with given renderer into output
+        file name and renderer parameters. """
+        h = hashlib.sha256()
+        h.update(nodes.get_shape_hash(shape).encode("ascii"))
+        h.update(
+            repr(
+                (
+                    renderer,
+                    os.path.splitext(output)[1].lower(),
+                    repr(shape.feature_size()),  # Determines mesh resolution
+                    sorted(kwargs.items()),
+                )
+            ).encode("utf-8")
+        )
+        return h.hexdigest()
+
+    def _path(self, key):
+        return os.path.join(self.directory, key)
+
+    def get(self, key, output):
+        """ Copy a cached file to output.
+        Returns True on cache hit, False otherwise. """
+        path = self._path(key)
+        try:
+            shutil.copyfile(path, output)
+        except FileNotFoundError:
+            self.misses += 1
+            return False
+
+        os.utime(path)  # Mark as recently used
+        self.hits += 1
+        return True
+
+    def put(self, key, output):
+        """ Store a rendered file in the cache and evict old entries if necessary """
+        path = self._path(key)
+        tmp_path = path + ".tmp"
+        shutil.copyfile(output, tmp_path)
+        os.replace(tmp_path, path)
+
+        self.evict()
+
+    def entries(self):
+        """ Return list of (path, size, mtime) of all cached files,
+        least recently used first. """
+        ret = []
+        with os.scandir(self.directory) as it:
+            for entry in it:
+                if not entry.is_file() or entry.name.endswith(".tmp"):
+                    continue
+                stat = entry.stat()
+                ret.append((entry.path, stat.st_size, stat.st_mtime))
+        ret.sort(key=lambda x: x[2])
+        return ret
+
+    def size(self):
+        """ Total size of cached files in bytes """
+        return sum(size for _, size, _ in self.entries())
+
+    def evict(self):
+        """ Remove least recently used entries until the cache fits into max_size """
+        if self.max_size is None:
+            return
+
+        entries = self.entries()
+        total = sum(size for _, size, _ in entries)
+        for path, size, _ in entries:
+            if total <= self.max_size:
+                break
+            os.remove(path)
+            total -= size
+            self.evictions += 1
+
+    def stats(self):
+        return "{} hits, {} misses, {} evicted, {:0.1f} MB cached".format(
+            self.hits, self.misses, self.evictions, self.size() / 2 ** 20
+        )
@@ -0,0 +1,569 @@
+""" Adaptive dual contouring mesher.
+
+Every grid cell that the surface passes through gets a single vertex and every
+grid edge crossing the surface produces a quad connecting the four cells
+around it.
+Cells where the surface is flat are clustered in an octree-like fashion
+(2x2x2 clusters form a cluster of the next level) and share one vertex,
+so the triangle count follows the surface complexity rather than its size.
+
+Vertex of each cluster minimizes the quadratic error function (QEF) of
+distances to tangent planes at the edge crossings, which reproduces sharp
+edges and corners. QEF is stored as the sums A^T A and A^T b so that merging
+clusters is just addition.
+
+Cells containing more than one sheet of the surface still get only a single
+vertex, so the mesh may be non-manifold there. """
+
+import numpy
+import pyopencl
+
+from .. import subdivision
+from .. import util
+from ..cl_util import opencl_manager
+from . import mesh
+
+# Offsets of the four cells around an edge along axis `a`, in axes
+# (a + 1) % 3, (a + 2) % 3, counter clockwise when looking against the axis
+_EDGE_CELL_OFFSETS = [(-1, -1), (0, -1), (0, 0), (-1, 0)]
+
+# Columns of per cell data
+_COUNT = 0
+_POSITION = slice(1, 4)
+_NORMAL = slice(4, 7)
+_ATA = slice(7, 13)  # Upper triangle of the symmetric matrix, row by row
+_ATB = slice(13, 16)
+_DATA_SIZE = 16
+
+_ATA_INDICES = [(0, 0), (0, 1), (0, 2), (1, 1), (1, 2), (2, 2)]
+
+# Bits per axis of cell coordinates packed by _pack
+_COORD_BITS = 21
+
+# Singular values of A^T A smaller than this fraction of the largest one are
+# ignored when solving the QEF
+QEF_SINGULAR_VALUE_THRESHOLD = 0.1
+
+
+def _corners_connected(corners):
+    """ Return True if all corners in a set are connected by cube edges. """
+    corners = set(corners)
+    if not corners:
+        return True
+    stack = [corners.pop()]
+    while stack:
+        corner = stack.pop()
+        for axis in range(3):
+            neighbor = corner ^ (1 << axis)
+            if neighbor in corners:
+                corners.remove(neighbor)
+                stack.append(neighbor)
+    return not corners
+
+
+# Cube corner configurations (bit per inside corner) where both inside and
+# outside corners are connected, ie. the surface within the cube is a single sheet
+_MANIFOLD_CONFIGS = numpy.array(
+    [
+        _corners_connected(c for c in range(8) if config & (1 << c))
+        and _corners_connected(c for c in range(8) if not config & (1 << c))
+        for config in range(256)
+    ]
+)
+
+
+def _topology_safe(inside, coords, level):
+    """ Return mask of cells at given level (with coordinates of their lowest
+    corner `coords << level`), that can be collapsed into a single vertex
+    without changing topology of the surface.
+
+    This is the test from Ju et al.: Dual contouring of hermite data:
+    Sign of the cell's middle, centers of its faces and of its edges must each
+    agree with at least one of the corresponding cell corners. Additionally
+    the corner configuration must be manifold. """
+    half = 1 << (level - 1)
+    samples = coords[:, numpy.newaxis, :] * (2 * half) + half * numpy.array(
+        [(i, j, k) for i in range(3) for j in range(3) for k in range(3)]
+    )
+    in_block = numpy.all(samples[:, -1] < inside.shape, axis=1)
+    samples = samples[in_block]
+    signs = numpy.zeros((len(coords), 3, 3, 3), dtype=bool)
+    signs[in_block] = inside[tuple(samples.transpose(2, 0, 1))].reshape(-1, 3, 3, 3)
+
+    config = numpy.zeros(len(coords), dtype=numpy.uint8)
+    for c in range(8):
+        i, j, k = (2 * ((c >> axis) & 1) for axis in range(3))
+        config |= signs[:, i, j, k].astype(numpy.uint8) << c
+    safe = in_block & _MANIFOLD_CONFIGS[config]
+
+    for i in range(3):
+        for j in range(3):
+            for k in range(3):
+                if i != 1 and j != 1 and k != 1:
+                    continue  # Corner
+                corner_signs = signs[
+                    :,
+                    slice(0, 3, 2) if i == 1 else i,
+                    slice(0, 3, 2) if j == 1 else j,
+                    slice(0, 3, 2) if k == 1 else k,
+                ].reshape(len(coords), -1)
+                safe &= numpy.any(
+                    corner_signs == signs[:, i, j, k, numpy.newaxis], axis=1
+                )
+
+    return safe
+
+
+def _pack(coords):
+    """ Pack block local non-negative integer coordinates (each < 2**_COORD_BITS)
+    into a single 64bit integer """
+    coords = coords.astype(numpy.int64)
+    return (
+        (coords[:, 0] << (2 * _COORD_BITS))
+        | (coords[:, 1] << _COORD_BITS)
+        | coords[:, 2]
+    )
+
+
+def _unpack(packed):
+    """ Inverse of _pack """
+    mask = (1 << _COORD_BITS) - 1
+    return numpy.stack(
+        [
+            (packed >> (2 * _COORD_BITS)) & mask,
+            (packed >> _COORD_BITS) & mask,
+            packed & mask,
+        ],
+        axis=1,
+    )
+
+
+def _cell_data(positions, normals):
+    """ Per crossing data that is summed over cells and clusters. """
+    data = numpy.empty((len(positions), _DATA_SIZE))
+    data[:, _COUNT] = 1
+    data[:, _POSITION] = positions
+    data[:, _NORMAL] = normals
+
+    plane_offsets = numpy.einsum("ij,ij->i", normals, positions)
+    data[:, _ATA] = numpy.stack(
+        [normals[:, i] * normals[:, j] for i, j in _ATA_INDICES], axis=1
+    )
+    data[:, _ATB] = normals * plane_offsets[:, numpy.newaxis]
+    return data
+
+
+def _sum_by_index(data, index, count):
+    """ Sum rows of data with the same index. """
+    return numpy.stack(
+        [numpy.bincount(index, weights=column, minlength=count) for column in data.T],
+        axis=1,
+    )
+
+
+def _is_flat(data, min_normal_alignment):
+    """ Return mask of clusters whose normals are all close to their average. """
+    normal_sum_length = numpy.linalg.norm(data[:, _NORMAL], axis=1)
+    return normal_sum_length >= min_normal_alignment * data[:, _COUNT]
+
+
+def _vertex_positions(data, bounds_min, bounds_max):
+    """ Calculate vertex positions for clusters from their summed data by
+    minimizing the QEF, clamped to cluster bounds.
+
+    Directions in which the QEF is (nearly) constant are resolved towards
+    the mass point of the edge crossings. """
+    mass_points = data[:, _POSITION] / data[:, _COUNT, numpy.newaxis]
+
+    ata = numpy.empty((len(data), 3, 3))
+    for column, (i, j) in enumerate(_ATA_INDICES):
+        ata[:, i, j] = ata[:, j, i] = data[:, _ATA.start + column]
+
+    eigenvalues, eigenvectors = numpy.linalg.eigh(ata)
+    threshold = QEF_SINGULAR_VALUE_THRESHOLD * eigenvalues[:, -1:]
+    inverse_eigenvalues = numpy.zeros_like(eigenvalues)
+    numpy.divide(1, eigenvalues, out=inverse_eigenvalues, where=eigenvalues > threshold)
+
+    residual = data[:, _ATB] - numpy.einsum("kij,kj->ki", ata, mass_points)
+    delta = numpy.einsum(
+        "kij,kj,kj->ki",
+        eigenvectors,
+        inverse_eigenvalues,
+        numpy.einsum("kji,kj->ki", eigenvectors, residual),
+    )
+
+    return numpy.clip(mass_points + delta, bounds_min, bounds_max)
+
+
+class _BlockResult:
+    """ Dual contouring data of a single block in block local coordinates """
+
+    def __init__(
+        self, vertices, cell_coords, cell_vertices, edge_starts, edge_axes, edge_flipped
+    ):
+        self.vertices = vertices
+        self.cell_coords = cell_coords
+        self.cell_vertices = cell_vertices
+        self.edge_starts = edge_starts
+        self.edge_axes = edge_axes
+        self.edge_flipped = edge_flipped
+
+
+class _DualContouringExtractor:
+    """ Evaluates blocks on the device and contours them on the host.
+    Has the same start_block / finish_block interface as
+    marching_cubes.MarchingCubes. """
+
+    def __init__(self, program_buffer, max_block_size, min_normal_alignment, max_level):
+        assert all(
+            s <= 2 ** _COORD_BITS for s in max_block_size
+        ), "Block is too large for packed cell coordinates"
+
+        self.program_buffer = program_buffer
+        self.min_normal_alignment = min_normal_alignment
+        self.max_level = max_level
+        self.block_buffer = pyopencl.Buffer(
+            opencl_manager.context,
+            pyopencl.mem_flags.WRITE_ONLY,
+            int(numpy.prod(max_block_size)) * 4 * 4,
+        )
+
+    def start_block(self, box_size, box_corner, box_resolution):
+        ev = opencl_manager.k.grid_eval(
+            box_size,
+            None,
+            self.program_buffer,
+            box_corner.as_float4(),
+            numpy.float32(box_resolution),
+            self.block_buffer,
+        )
+        values = numpy.empty(tuple(box_size) + (4,), dtype=numpy.float32)
+        ev = pyopencl.enqueue_copy(
+            opencl_manager.queue,
+            values,
+            self.block_buffer,
+            wait_for=[ev],
+            is_blocking=False,
+        )
+        return values, box_corner, box_resolution, ev
+
+    def _evaluate_points(self, points):
+        """ Evaluate the shape at given points, blocks until the result is ready. """
+        points = numpy.ascontiguousarray(points, dtype=numpy.float32)
+        output = numpy.empty((len(points), 4), dtype=numpy.float32)
+        mf = pyopencl.mem_flags
+        points_buffer = pyopencl.Buffer(
+            opencl_manager.context, mf.READ_ONLY | mf.COPY_HOST_PTR, hostbuf=points
+        )
+        output_buffer = pyopencl.Buffer(
+            opencl_manager.context, mf.WRITE_ONLY, output.nbytes
+        )
+        ev = opencl_manager.k.points_eval(
+            (len(points),), None, self.program_buffer, points_buffer, output_buffer
+        )
+        pyopencl.enqueue_copy(
+            opencl_manager.queue, output, output_buffer, wait_for=[ev]
+        )
+        return output
+
+    def finish_block(self, started):
+        values, box_corner, box_resolution, ev = started
+        ev.wait()
+
+        distances = values[..., 3]
+        inside = distances < 0
+        cell_shape = numpy.array(inside.shape) - 1
+        corner = numpy.array(box_corner)
+
+        edge_starts = []
+        edge_axes = []
+        positions = []
+
+        for axis in range(3):
+            offset = numpy.zeros(3, dtype=numpy.int64)
+            offset[axis] = 1
+
+            lower = [slice(None)] * 3
+            upper = [slice(None)] * 3
+            lower[axis] = slice(None, -1)
+            upper[axis] = slice(1, None)
+            crossing = inside[tuple(lower)] != inside[tuple(upper)]
+
+            starts = numpy.argwhere(crossing)
+            d0 = distances[tuple(starts.T)]
+            d1 = distances[tuple((starts + offset).T)]
+            t = (d0 / (d0 - d1))[:, numpy.newaxis]
+
+            edge_starts.append(starts)
+            edge_axes.append(numpy.full(len(starts), axis))
+            positions.append(corner + box_resolution * (starts + t * offset))
+
+        edge_starts = numpy.concatenate(edge_starts)
+        if not len(edge_starts):
+            return None
+        edge_axes = numpy.concatenate(edge_axes)
+        positions = numpy.concatenate(positions)
+
+        # Normals interpolated from the grid would be wrong around sharp edges,
+        # evaluate them directly at the crossings instead.
+        # Linear interpolation doesn't put the crossings exactly on the surface,
+        # so we also move them along the normal by the evaluated distance.
+        evaluated = self._evaluate_points(positions).astype(numpy.float64)
+        normals = evaluated[:, :3]
+        normals /= numpy.linalg.norm(normals, axis=1, keepdims=True)
+        positions -= evaluated[:, 3:] * normals
+        data = _cell_data(positions, normals)
+
+        # Every crossing contributes to the four cells around its edge
+        crossing_cells = []
+        crossing_data = []
+        edge_index = numpy.arange(len(edge_starts))
+        u = (edge_axes + 1) % 3
+        v = (edge_axes + 2) % 3
+        for du, dv in _EDGE_CELL_OFFSETS:
+            cells = edge_starts.copy()
+            cells[edge_index, u] += du
+            cells[edge_index, v] += dv
+            valid = numpy.all((cells >= 0) & (cells < cell_shape), axis=1)
+            crossing_cells.append(cells[valid])
+            crossing_data.append(data[valid])
+
+        crossing_cells = numpy.concatenate(crossing_cells)
+        packed, crossing_cell_index = numpy.unique(
+            _pack(crossing_cells), return_inverse=True
+        )
+        crossing_cell_index = crossing_cell_index.ravel()
+        cell_coords = _unpack(packed)
+        cell_data = _sum_by_index(
+            numpy.concatenate(crossing_data), crossing_cell_index, len(packed)
+        )
+
+        cluster_data, cluster_min, cluster_max, cell_vertices = self._cluster(
+            inside, cell_coords, cell_data
+        )
+
+        return _BlockResult(
+            _vertex_positions(
+                cluster_data,
+                corner + box_resolution * cluster_min,
+                corner + box_resolution * cluster_max,
+            ),
+            cell_coords,
+            cell_vertices,
+            edge_starts,
+            edge_axes,
+            # Quads are oriented for edges going from inside to outside
+            ~inside[tuple(edge_starts.T)],
+        )
+
+    def _cluster(self, inside, cell_coords, cell_data):
+        """ Bottom up clustering of cells.
+        Returns tuple (data of final clusters, their lower and upper bounds
+        in cell units, index of final cluster for every cell). """
+        cell_count = len(cell_coords)
+
+        # Clusters that may still be merged, coordinates are on the current level
+        live_coords = cell_coords
+        live_data = cell_data
+        cell_live_cluster = numpy.arange(cell_count)  # -1 for finalized cells
+
+        final_data = []
+        final_min = []
+        final_max = []
+        final_count = 0
+        cell_final_cluster = numpy.full(cell_count, -1)
+
+        def finalize(mask, level):
+            """ Move live clusters on given level selected by mask to the final ones """
+            nonlocal live_coords, live_data, final_count
+            count = numpy.count_nonzero(mask)
+
+            new_final = numpy.full(len(mask), -1)
+            new_final[mask] = numpy.arange(final_count, final_count + count)
+            new_live = numpy.full(len(mask), -1)
+            new_live[~mask] = numpy.arange(len(mask) - count)
+
+            live_cells = cell_live_cluster >= 0
+            cluster = cell_live_cluster[live_cells]
+            cell_final_cluster[live_cells] = new_final[cluster]
+            cell_live_cluster[live_cells] = new_live[cluster]
+
+            final_data.append(live_data[mask])
+            final_min.append(live_coords[mask] << level)
+            final_max.append((live_coords[mask] + 1) << level)
+            final_count += count
+            live_coords = live_coords[~mask]
+            live_data = live_data[~mask]
+
+        # Cells that are not flat don't merge at all
+        finalize(~_is_flat(live_data, self.min_normal_alignment), 0)
+        live_level = 0
+
+        for level in range(1, self.max_level + 1):
+            if not len(live_data):
+                break
+
+            parents, parent_index = numpy.unique(
+                _pack(live_coords >> 1), return_inverse=True
+            )
+            parent_index = parent_index.ravel()
+            parent_data = _sum_by_index(live_data, parent_index, len(parents))
+
+            # Parents containing a finalized cell can't be merged
+            blocked = numpy.unique(
+                _pack(cell_coords[cell_final_cluster >= 0] >> level)
+            )
+            parent_coords = _unpack(parents)
+            mergeable = (
+                _is_flat(parent_data, self.min_normal_alignment)
+                & ~numpy.isin(parents, blocked)
+                & _topology_safe(inside, parent_coords, level)
+            )
+
+            merged = mergeable[parent_index]
+            finalize(~merged, live_level)
+
+            new_parent_index = numpy.full(len(parents), -1)
+            new_parent_index[mergeable] = numpy.arange(numpy.count_nonzero(mergeable))
+            live_cells = cell_live_cluster >= 0
+            cell_live_cluster[live_cells] = new_parent_index[
+                parent_index[merged][cell_live_cluster[live_cells]]
+            ]
+            live_coords = parent_coords[mergeable]
+            live_data = parent_data[mergeable]
+            live_level = level
+
+        finalize(numpy.ones(len(live_data), dtype=bool), live_level)
+
+        return (
+            numpy.concatenate(final_data),
+            numpy.concatenate(final_min),
+            numpy.concatenate(final_max),
+            cell_final_cluster,
+        )
+
+
+def dual_contouring_mesh(
+    obj,
+    resolution=None,
+    min_normal_alignment=0.995,
+    max_level=5,
+    subdivision_grid_size=None,
+    blocks_in_flight=4,
+):
+    """ Generate an adaptive indexed triangle mesh representing a surface of 3D shape.
+
+    `resolution` is the size of the finest cells (defaults to half of feature size),
+    cells are merged up to `max_level` times (into cells of size
+    `resolution * 2**max_level`) while the normals in them stay aligned,
+    `min_normal_alignment` is the minimal length of the average normal.
+    Clusters never cross subdivision block boundaries, so `subdivision_grid_size`
+    should be `2**k + 1` with k >= `max_level`. The default is the smallest such
+    size, but at least 65 and at most 129 (larger grids are not supported by
+    subdivision).
+    Returns mesh.IndexedMesh. """
+    obj.check_dimension(required=3)
+
+    if resolution is None:
+        resolution = obj.feature_size() / 2
+    if subdivision_grid_size is None:
+        subdivision_grid_size = min(max(64, 2 ** max_level), 128) + 1
+
+    program_buffer, max_box_size, boxes = subdivision.subdivision(
+        obj, resolution, grid_size=subdivision_grid_size
+    )
+
+    if len(boxes) == 1:
+        # A single block doesn't have any neighbors, so we can pad it to allow
+        # clusters of all levels.
+        box_size, *rest = boxes[0]
+        box_size = util.Vector(
+            *(util.round_up_to(s - 1, 2 ** max_level) + 1 for s in box_size)
+        )
+        boxes = [(box_size,) + tuple(rest)]
+        max_box_size = box_size
+    extractors = [
+        _DualContouringExtractor(
+            program_buffer, max_box_size, min_normal_alignment, max_level
+        )
+        for _ in range(blocks_in_flight)
+    ]
+
+    vertices = []
+    cell_coords = []
+    cell_vertices = []
+    edge_starts = []
+    edge_axes = []
+    edge_flipped = []
+    vertex_count = 0
+
+    for box, result in mesh.pipelined(extractors, boxes):
+        if result is None:
+            continue
+        _, _, _, int_corner, int_spacing = box
+        int_corner = numpy.array(int_corner, dtype=numpy.int64)
+
+        vertices.append(result.vertices)
+        cell_coords.append(result.cell_coords * int_spacing + int_corner)
+        cell_vertices.append(result.cell_vertices + vertex_count)
+        edge_starts.append(result.edge_starts * int_spacing + int_corner)
+        edge_axes.append(result.edge_axes)
+        edge_flipped.append(result.edge_flipped)
+        vertex_count += len(result.vertices)
+
+    if not vertex_count:
+        return mesh.IndexedMesh(
+            numpy.empty((0, 3), dtype=numpy.float32),
+            numpy.empty((0, 3), dtype=numpy.uint32),
+        )
+
+    vertices = numpy.concatenate(vertices)
+    cell_coords = numpy.concatenate(cell_coords)
+    cell_vertices = numpy.concatenate(cell_vertices)
+    edge_starts = numpy.concatenate(edge_starts)
+    edge_axes = numpy.concatenate(edge_axes)
+    edge_flipped = numpy.concatenate(edge_flipped)
+
+    # Edges on block boundaries are processed by both blocks
+    coord_range = numpy.maximum(cell_coords.max(axis=0), edge_starts.max(axis=0)) + 2
+    edge_keys = numpy.ravel_multi_index(edge_starts.T, coord_range) * 3 + edge_axes
+    _, unique_edges = numpy.unique(edge_keys, return_index=True)
+    edge_starts = edge_starts[unique_edges]
+    edge_axes = edge_axes[unique_edges]
+    edge_flipped = edge_flipped[unique_edges]
+
+    # Find vertices of the four cells around each edge (every cell belongs
+    # to exactly one block), offset by one to avoid negative coordinates
+    cell_keys = numpy.ravel_multi_index((cell_coords + 1).T, coord_range)
+    cell_order = numpy.argsort(cell_keys)
+    sorted_cell_keys = cell_keys[cell_order]
+
+    quads = numpy.empty((len(edge_starts), 4), dtype=numpy.int64)
+    u = (edge_axes + 1) % 3
+    v = (edge_axes + 2) % 3
+    valid = numpy.ones(len(edge_starts), dtype=bool)
+    for i, (du, dv) in enumerate(_EDGE_CELL_OFFSETS):
+        cells = edge_starts + 1
+        cells[numpy.arange(len(cells)), u] += du
+        cells[numpy.arange(len(cells)), v] += dv
+        keys = numpy.ravel_multi_index(cells.T, coord_range)
+        positions = numpy.minimum(
+            numpy.searchsorted(sorted_cell_keys, keys), len(sorted_cell_keys) - 1
+        )
+        valid &= sorted_cell_keys[positions] == keys
+        quads[:, i] = cell_vertices[cell_order[positions]]
+
+    quads = quads[valid]
+    quads[edge_flipped[valid]] = quads[edge_flipped[valid]][:, ::-1]
+
+    triangles = numpy.concatenate([quads[:, [0, 1, 2]], quads[:, [0, 2, 3]]])
+    degenerate = (
+        (triangles[:, 0] == triangles[:, 1])
+        | (triangles[:, 1] == triangles[:, 2])
+        | (triangles[:, 2] == triangles[:, 0])
+    )
+    triangles = triangles[~degenerate]
+
+    return mesh.IndexedMesh(
+        vertices.astype(numpy.float32), triangles.astype(numpy.uint32)
+    )
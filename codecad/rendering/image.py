@@ -3,18 +3,35 @@ import PIL
 from . import ray_caster
 from . import bitmap
 
+# Jittered samples per axis in edge pixels of 3D renders,
+# see ray_caster.render
+DEFAULT_ANTIALIASING = 3
+
+
+def render_pil_image(obj, size=(1024, 768), view_angle=None, antialiasing=None):
+    if antialiasing is None:
+        antialiasing = DEFAULT_ANTIALIASING
 
-def render_pil_image(obj, size=(1024, 768), view_angle=None):
     if obj.dimension() == 2:
         pixels = bitmap.render(obj, size)
     else:
         camera_params = ray_caster.get_camera_params(
             obj.bounding_box(), size, view_angle
         )
-        pixels = ray_caster.render(obj, size=size, *camera_params)
+        pixels = ray_caster.render(
+            obj, size=size, *camera_params, antialiasing=antialiasing
+        )
 
     return PIL.Image.fromarray(pixels)
 
 
-def render_image(obj, filename, size=(1024, 768), view_angle=None):
-    render_pil_image(obj, size, view_angle).save(filename)
+def render_image(obj, filename, size=(1024, 768), view_angle=None, antialiasing=None):
+    render_pil_image(obj, size, view_angle, antialiasing).save(filename)
+
+
+def render_images(obj, filename, cameras, size=(1024, 768)):
+    """ Render a 3D object from each of the cameras into numbered image files.
+    `filename` is formatted with the frame number, for example "frame_{:03}.png".
+    See ray_caster.render_views for details. """
+    for i, pixels in enumerate(ray_caster.render_views(obj, cameras, size)):
+        PIL.Image.fromarray(pixels).save(filename.format(i))
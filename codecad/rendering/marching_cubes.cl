@@ -0,0 +1,121 @@
+// Tables and MARCHING_CUBES_MAX_TRIANGLES are generated in marching_cubes.py
+
+static uint3 corner_offset(uint corner)
+{
+    return (uint3)(corner & 1, (corner >> 1) & 1, (corner >> 2) & 1);
+}
+
+static uint3 axis_offset(uint axis)
+{
+    return (uint3)(axis == 0, axis == 1, axis == 2);
+}
+
+static bool is_inside(float value)
+{
+    return value < 0;
+}
+
+/** Returns true if the edge from `coords` along axis crosses the surface. */
+static bool edge_crosses(__global const float* values, uint3 size, uint3 coords, uint axis)
+{
+    uint3 other = coords + axis_offset(axis);
+    if (any(other >= size))
+        return false;
+    return is_inside(values[INDEX3(size.x, size.y, size.z, coords.x, coords.y, coords.z)]) !=
+           is_inside(values[INDEX3(size.x, size.y, size.z, other.x, other.y, other.z)]);
+}
+
+static uint cube_index(__global const float* values, uint3 size, uint3 coords)
+{
+    uint ret = 0;
+    for (uint corner = 0; corner < 8; ++corner)
+    {
+        uint3 c = coords + corner_offset(corner);
+        if (is_inside(values[INDEX3(size.x, size.y, size.z, c.x, c.y, c.z)]))
+            ret |= 1 << corner;
+    }
+    return ret;
+}
+
+/** For every grid point count the surface crossings on edges starting at this
+ * point (positive directions only) and triangles of the cell that has this point
+ * as the lowest corner. */
+__kernel void marching_cubes_count(__global const float* values,
+                                   __global uint* vertexCounts,
+                                   __global uint* triangleCounts)
+{
+    uint3 coords = (uint3)(get_global_id(0),
+                           get_global_id(1),
+                           get_global_id(2));
+    uint3 size = (uint3)(get_global_size(0),
+                         get_global_size(1),
+                         get_global_size(2));
+
+    uint vertexCount = 0;
+    for (uint axis = 0; axis < 3; ++axis)
+        vertexCount += edge_crosses(values, size, coords, axis);
+    vertexCounts[INDEX3_GG] = vertexCount;
+
+    if (all(coords + 1 < size))
+        triangleCounts[INDEX3_GG] = marchingCubesTriangleCounts[cube_index(values, size, coords)];
+    else
+        triangleCounts[INDEX3_GG] = 0;
+}
+
+/** Write vertices and triangles to offsets calculated from counts by prefix sum.
+ * Vertices of each grid point are stored in order of their axis.
+ * For every vertex also store a key identifying its edge within the block
+ * (3 * index of the starting grid point + axis). */
+__kernel void marching_cubes_generate(__global const float* values,
+                                      float4 boxCorner, float boxStep,
+                                      __global const uint* vertexOffsets,
+                                      __global const uint* triangleOffsets,
+                                      __global float* vertices,
+                                      __global uint* vertexKeys,
+                                      __global uint* triangles)
+{
+    uint3 coords = (uint3)(get_global_id(0),
+                           get_global_id(1),
+                           get_global_id(2));
+    uint3 size = (uint3)(get_global_size(0),
+                         get_global_size(1),
+                         get_global_size(2));
+
+    uint vertexIndex = vertexOffsets[INDEX3_GG];
+    float value = values[INDEX3_GG];
+    for (uint axis = 0; axis < 3; ++axis)
+    {
+        if (!edge_crosses(values, size, coords, axis))
+            continue;
+
+        uint3 other = coords + axis_offset(axis);
+        float otherValue = values[INDEX3(size.x, size.y, size.z, other.x, other.y, other.z)];
+        float t = value / (value - otherValue);
+
+        float3 position = convert_float3(coords) + t * convert_float3(axis_offset(axis));
+        vstore3(as_float3(boxCorner) + boxStep * position, vertexIndex, vertices);
+        vertexKeys[vertexIndex] = 3 * INDEX3_GG + axis;
+        ++vertexIndex;
+    }
+
+    if (any(coords + 1 >= size))
+        return;
+
+    uint index = cube_index(values, size, coords);
+    uint triangleIndex = triangleOffsets[INDEX3_GG];
+    for (uint i = 0; i < 3 * marchingCubesTriangleCounts[index]; ++i)
+    {
+        uint edge = marchingCubesTriangles[index * 3 * MARCHING_CUBES_MAX_TRIANGLES + i];
+        uint axis = edge / 4;
+        uint3 owner = coords + corner_offset(marchingCubesEdgeStarts[edge]);
+
+        // Vertex index of the owner point, plus vertices on preceding axes
+        uint vertex = vertexOffsets[INDEX3(size.x, size.y, size.z, owner.x, owner.y, owner.z)];
+        for (uint j = 0; j < axis; ++j)
+            vertex += edge_crosses(values, size, owner, j);
+
+        triangles[3 * triangleIndex + i] = vertex;
+    }
+}
+
+// vim: filetype=c
@@ -0,0 +1,304 @@
+""" Marching cubes surface extraction running in OpenCL.
+
+The triangle tables are generated when this module is imported rather than
+copied from the usual sources:
+Intersection of the surface with every face of a cube is a set of oriented
+segments between edge crossings, on faces with two inside corners on a diagonal
+the inside corners are always kept separated.
+The segments are chained into loops and each loop is triangulated as a fan.
+Because the face rule only depends on the four corners of the face, triangulations
+of neighboring cells always match and the resulting mesh is watertight. """
+
+import numpy
+import pyopencl
+
+from .. import cl_util
+from ..cl_util import opencl_manager
+
+# Corner `c` of a cell has offset (c & 1, (c >> 1) & 1, (c >> 2) & 1).
+# Edge `e` goes from corner EDGES[e][0] in direction of axis `e // 4`.
+EDGES = [
+    (a, a | (1 << axis))
+    for axis in range(3)
+    for a in range(8)
+    if not a & (1 << axis)
+]
+
+
+def _corner_offset(corner):
+    return (corner & 1, (corner >> 1) & 1, (corner >> 2) & 1)
+
+
+def _faces():
+    """ Yield lists of four corners of each cube face, counter clockwise when viewed
+    from outside of the cube. """
+    for axis in range(3):
+        u = (axis + 1) % 3
+        v = (axis + 2) % 3
+        for side in range(2):
+            ccw = [(0, 0), (1, 0), (1, 1), (0, 1)]
+            if not side:
+                # Viewed from the negative side, the orientation flips
+                ccw = [(b, a) for a, b in ccw]
+            yield [
+                (side << axis) | (a << u) | (b << v) for a, b in ccw
+            ]
+
+
+def _edge_index(a, b):
+    try:
+        return EDGES.index((a, b))
+    except ValueError:
+        return EDGES.index((b, a))
+
+
+def _cell_triangles(cube_index):
+    """ Return list of triangles (triplets of edge indices) for a cell with given
+    inside corners bitmap.
+    Triangles are oriented counter clockwise when viewed from outside of the body. """
+
+    def inside(corner):
+        return bool(cube_index & (1 << corner))
+
+    following = {}
+    for face in _faces():
+        entries = []
+        exits = []
+        for i in range(4):
+            a = face[i]
+            b = face[(i + 1) % 4]
+            if inside(a) == inside(b):
+                continue
+            if inside(b):
+                entries.append(i)
+            else:
+                exits.append(i)
+
+        for entry in entries:
+            # Pair the entry with the next exit in ccw direction, this keeps
+            # inside corners separated on ambiguous faces.
+            exit = min(exits, key=lambda x, entry=entry: (x - entry) % 4)
+            following[
+                _edge_index(face[entry], face[(entry + 1) % 4])
+            ] = _edge_index(face[exit], face[(exit + 1) % 4])
+
+    triangles = []
+    while following:
+        start, current = following.popitem()
+        loop = [start, current]
+        while True:
+            current = following.pop(current)
+            if current == start:
+                break
+            loop.append(current)
+
+        for i in range(1, len(loop) - 1):
+            triangles.append((loop[0], loop[i], loop[i + 1]))
+
+    return triangles
+
+
+def _generate_tables():
+    triangles = [_cell_triangles(i) for i in range(256)]
+    max_triangles = max(len(t) for t in triangles)
+    return triangles, max_triangles
+
+
+def _format_c_array(name, c_type, values):
+    """ Format a constant array definition as a single line of C code.
+    (Multi line strings would break the #line directives of compile unit.) """
+    return "__constant {} {}[{}] = {{{}}};".format(
+        c_type, name, len(values), ", ".join(str(v) for v in values)
+    )
+
+
+_triangle_table, MAX_CELL_TRIANGLES = _generate_tables()
+
+_c_file = opencl_manager.add_compile_unit()
+_c_file.append_define("MARCHING_CUBES_MAX_TRIANGLES", MAX_CELL_TRIANGLES)
+_c_file.append(
+    _format_c_array("marchingCubesEdgeStarts", "uchar", [a for a, b in EDGES])
+)
+_c_file.append(
+    _format_c_array(
+        "marchingCubesTriangleCounts", "uchar", [len(t) for t in _triangle_table]
+    )
+)
+_c_file.append(
+    _format_c_array(
+        "marchingCubesTriangles",
+        "uchar",
+        [
+            e
+            for triangles in _triangle_table
+            for e in list(sum(triangles, ()))
+            + [0] * 3 * (MAX_CELL_TRIANGLES - len(triangles))
+        ],
+    )
+)
+_c_file.append_resource("marching_cubes.cl")
+
+
+class MarchingCubes:
+    """ Extracts triangle meshes from blocks of the distance field on the device.
+
+    Only the compacted vertex and triangle arrays are transferred to the host.
+    Buffers are allocated for blocks of at most `max_block_size` samples
+    and reused between blocks.
+
+    If `refine_iterations` is nonzero, vertices are projected onto the surface
+    with that many Newton steps before being read. """
+
+    def __init__(self, program_buffer, max_block_size, refine_iterations=0):
+        self.program_buffer = program_buffer
+        self.refine_iterations = refine_iterations
+        self.max_point_count = int(numpy.prod(max_block_size))
+
+        mf = pyopencl.mem_flags
+        self.values = cl_util.Buffer(numpy.float32, self.max_point_count, mf.READ_WRITE)
+        self.vertex_offsets = cl_util.Buffer(
+            numpy.uint32, self.max_point_count, mf.READ_WRITE
+        )
+        self.triangle_offsets = cl_util.Buffer(
+            numpy.uint32, self.max_point_count, mf.READ_WRITE
+        )
+        self.vertex_sum = cl_util.parallel_sum.IndexingPrefixSum(self.max_point_count)
+        self.triangle_sum = cl_util.parallel_sum.IndexingPrefixSum(
+            self.max_point_count
+        )
+
+        self.vertices = None
+        self.vertex_keys = None
+        self.triangles = None
+
+    def _ensure_output_capacity(self, vertex_count, triangle_count):
+        mf = pyopencl.mem_flags
+        if self.vertices is None or self.vertices.shape[0] < vertex_count:
+            self.vertices = cl_util.Buffer(
+                numpy.float32, (vertex_count, 3), mf.READ_WRITE
+            )
+            self.vertex_keys = cl_util.Buffer(numpy.uint32, vertex_count, mf.WRITE_ONLY)
+        if self.triangles is None or self.triangles.shape[0] < triangle_count:
+            self.triangles = cl_util.Buffer(
+                numpy.uint32, (triangle_count, 3), mf.WRITE_ONLY
+            )
+
+    def enqueue_counts(self, box_size, box_corner, box_resolution, wait_for=None):
+        """ Enqueue evaluation of a block and counting of its vertices and triangles.
+        Returns event after which `vertex_sum.total` and `triangle_sum.total`
+        contain counts for this block. """
+        point_count = int(numpy.prod(box_size))
+        assert point_count <= self.max_point_count
+
+        ev = opencl_manager.k.grid_eval_distance(
+            box_size,
+            None,
+            self.program_buffer,
+            box_corner.as_float4(),
+            numpy.float32(box_resolution),
+            self.values,
+            wait_for=wait_for,
+        )
+        ev = opencl_manager.k.marching_cubes_count(
+            box_size,
+            None,
+            self.values,
+            self.vertex_offsets,
+            self.triangle_offsets,
+            wait_for=[ev],
+        )
+        vertex_ev = self.vertex_sum.enqueue(self.vertex_offsets, point_count, [ev])
+        triangle_ev = self.triangle_sum.enqueue(
+            self.triangle_offsets, point_count, [ev]
+        )
+
+        return pyopencl.enqueue_marker(
+            opencl_manager.queue, wait_for=[vertex_ev, triangle_ev]
+        )
+
+    def enqueue_generate(self, box_size, box_corner, box_resolution, wait_for=None):
+        """ Enqueue generating vertices and triangles of a block whose counts were
+        calculated by `enqueue_counts`. Blocks until the counts are available.
+        Returns tuple (event, vertex count, triangle count), vertices, their keys
+        and triangles are in buffers `self.vertices`, `self.vertex_keys` and
+        `self.triangles` after the event finishes.
+
+        Vertex key is `3 * index of grid point + axis` of the cell edge containing
+        the vertex, grid point index is in the usual INDEX3 order. """
+        vertex_count = int(self.vertex_sum.total.read(wait_for=wait_for)[0])
+        triangle_count = int(self.triangle_sum.total.read(wait_for=wait_for)[0])
+
+        if not triangle_count:
+            return None, 0, 0
+
+        self._ensure_output_capacity(vertex_count, triangle_count)
+
+        ev = opencl_manager.k.marching_cubes_generate(
+            box_size,
+            None,
+            self.values,
+            box_corner.as_float4(),
+            numpy.float32(box_resolution),
+            self.vertex_offsets,
+            self.triangle_offsets,
+            self.vertices,
+            self.vertex_keys,
+            self.triangles,
+            wait_for=wait_for,
+        )
+        return ev, vertex_count, triangle_count
+
+    def read_output(self, vertex_count, triangle_count, wait_for=None):
+        """ Read vertices, triangles and vertex keys into new numpy arrays.
+        Returns tuple (vertices, triangles, vertex_keys). """
+        vertices = numpy.empty((vertex_count, 3), dtype=numpy.float32)
+        triangles = numpy.empty((triangle_count, 3), dtype=numpy.uint32)
+        vertex_keys = numpy.empty(vertex_count, dtype=numpy.uint32)
+        events = [
+            pyopencl.enqueue_copy(
+                opencl_manager.queue,
+                host_array,
+                buffer,
+                wait_for=wait_for,
+                is_blocking=False,
+            )
+            for host_array, buffer in [
+                (vertices, self.vertices),
+                (triangles, self.triangles),
+                (vertex_keys, self.vertex_keys),
+            ]
+        ]
+        pyopencl.wait_for_events(events)
+        return vertices, triangles, vertex_keys
+
+    def start_block(self, box_size, box_corner, box_resolution):
+        """ Enqueue the part of block processing that doesn't need to synchronize
+        with the host. Returns a value to be passed to `finish_block`. """
+        ev = self.enqueue_counts(box_size, box_corner, box_resolution)
+        return box_size, box_corner, box_resolution, ev
+
+    def finish_block(self, started):
+        """ Wait for a block started by `start_block`, extract its mesh
+        and return tuple (vertices, triangles, vertex_keys), or (None, None, None)
+        if the block doesn't contain any surface. """
+        box_size, box_corner, box_resolution, ev = started
+        ev, vertex_count, triangle_count = self.enqueue_generate(
+            box_size, box_corner, box_resolution, wait_for=[ev]
+        )
+        if not triangle_count:
+            return None, None, None
+        if self.refine_iterations:
+            ev = opencl_manager.k.project_to_surface(
+                (vertex_count,),
+                None,
+                self.program_buffer,
+                self.vertices,
+                numpy.uint32(self.refine_iterations),
+                wait_for=[ev],
+            )
+        return self.read_output(vertex_count, triangle_count, wait_for=[ev])
+
+    def process_block(self, box_size, box_corner, box_resolution):
+        """ Extract mesh of a single block and return tuple
+        (vertices, triangles, vertex_keys). """
+        return self.finish_block(self.start_block(box_size, box_corner, box_resolution))
@@ -1,15 +1,35 @@
+import collections
+import concurrent.futures
+
 import numpy
-import mcubes
 import pyopencl
 
 from .. import util
 from .. import subdivision
 from ..cl_util import opencl_manager
+from . import marching_cubes
 
 
-def triangular_mesh(obj, subdivision_grid_size=None, debug_subdivision_boxes=False):
+def triangular_mesh(
+    obj,
+    subdivision_grid_size=None,
+    debug_subdivision_boxes=False,
+    use_mcubes=False,
+    blocks_in_flight=4,
+    refine_iterations=0,
+):
     """ Generate a triangular mesh representing a surface of 3D shape.
-    Yields tuples (vertices, indices). """
+    Yields tuples (vertices, indices).
+
+    By default the mesh is extracted in OpenCL, if `use_mcubes` is set,
+    only the distance field is evaluated in OpenCL and the surface extraction
+    is done by PyMCubes.
+
+    Up to `blocks_in_flight` blocks are processed at the same time, the output
+    order doesn't depend on this value.
+
+    If `refine_iterations` is nonzero, vertices are moved onto the surface with
+    this many Newton steps (see `project_to_surface`). """
     obj.check_dimension(required=3)
 
     # TODO: Change mesh generation so that it doesn't use the subdivision module
@@ -17,58 +37,264 @@ def triangular_mesh(obj, subdivision_grid_size=None, debug_subdivision_boxes=Fal
         obj, obj.feature_size() / 2, grid_size=subdivision_grid_size
     )
 
-    block = numpy.empty(max_box_size, dtype=numpy.float32)
-    block_buffer = pyopencl.Buffer(
-        opencl_manager.context, pyopencl.mem_flags.WRITE_ONLY, block.nbytes
+    if debug_subdivision_boxes:
+        yield from _debug_subdivision_boxes(boxes)
+        return
+
+    if use_mcubes:
+        extractor_class = _MCubesExtractor
+    else:
+        extractor_class = marching_cubes.MarchingCubes
+    extractors = [
+        extractor_class(program_buffer, max_box_size, refine_iterations)
+        for _ in range(blocks_in_flight)
+    ]
+
+    for _, (vertices, triangles, _) in pipelined(extractors, boxes):
+        if triangles is None:
+            continue
+        yield vertices, triangles
+
+
+class IndexedMesh(collections.namedtuple("IndexedMesh", "vertices triangles")):
+    """ Triangle mesh with shared vertices.
+    `vertices` is a (n, 3) float array, `triangles` is a (m, 3) array of indices
+    into vertices. """
+
+    __slots__ = ()
+
+    def is_watertight(self):
+        """ Return True if every edge is used by exactly two triangles
+        in opposite directions. """
+        if not len(self.triangles):
+            return False
+
+        triangles = self.triangles.astype(numpy.int64)
+        starts = triangles.ravel()
+        ends = numpy.roll(triangles, -1, axis=1).ravel()
+        n = len(self.vertices)
+
+        directed = starts * n + ends
+        if len(numpy.unique(directed)) != len(directed):
+            return False  # Some directed edge is used twice
+
+        # Every directed edge must have its reverse.
+        return bool(numpy.isin(ends * n + starts, directed).all())
+
+
+def welded_mesh(
+    obj, subdivision_grid_size=None, blocks_in_flight=4, refine_iterations=0
+):
+    """ Generate a single indexed triangle mesh representing a surface of 3D shape.
+
+    Vertices shared between blocks are merged based on integer coordinates of
+    the cell edge they lie on, no floating point comparisons are involved.
+    Only vertices on block boundaries can be duplicated, so only these
+    take part in the merging.
+    `refine_iterations` has the same meaning as in `triangular_mesh`.
+    Returns IndexedMesh. """
+    obj.check_dimension(required=3)
+
+    program_buffer, max_box_size, boxes = subdivision.subdivision(
+        obj, obj.feature_size() / 2, grid_size=subdivision_grid_size
     )
+    extractors = [
+        marching_cubes.MarchingCubes(program_buffer, max_box_size, refine_iterations)
+        for _ in range(blocks_in_flight)
+    ]
 
-    for box_size, box_corner, box_resolution, *_ in boxes:
-        if debug_subdivision_boxes:
-            # Export just an outline of the block instead of displaying its contents
-            vertices = [
-                util.Vector(i, j, k).elementwise_mul(box_size) * box_resolution
-                + box_corner
-                for k in range(2)
-                for j in range(2)
-                for i in range(2)
-            ]
-            triangles = [
-                [0, 3, 1],
-                [0, 2, 3],
-                [1, 3, 5],
-                [3, 7, 5],
-                [4, 5, 6],
-                [5, 7, 6],
-                [0, 6, 2],
-                [0, 4, 6],
-                [0, 1, 5],
-                [0, 5, 4],
-                [3, 2, 6],
-                [3, 6, 7],
-            ]
-            yield vertices, triangles
+    vertex_pieces = []
+    triangle_pieces = []
+    boundary_indices = []  # Indices of boundary vertices in the concatenated array
+    boundary_coords = []  # Global integer coordinates of their edge start + axis
+    vertex_count = 0
+
+    for box, (vertices, triangles, keys) in pipelined(extractors, boxes):
+        if triangles is None:
             continue
+        box_size, _, _, int_corner, int_spacing = box
+
+        axis = keys % 3
+        coords = numpy.stack(
+            numpy.unravel_index(keys // 3, tuple(box_size)), axis=1
+        ).astype(numpy.int64)
+        on_boundary = numpy.logical_or(
+            coords == 0, coords == numpy.array(box_size) - 1
+        ).any(axis=1)
+
+        boundary_indices.append(numpy.flatnonzero(on_boundary) + vertex_count)
+        boundary_coords.append(
+            numpy.column_stack(
+                (
+                    coords[on_boundary] * int_spacing + numpy.array(int_corner),
+                    axis[on_boundary],
+                )
+            )
+        )
+
+        vertex_pieces.append(vertices)
+        triangle_pieces.append(triangles.astype(numpy.int64) + vertex_count)
+        vertex_count += len(vertices)
+
+    if not vertex_count:
+        return IndexedMesh(
+            numpy.empty((0, 3), dtype=numpy.float32),
+            numpy.empty((0, 3), dtype=numpy.uint32),
+        )
+
+    vertices = numpy.concatenate(vertex_pieces)
+    triangles = numpy.concatenate(triangle_pieces)
+    boundary_indices = numpy.concatenate(boundary_indices)
+    boundary_coords = numpy.concatenate(boundary_coords)
 
-        # TODO: Staggered opencl / python processing the way subdivision does it.
+    # Pack coordinates into a single integer key
+    coord_range = boundary_coords.max(axis=0) + 1
+    keys = numpy.ravel_multi_index(boundary_coords.T, coord_range)
+    _, first, inverse = numpy.unique(keys, return_index=True, return_inverse=True)
+
+    # Map every vertex to the first of its duplicates and drop the rest
+    canonical = numpy.arange(vertex_count)
+    canonical[boundary_indices] = boundary_indices[first[inverse.ravel()]]
+    keep = canonical == numpy.arange(vertex_count)
+    new_indices = numpy.cumsum(keep) - 1
+
+    return IndexedMesh(
+        vertices[keep], new_indices[canonical][triangles].astype(numpy.uint32)
+    )
+
+
+def project_to_surface(program_buffer, vertices, iterations=3):
+    """ Move vertices onto the surface using Newton steps `p -= d * n`, with
+    distance and normal from the evaluator. All vertices are processed in
+    a single kernel run.
+    Returns a new array of projected vertices. """
+    vertices = numpy.array(vertices, dtype=numpy.float32, order="C")
+    if not len(vertices):
+        return vertices
+
+    buffer = pyopencl.Buffer(
+        opencl_manager.context,
+        pyopencl.mem_flags.READ_WRITE | pyopencl.mem_flags.COPY_HOST_PTR,
+        hostbuf=vertices,
+    )
+    ev = opencl_manager.k.project_to_surface(
+        (len(vertices),), None, program_buffer, buffer, numpy.uint32(iterations)
+    )
+    pyopencl.enqueue_copy(opencl_manager.queue, vertices, buffer, wait_for=[ev])
+    return vertices
+
+
+def pipelined(extractors, boxes):
+    """ Process boxes using a pool of extractors, yield tuples (box, result)
+    in order of boxes.
+
+    Device work for every block is enqueued from this thread as soon as
+    an extractor is free, waiting for the device and host side extraction
+    runs in a thread pool (both pyopencl waits and mcubes release the GIL). """
+    free = list(extractors)
+    in_flight = collections.deque()
+
+    with concurrent.futures.ThreadPoolExecutor(len(extractors)) as executor:
+        for box in boxes:
+            if not free:
+                extractor, finished_box, future = in_flight.popleft()
+                yield finished_box, future.result()
+                free.append(extractor)
+
+            box_size, box_corner, box_resolution, *_ = box
+            extractor = free.pop()
+            started = extractor.start_block(box_size, box_corner, box_resolution)
+            in_flight.append(
+                (extractor, box, executor.submit(extractor.finish_block, started))
+            )
+
+        while in_flight:
+            _, finished_box, future = in_flight.popleft()
+            yield finished_box, future.result()
+
+
+def _debug_subdivision_boxes(boxes):
+    """ Yield just outlines of the blocks instead of displaying their contents """
+    for box_size, box_corner, box_resolution, *_ in boxes:
+        vertices = [
+            util.Vector(i, j, k).elementwise_mul(box_size) * box_resolution
+            + box_corner
+            for k in range(2)
+            for j in range(2)
+            for i in range(2)
+        ]
+        triangles = [
+            [0, 3, 1],
+            [0, 2, 3],
+            [1, 3, 5],
+            [3, 7, 5],
+            [4, 5, 6],
+            [5, 7, 6],
+            [0, 6, 2],
+            [0, 4, 6],
+            [0, 1, 5],
+            [0, 5, 4],
+            [3, 2, 6],
+            [3, 6, 7],
+        ]
+        yield vertices, triangles
+
+
+class _MCubesExtractor:
+    """ Surface extraction using PyMCubes on the host.
+    Has the same interface as marching_cubes.MarchingCubes, except that
+    vertex keys are not available. """
+
+    def __init__(self, program_buffer, max_block_size, refine_iterations=0):
+        import mcubes
+
+        self._mcubes = mcubes
+        self.program_buffer = program_buffer
+        self.refine_iterations = refine_iterations
+        self.block = numpy.empty(max_block_size, dtype=numpy.float32)
+        self.block_buffer = pyopencl.Buffer(
+            opencl_manager.context, pyopencl.mem_flags.WRITE_ONLY, self.block.nbytes
+        )
+
+    def start_block(self, box_size, box_corner, box_resolution):
         ev = opencl_manager.k.grid_eval_pymcubes(
             box_size,
             None,
-            program_buffer,
+            self.program_buffer,
             box_corner.as_float4(),
             numpy.float32(box_resolution),
-            block_buffer,
+            self.block_buffer,
+        )
+        ev = pyopencl.enqueue_copy(
+            opencl_manager.queue,
+            self.block,
+            self.block_buffer,
+            wait_for=[ev],
+            is_blocking=False,
         )
-        pyopencl.enqueue_copy(opencl_manager.queue, block, block_buffer, wait_for=[ev])
+        return box_size, box_corner, box_resolution, ev
 
-        vertices, triangles = mcubes.marching_cubes(block, 0)
+    def finish_block(self, started):
+        box_size, box_corner, box_resolution, ev = started
+        ev.wait()
+
+        vertices, triangles = self._mcubes.marching_cubes(self.block, 0)
 
         if not len(triangles):
-            continue
+            return None, None, None
 
         vertices[:, [0, 1]] = vertices[:, [1, 0]]
-        vertices[:, 1] *= -1
+        vertices[:, 1] = box_size[1] - 1 - vertices[:, 1]
         vertices *= box_resolution
         vertices += box_corner
         triangles[:, [0, 1]] = triangles[:, [1, 0]]
 
-        yield vertices, triangles
+        if self.refine_iterations:
+            vertices = project_to_surface(
+                self.program_buffer, vertices, self.refine_iterations
+            )
+
+        return vertices, triangles, None
+
+    def process_block(self, box_size, box_corner, box_resolution):
+        return self.finish_block(self.start_block(box_size, box_corner, box_resolution))
@@ -0,0 +1,151 @@
+""" Indexed mesh file formats (binary PLY, OBJ, 3MF).
+
+All of these are written from a single welded mesh, vertex and triangle data
+are formatted in large chunks rather than one item at a time. """
+
+import io
+import zipfile
+
+import numpy
+
+from . import mesh
+from .. import util
+
+# Number of vertices or triangles formatted at once in text formats
+TEXT_CHUNK_SIZE = 65536
+
+_PLY_FACE_DTYPE = numpy.dtype([("count", "u1"), ("indices", "<i4", (3,))])
+
+
+def _welded_mesh(obj):
+    with util.status_block("generating mesh"):
+        indexed_mesh = mesh.welded_mesh(obj)
+    print(
+        "{} vertices, {} triangles".format(
+            len(indexed_mesh.vertices), len(indexed_mesh.triangles)
+        )
+    )
+    return indexed_mesh
+
+
+def _write_chunked(fp, line_format, array):
+    """ Write rows of a 2D array formatted using `line_format` (bytes)
+    without formatting every row separately. """
+    for i in range(0, len(array), TEXT_CHUNK_SIZE):
+        chunk = array[i : i + TEXT_CHUNK_SIZE]
+        fp.write((line_format * len(chunk)) % tuple(chunk.ravel().tolist()))
+
+
+def write_ply(fp, indexed_mesh):
+    """ Write indexed mesh as a binary little endian PLY to a binary file object """
+    vertices = numpy.ascontiguousarray(indexed_mesh.vertices, dtype="<f4")
+    faces = numpy.empty(len(indexed_mesh.triangles), dtype=_PLY_FACE_DTYPE)
+    faces["count"] = 3
+    faces["indices"] = indexed_mesh.triangles
+
+    fp.write(
+        "\n".join(
+            [
+                "ply",
+                "format binary_little_endian 1.0",
+                "comment generated by CodeCad",
+                "element vertex {}".format(len(vertices)),
+                "property float x",
+                "property float y",
+                "property float z",
+                "element face {}".format(len(faces)),
+                "property list uchar int vertex_indices",
+                "end_header",
+                "",
+            ]
+        ).encode("ascii")
+    )
+    fp.write(vertices.tobytes())
+    fp.write(faces.tobytes())
+
+
+def write_obj(fp, indexed_mesh):
+    """ Write indexed mesh as a Wavefront OBJ to a binary file object """
+    fp.write(b"# generated by CodeCad\n")
+    _write_chunked(fp, b"v %.9g %.9g %.9g\n", indexed_mesh.vertices)
+    _write_chunked(
+        fp, b"f %d %d %d\n", indexed_mesh.triangles.astype(numpy.int64) + 1
+    )
+
+
+_3MF_CONTENT_TYPES = """<?xml version="1.0" encoding="UTF-8"?>
+<Types xmlns="http://schemas.openxmlformats.org/package/2006/content-types">
+<Default Extension="rels" ContentType="application/vnd.openxmlformats-package.relationships+xml"/>
+<Default Extension="model" ContentType="application/vnd.ms-package.3dmanufacturing-3dmodel+xml"/>
+</Types>
+"""
+
+_3MF_RELS = """<?xml version="1.0" encoding="UTF-8"?>
+<Relationships xmlns="http://schemas.openxmlformats.org/package/2006/relationships">
+<Relationship Target="/3D/3dmodel.model" Id="rel0" Type="http://schemas.microsoft.com/3dmanufacturing/2013/01/3dmodel"/>
+</Relationships>
+"""
+
+_3MF_MODEL_START = b"""<?xml version="1.0" encoding="UTF-8"?>
+<model unit="millimeter" xml:lang="en-US" xmlns="http://schemas.microsoft.com/3dmanufacturing/core/2015/02">
+<resources>
+<object id="1" type="model">
+<mesh>
+<vertices>
+"""
+
+_3MF_MODEL_MIDDLE = b"""</vertices>
+<triangles>
+"""
+
+_3MF_MODEL_END = b"""</triangles>
+</mesh>
+</object>
+</resources>
+<build>
+<item objectid="1"/>
+</build>
+</model>
+"""
+
+
+def write_3mf(fp, indexed_mesh):
+    """ Write indexed mesh as a 3MF package to a seekable binary file object.
+    The model XML is built in memory, writing zip members through a file object
+    needs Python 3.6. """
+    model = io.BytesIO()
+    model.write(_3MF_MODEL_START)
+    _write_chunked(
+        model, b'<vertex x="%.9g" y="%.9g" z="%.9g"/>\n', indexed_mesh.vertices
+    )
+    model.write(_3MF_MODEL_MIDDLE)
+    _write_chunked(
+        model, b'<triangle v1="%d" v2="%d" v3="%d"/>\n', indexed_mesh.triangles
+    )
+    model.write(_3MF_MODEL_END)
+
+    with zipfile.ZipFile(fp, "w", compression=zipfile.ZIP_DEFLATED) as package:
+        package.writestr("[Content_Types].xml", _3MF_CONTENT_TYPES)
+        package.writestr("_rels/.rels", _3MF_RELS)
+        package.writestr("3D/3dmodel.model", model.getvalue())
+
+
+def render_ply(obj, filename):
+    indexed_mesh = _welded_mesh(obj)
+    with util.status_block("saving"):
+        with open(filename, "wb") as fp:
+            write_ply(fp, indexed_mesh)
+
+
+def render_obj(obj, filename):
+    indexed_mesh = _welded_mesh(obj)
+    with util.status_block("saving"):
+        with open(filename, "wb") as fp:
+            write_obj(fp, indexed_mesh)
+
+
+def render_3mf(obj, filename):
+    indexed_mesh = _welded_mesh(obj)
+    with util.status_block("saving"):
+        with open(filename, "wb") as fp:
+            write_3mf(fp, indexed_mesh)
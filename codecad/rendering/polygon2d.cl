@@ -1,8 +1,8 @@
 /* Encode index with information about overflowing the block.
- * If coord is outside of a block (size specified by get_global_id),
+ * If coord is outside of a block (size specified by `size`),
  * this function prepends information about where this overflow happened on a
  * boundary of the block. */
-static uint encode_index(int2 coord, uint index)
+static uint encode_index(int2 coord, uint2 size, uint index)
 {
     const uint indexSize = 20; // max size of index in bits
 
@@ -13,12 +13,12 @@ static uint encode_index(int2 coord, uint index)
     // Find which coordinate is the outside one and swap it to x
     bool y;
     int2 swappedCoord;
-    if (coord.x < 0 || coord.x >= get_global_size(0))
+    if (coord.x < 0 || coord.x >= size.x)
     {
         y = false;
         swappedCoord = coord;
     }
-    else if (coord.y < 0 || coord.y >= get_global_size(1))
+    else if (coord.y < 0 || coord.y >= size.y)
     {
         y = true;
         swappedCoord = coord.yx;
@@ -60,6 +60,8 @@ static float2 place_vertex(float2 cornerPositions[3],
             // If the shape is properly 2D, then the gradient is inside Z=0 plane.
             // so that surfaceNormal will be already normalized and cornerValues[j].w
             // will also be correct.
+            // For slices of 3D shapes the normal is not normalized in the plane,
+            // but the linear approximation of the distance in the plane still holds.
 
             float tmp = dot(surfaceNormal, p - cornerPositions[j]) + cornerValues[j].w;
             residualSum += tmp * tmp;
@@ -79,27 +81,27 @@ static float2 place_vertex(float2 cornerPositions[3],
     return p;
 }
 
-__kernel void process_polygon(float2 boxCorner, float boxStep,
-                              __global float4* corners, /* Input, evaluated shape on grid corners */
-                              __global float2* vertices, /* Output, vertex coordinates corresponding to each cell. */
-                              __global uint* links, /* Output, encoded indices of cells that follows this one along the edge or -1 */
-                              __global uint* starts, /* Output, encoded indices of cells that start non-looped chains
-                                    Overflow specification in start index says should match overflow spec in links of
-                                    a neighboring block to connect the two */
-                              __global uint* startCounter /* Output, count of items in starts */)
+/* Process a single triangle of a block of size `size` (in cells).
+ * `flip` selects which of the two triangles of the cell is processed. */
+static void process_polygon_cell(uint2 cell, uint flip, uint2 size,
+                                 float2 boxCorner, float boxStep,
+                                 __global float4* corners,
+                                 __global float2* vertices,
+                                 __global uint* links,
+                                 __global uint* starts,
+                                 __global uint* startCounter)
 {
-    uint2 offsets[3] = {{0, 0}, {1, 1}, {get_global_id(2), 1 - get_global_id(2)}};
+    uint2 offsets[3] = {{0, 0}, {1, 1}, {flip, 1 - flip}};
     uint cellType = 0;
 
     for (uint i = 0; i < 3; ++i)
     {
-        uint2 coords = (uint2)(get_global_id(0), get_global_id(1)) + offsets[i];
-        size_t cornerIndex = INDEX2(get_global_size(0) + 1, get_global_size(1) + 1,
-                                    coords.x, coords.y);
+        uint2 coords = cell + offsets[i];
+        size_t cornerIndex = INDEX2(size.x + 1, size.y + 1, coords.x, coords.y);
         cellType = cellType << 1 | (corners[cornerIndex].w <= 0 ? 1 : 0);
 
     }
-    uint index = INDEX3_GG;
+    uint index = INDEX3(size.x, size.y, 2, cell.x, cell.y, flip);
 
     if (cellType == 0 || cellType == 7)
     {
@@ -116,7 +118,6 @@ __kernel void process_polygon(float2 boxCorner, float boxStep,
     bool backwards = cellType == 3 || cellType == 5 || cellType == 6;
     if (backwards)
         cellType = 7 - cellType; // Flip inside / outside flags in cellType
-    bool flip = get_global_id(2) == 1;
     if (flip)
         backwards = !backwards;
 
@@ -148,15 +149,16 @@ __kernel void process_polygon(float2 boxCorner, float boxStep,
         reverseCoords = reverseCoords.yx;
     }
 
-    forwardCoords += (int2)(get_global_id(0), get_global_id(1));
-    reverseCoords += (int2)(get_global_id(0), get_global_id(1));
+    forwardCoords += convert_int2(cell);
+    reverseCoords += convert_int2(cell);
 
-    links[index] = encode_index(forwardCoords,
-                                INDEX3_G(forwardCoords.x,
-                                         forwardCoords.y,
-                                         1 - get_global_id(2)));
+    links[index] = encode_index(forwardCoords, size,
+                                INDEX3(size.x, size.y, 2,
+                                       forwardCoords.x,
+                                       forwardCoords.y,
+                                       1 - flip));
 
-    uint startIndex = encode_index(reverseCoords, index);
+    uint startIndex = encode_index(reverseCoords, size, index);
     if (startIndex & 0x80000000) // If the overflow flag is set, then this is the start of an open chain
         starts[atomic_inc(startCounter)] = startIndex ^ 0x20000000; // Flip the +/- flag to match the end corresponding end of a chain
 
@@ -165,13 +167,56 @@ __kernel void process_polygon(float2 boxCorner, float boxStep,
     float4 cornerValues[3];
     for (uint i = 0; i < 3; ++i)
     {
-        uint2 coords = (uint2)(get_global_id(0), get_global_id(1)) + offsets[i];
-        size_t cornerIndex = INDEX2(get_global_size(0) + 1, get_global_size(1) + 1,
-                                    coords.x, coords.y);
+        uint2 coords = cell + offsets[i];
+        size_t cornerIndex = INDEX2(size.x + 1, size.y + 1, coords.x, coords.y);
         cornerPositions[i] = boxCorner + convert_float2(coords) * boxStep;
         cornerValues[i] = corners[cornerIndex];
     }
     vertices[index] = place_vertex(cornerPositions, cornerValues);
 }
 
+__kernel void process_polygon(float2 boxCorner, float boxStep,
+                              __global float4* corners, /* Input, evaluated shape on grid corners */
+                              __global float2* vertices, /* Output, vertex coordinates corresponding to each cell. */
+                              __global uint* links, /* Output, encoded indices of cells that follows this one along the edge or -1 */
+                              __global uint* starts, /* Output, encoded indices of cells that start non-looped chains
+                                    Overflow specification in start index says should match overflow spec in links of
+                                    a neighboring block to connect the two */
+                              __global uint* startCounter /* Output, count of items in starts */)
+{
+    process_polygon_cell((uint2)(get_global_id(0), get_global_id(1)),
+                         get_global_id(2),
+                         (uint2)(get_global_size(0), get_global_size(1)),
+                         boxCorner, boxStep,
+                         corners, vertices, links, starts, startCounter);
+}
+
+/* Version of process_polygon that processes several layers of the same block at once.
+ * Global size is (cells x, cells y, 2 * layer count), inputs and outputs of
+ * individual layers are stored one after another, each in the same layout as
+ * in process_polygon, startCounters has one item per layer. */
+__kernel void process_polygon_layers(float2 boxCorner, float boxStep,
+                                     __global float4* corners,
+                                     __global float2* vertices,
+                                     __global uint* links,
+                                     __global uint* starts,
+                                     __global uint* startCounters)
+{
+    uint2 size = (uint2)(get_global_size(0), get_global_size(1));
+    uint layer = get_global_id(2) / 2;
+    size_t cornerCount = (size.x + 1) * (size.y + 1);
+    size_t cellCount = size.x * size.y * 2;
+    size_t startCount = size.x + size.y;
+
+    process_polygon_cell((uint2)(get_global_id(0), get_global_id(1)),
+                         get_global_id(2) % 2,
+                         size,
+                         boxCorner, boxStep,
+                         corners + layer * cornerCount,
+                         vertices + layer * cellCount,
+                         links + layer * cellCount,
+                         starts + layer * startCount,
+                         startCounters + layer);
+}
+
 // vim: filetype=c
@@ -11,18 +11,74 @@ opencl_manager.add_compile_unit().append_resource("polygon2d.cl")
 _LINK_OVERFLOW_MASK = 0xfff00000
 
 
-def _collect_polygon(vertices, links, starting_index, chain):
-    """ Follow links starting at starting_index and apend outputs onto chain.
-    Returns the overflow spec of the last (invalid) link. """
-    i = starting_index
+_EMPTY_LINK = 0xffffffff
 
-    while not i & _LINK_OVERFLOW_MASK:
-        chain.append(tuple(vertices[i]))
-        last_index = i
-        i = links[i]
-        links[last_index] = _LINK_OVERFLOW_MASK
 
-    return i & _LINK_OVERFLOW_MASK
+def _follow_links(vertices, links):
+    """ Split cells of a block into chains by following the links.
+
+    Chains are ordered using pointer jumping on NumPy arrays, closed loops are
+    broken at their lowest cell index.
+    Returns tuple `(closed_chains, open_chains)`, where `closed_chains` is a list
+    of vertex arrays of closed loops and `open_chains` is a dict mapping cell index
+    of the first cell of an open chain to a tuple (vertex array, overflow spec of
+    the last link). """
+    cells = numpy.flatnonzero(links != _EMPTY_LINK)
+    count = len(cells)
+    if not count:
+        return [], {}
+
+    cell_links = links[cells]
+    linked = (cell_links & _LINK_OVERFLOW_MASK) == 0
+
+    compact = numpy.empty(len(links), dtype=numpy.intp)
+    compact[cells] = numpy.arange(count)
+
+    # Successor of each cell, last cells of open chains point to themselves
+    indices = numpy.arange(count)
+    successors = indices.copy()
+    successors[linked] = compact[cell_links[linked]]
+
+    iterations = count.bit_length()
+
+    # Find the lowest index in every loop and the last cell of every open chain
+    lowest = indices.copy()
+    jump = successors
+    for _ in range(iterations):
+        lowest = numpy.minimum(lowest, lowest[jump])
+        jump = jump[jump]
+    in_loop = linked[jump]
+
+    # Break the loops just before their lowest cell
+    loop_heads = in_loop & (lowest == indices)
+    breaks = in_loop & loop_heads[successors]
+    successors[breaks] = indices[breaks]
+
+    # List ranking, `jump` ends up pointing to the last cell of the chain
+    distance = (successors != indices).astype(numpy.intp)
+    jump = successors
+    for _ in range(iterations):
+        distance = distance + distance[jump]
+        jump = jump[jump]
+
+    order = numpy.lexsort((-distance, jump))
+    chain_boundaries = numpy.flatnonzero(numpy.diff(jump[order])) + 1
+    ordered_vertices = vertices[cells[order]]
+    points = numpy.column_stack((ordered_vertices["x"], ordered_vertices["y"]))
+
+    closed_chains = []
+    open_chains = {}
+    for chain_order, chain_points in zip(
+        numpy.split(order, chain_boundaries), numpy.split(points, chain_boundaries)
+    ):
+        last = chain_order[-1]
+        if in_loop[last]:
+            closed_chains.append(chain_points)
+        else:
+            overflow_spec = int(cell_links[last]) & _LINK_OVERFLOW_MASK
+            open_chains[int(cells[chain_order[0]])] = chain_points, overflow_spec
+
+    return closed_chains, open_chains
 
 
 def _step_from_overflow_spec(spec):
@@ -33,8 +89,86 @@ def _step_from_overflow_spec(spec):
         return util.Vector(step_direction, 0)
 
 
+class _OpenChain:
+    """ Chain of vertices that continues over block boundaries. """
+
+    __slots__ = ("pieces", "end_key")
+
+    def __init__(self):
+        self.pieces = []
+        self.end_key = None
+
+
+class _ChainAssembler:
+    """ Connects chains of vertices generated by process_polygon kernel in
+    individual blocks of a single layer into polygons. """
+
+    def __init__(self):
+        self.open_chain_beginnings = {}
+        self.open_chain_ends = {}
+
+    def add_block(
+        self, int_box_corner, int_box_step, vertices, links, starts, start_count
+    ):
+        """ Process outputs of a single block, yield polygons finished by it
+        as arrays of shape (n, 2). """
+        closed_chains, open_chains = _follow_links(vertices, links)
+
+        # First handle the open chains
+        assert start_count < len(starts)
+        assert start_count == len(open_chains)
+        for starting_index in starts[:start_count].tolist():
+            overflow_spec = starting_index & _LINK_OVERFLOW_MASK
+            starting_index = starting_index & (~_LINK_OVERFLOW_MASK)
+
+            # Find existing chain in open chains that can be continued here, or
+            # create a new one
+            beginning_key = (int_box_corner, overflow_spec)
+            try:
+                chain = self.open_chain_ends.pop(beginning_key)
+            except KeyError:
+                chain = _OpenChain()
+                assert beginning_key not in self.open_chain_beginnings
+                self.open_chain_beginnings[beginning_key] = chain
+
+            points, overflow_spec = open_chains[starting_index]
+            chain.pieces.append(points)
+
+            end_key = (
+                int_box_corner + _step_from_overflow_spec(overflow_spec) * int_box_step,
+                overflow_spec,
+            )
+
+            # Find any chain following the current one and merge them
+            try:
+                to_append = self.open_chain_beginnings.pop(end_key)
+            except KeyError:
+                chain.end_key = end_key
+                self.open_chain_ends[end_key] = chain
+            else:
+                if to_append is chain:
+                    # This would close the chain into a loop, we're done with it
+                    yield numpy.concatenate(chain.pieces)
+                else:
+                    chain.pieces.extend(to_append.pieces)
+                    chain.end_key = to_append.end_key
+                    # Overwrite the reference to `to_append` to point to `chain` instead
+                    self.open_chain_ends[chain.end_key] = chain
+
+            assert len(self.open_chain_beginnings) == len(self.open_chain_ends)
+
+        # Closed chains can be yielded directly
+        yield from closed_chains
+
+    def finish(self):
+        """ Check that all chains were closed. """
+        assert len(self.open_chain_beginnings) == 0
+        assert len(self.open_chain_ends) == 0
+
+
 def polygon(obj, subdivision_grid_size=None):
-    """ Generate polygons representing the boundaries of a 2D shape. """
+    """ Generate polygons representing the boundaries of a 2D shape.
+    Each polygon is a NumPy array of vertex coordinates with shape (n, 2). """
     obj.check_dimension(required=2)
 
     # TODO: Change polygon so that it doesn't use subdivision module
@@ -72,8 +206,7 @@ def polygon(obj, subdivision_grid_size=None):
     )
     start_counter = cl_util.Buffer(numpy.uint32, 1, pyopencl.mem_flags.READ_WRITE)
 
-    open_chain_beginnings = {}
-    open_chain_ends = {}
+    assembler = _ChainAssembler()
 
     for (
         box_size,
@@ -114,60 +247,207 @@ def polygon(obj, subdivision_grid_size=None):
         # Everything is read into the internal array of clutil.Buffer
         vertices.read(wait_for=[process_ev])
         links.read(wait_for=[process_ev])
-        vertices.read(wait_for=[process_ev])
         starts.read(wait_for=[process_ev])
         start_counter.read(wait_for=[process_ev])
 
-        # First handle the open chains
-        assert start_counter[0] < len(starts)
-        for starting_index in starts[: start_counter[0]]:
-            overflow_spec = starting_index & _LINK_OVERFLOW_MASK
-            starting_index = starting_index & (~_LINK_OVERFLOW_MASK)
+        yield from assembler.add_block(
+            int_box_corner,
+            int_box_step,
+            vertices.array,
+            links.array,
+            starts.array,
+            start_counter[0],
+        )
 
-            # Find existing chain in open chains that can be continued here, or
-            # create a new one
-            # After the block is done, we are holding either a fresh chain,
-            # or an existing one and the chain is registered only in open_chain_beginnings
-            beginning_key = (int_box_corner, overflow_spec)
-            try:
-                chain = open_chain_ends.pop(beginning_key)
-            except KeyError:
-                chain = []
-                assert beginning_key not in open_chain_beginnings
+    assembler.finish()
 
-            overflow_spec = _collect_polygon(vertices, links, starting_index, chain)
 
-            end_key = (
-                int_box_corner + _step_from_overflow_spec(overflow_spec) * int_box_step,
-                overflow_spec,
+def _layer_blocks(boxes, z_values):
+    """ Group 3D blocks from subdivision by their XY position.
+    Returns list of tuples (box_size, box_corner, box_resolution, int_box_corner,
+    int_box_resolution, layer_indices) with one item for each XY position that
+    intersects surface in at least one of the layers. """
+    by_position = {}
+    for (
+        box_size,
+        box_corner,
+        box_resolution,
+        int_box_corner,
+        int_box_resolution,
+    ) in boxes:
+        z_min = box_corner.z
+        z_max = box_corner.z + box_resolution * (box_size[2] - 1)
+        layer_indices = [i for i, z in enumerate(z_values) if z_min <= z <= z_max]
+        if not layer_indices:
+            continue
+
+        flat_int_corner = util.Vector(int_box_corner.x, int_box_corner.y)
+        try:
+            block = by_position[flat_int_corner]
+        except KeyError:
+            by_position[flat_int_corner] = (
+                box_size,
+                box_corner,
+                box_resolution,
+                flat_int_corner,
+                int_box_resolution,
+                set(layer_indices),
             )
-            open_chain_beginnings[beginning_key] = chain, end_key
+        else:
+            block[5].update(layer_indices)
 
-            # Find any chain following the current one and merge them
-            try:
-                to_append, to_append_end_key = open_chain_beginnings.pop(end_key)
-            except KeyError:
-                open_chain_ends[end_key] = chain
+    return [block[:5] + (sorted(block[5]),) for block in by_position.values()]
+
+
+def slices(
+    obj, z_values, resolution=None, subdivision_grid_size=None, max_layers=None
+):
+    """ Generate polygons representing boundaries of intersections of a 3D shape
+    with planes parallel to XY at given Z coordinates.
+
+    All layers share one 3D subdivision of the shape, layers are processed in
+    batches of at most `max_layers`, each batch evaluated with one kernel launch
+    per block.
+    Yields a list of polygons for each item of `z_values`, in the same order,
+    polygons are NumPy arrays with shape (n, 2). Every layer is yielded as soon
+    as the last block intersecting it is processed. """
+    obj.check_dimension(required=3)
+
+    if resolution is None:
+        resolution = obj.feature_size() / 2
+    if max_layers is None:
+        max_layers = 64
+
+    z_values = list(z_values)
+
+    program_buffer, grid_size, boxes = subdivision.subdivision(
+        obj, resolution, grid_size=subdivision_grid_size
+    )
+
+    assert grid_size[0] < 512, "Larger grid size would overflow the index encoding"
+
+    grid_size = (grid_size[0], grid_size[1])
+    grid_size_triangles = (grid_size[0] - 1, grid_size[1] - 1)
+    corner_count = grid_size[0] * grid_size[1]
+    cell_count = grid_size_triangles[0] * grid_size_triangles[1] * 2
+    start_count = grid_size_triangles[0] + grid_size_triangles[1]
+
+    z_buffer = cl_util.Buffer(numpy.float32, max_layers, pyopencl.mem_flags.READ_ONLY)
+    corners = pyopencl.Buffer(
+        opencl_manager.context,
+        pyopencl.mem_flags.READ_WRITE | pyopencl.mem_flags.HOST_NO_ACCESS,
+        cl_util.Buffer.quad_dtype(numpy.float32).itemsize * corner_count * max_layers,
+    )
+    vertices = cl_util.Buffer(
+        cl_util.Buffer.dual_dtype(numpy.float32),
+        (max_layers, cell_count),
+        pyopencl.mem_flags.WRITE_ONLY | pyopencl.mem_flags.HOST_READ_ONLY,
+    )
+    links = cl_util.Buffer(
+        numpy.uint32,
+        (max_layers, cell_count),
+        pyopencl.mem_flags.WRITE_ONLY | pyopencl.mem_flags.HOST_READ_ONLY,
+    )
+    starts = cl_util.Buffer(
+        numpy.uint32,
+        (max_layers, start_count),
+        pyopencl.mem_flags.WRITE_ONLY | pyopencl.mem_flags.HOST_READ_ONLY,
+    )
+    start_counters = cl_util.Buffer(
+        numpy.uint32, max_layers, pyopencl.mem_flags.READ_WRITE
+    )
+
+    for batch_start in range(0, len(z_values), max_layers):
+        batch = z_values[batch_start : batch_start + max_layers]
+        # Processing blocks ordered by their first layer finishes the layers
+        # in order
+        blocks = sorted(_layer_blocks(boxes, batch), key=lambda block: block[5][0])
+        assemblers = [_ChainAssembler() for z in batch]
+        outputs = [[] for z in batch]
+
+        last_blocks = [-1] * len(batch)
+        for block_index, block in enumerate(blocks):
+            for layer_index in block[5]:
+                last_blocks[layer_index] = block_index
+        finished_count = 0
+
+        def finish_layers(block_index):
+            """ Yield outputs of all layers that have no blocks after
+            `block_index` and were not yielded yet """
+            nonlocal finished_count
+            while (
+                finished_count < len(batch)
+                and last_blocks[finished_count] <= block_index
+            ):
+                assemblers[finished_count].finish()
+                yield outputs[finished_count]
+                outputs[finished_count] = None
+                finished_count += 1
+
+        yield from finish_layers(-1)
+
+        for (
+            block_index,
+            (
+                box_size,
+                box_corner,
+                box_resolution,
+                int_box_corner,
+                int_box_resolution,
+                layer_indices,
+            ),
+        ) in enumerate(blocks):
+            if len(boxes) > 1:
+                assert box_size[0] == box_size[1]
+                int_box_step = int_box_resolution * (box_size[0] - 1)
             else:
-                if to_append is chain:
-                    # This would close the chain into a loop, we're done with it
-                    del open_chain_beginnings[beginning_key]
-                    yield chain
-                else:
-                    chain.extend(to_append)
-                    # Overwrite the reference to `to_append` to point to `chain` instead
-                    open_chain_ends[to_append_end_key] = chain
+                int_box_step = None
+
+            layer_count = len(layer_indices)
+            z_ev = z_buffer.enqueue_write(
+                numpy.array([batch[i] for i in layer_indices], dtype=numpy.float32)
+            )
+            corners_ev = opencl_manager.k.grid_eval_layers(
+                grid_size + (layer_count,),
+                None,
+                program_buffer,
+                box_corner.as_float2(),
+                numpy.float32(box_resolution),
+                z_buffer,
+                corners,
+                wait_for=[z_ev],
+            )
+            fill_ev = start_counters.enqueue_write(
+                numpy.zeros(max_layers, start_counters.dtype)
+            )
+            process_ev = opencl_manager.k.process_polygon_layers(
+                grid_size_triangles + (2 * layer_count,),
+                None,
+                box_corner.as_float2(),
+                numpy.float32(box_resolution),
+                corners,
+                vertices,
+                links,
+                starts,
+                start_counters,
+                wait_for=[corners_ev, fill_ev],
+            )
 
-            assert len(open_chain_beginnings) == len(open_chain_ends)
+            vertices.read(wait_for=[process_ev])
+            links.read(wait_for=[process_ev])
+            starts.read(wait_for=[process_ev])
+            start_counters.read(wait_for=[process_ev])
 
-        # Next go through the whole array and find all cells that have valid links
-        # Each of these must be a part of a closed chain
-        for starting_index in range(len(vertices)):
-            if links[starting_index] & _LINK_OVERFLOW_MASK:
-                continue
-            output_polygon = []
-            _collect_polygon(vertices, links, starting_index, output_polygon)
-            yield output_polygon  # Closed chains can be yielded directly
+            for i, layer_index in enumerate(layer_indices):
+                outputs[layer_index].extend(
+                    assemblers[layer_index].add_block(
+                        int_box_corner,
+                        int_box_step,
+                        vertices[i],
+                        links[i],
+                        starts[i],
+                        start_counters[i],
+                    )
+                )
 
-    assert len(open_chain_beginnings) == 0
-    assert len(open_chain_ends) == 0
+            yield from finish_layers(block_index)
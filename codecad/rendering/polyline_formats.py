@@ -0,0 +1,166 @@
+""" 2D outline file formats (SVG, DXF).
+
+Outlines from polygon2d are simplified within a tolerance before writing and
+vertex coordinates are formatted with fixed precision in large chunks, one
+polygon at a time as they are generated. """
+
+import numpy
+
+from . import polygon2d
+from .. import util
+
+# Number of vertices formatted at once
+TEXT_CHUNK_SIZE = 65536
+
+# Number of decimal places in written coordinates
+DEFAULT_PRECISION = 4
+
+
+def simplify(points, tolerance):
+    """ Simplify a closed polygon given as an array of shape (n, 2) using
+    Douglas-Peucker algorithm, so that no removed vertex is farther than
+    `tolerance` from the simplified outline.
+
+    All segments of one recursion level are processed at once.
+    Returns array of the remaining vertices, possibly with less than three
+    vertices if the whole polygon is within tolerance of a line segment. """
+    points = numpy.asarray(points)
+    count = len(points)
+    if count <= 3:
+        return points
+
+    closed = numpy.concatenate((points, points[:1]))
+    keep = numpy.zeros(count + 1, dtype=bool)
+    keep[0] = keep[count] = True
+    # The first segment starts and ends at the same point, split it at the
+    # farthest vertex first
+    keep[numpy.argmax(numpy.hypot(*(points - points[0]).T))] = True
+
+    while True:
+        kept = numpy.flatnonzero(keep)
+        candidates = numpy.flatnonzero(~keep)
+        if not len(candidates):
+            break
+
+        segments = numpy.searchsorted(kept, candidates) - 1
+        a = closed[kept[segments]]
+        direction = closed[kept[segments + 1]] - a
+        offset = closed[candidates] - a
+
+        # Distance to the segment, not to the whole line
+        length_squared = numpy.einsum("ij,ij->i", direction, direction)
+        t = numpy.einsum("ij,ij->i", offset, direction)
+        numpy.divide(t, length_squared, out=t, where=length_squared > 0)
+        numpy.clip(t, 0, 1, out=t)
+        distances = numpy.hypot(*(offset - direction * t[:, numpy.newaxis]).T)
+
+        # Farthest candidate in every segment
+        order = numpy.lexsort((-distances, segments))
+        first_in_segment = numpy.ones(len(order), dtype=bool)
+        first_in_segment[1:] = segments[order[1:]] != segments[order[:-1]]
+        farthest = order[first_in_segment]
+        farthest = farthest[distances[farthest] > tolerance]
+
+        if not len(farthest):
+            break
+        keep[candidates[farthest]] = True
+
+    return points[keep[:count]]
+
+
+def simplified_polygons(obj, tolerance=None):
+    """ Generate polygons of a 2D shape, simplified by `simplify`.
+    Polygons that collapse to less than three vertices are dropped.
+    Default tolerance is a tenth of the sampling resolution of polygon2d. """
+    if tolerance is None:
+        tolerance = obj.feature_size() / 20
+
+    for polygon in polygon2d.polygon(obj):
+        simplified = simplify(polygon, tolerance)
+        if len(simplified) >= 3:
+            yield simplified
+
+
+def _format_chunked(point_format, points):
+    """ Format rows of an array of shape (n, 2) using `point_format`
+    without formatting every row separately. Yields strings. """
+    for i in range(0, len(points), TEXT_CHUNK_SIZE):
+        chunk = points[i : i + TEXT_CHUNK_SIZE]
+        yield (point_format * len(chunk)) % tuple(chunk.ravel().tolist())
+
+
+def write_svg(fp, polygons, box, precision=None):
+    """ Write polygons as a single SVG path into a text file object.
+    `box` is the bounding box of the drawing, units are millimeters. """
+    if precision is None:
+        precision = DEFAULT_PRECISION
+    number = "%.{}f".format(precision)
+
+    box_size = box.size()
+
+    fp.write('<svg xmlns="http://www.w3.org/2000/svg" ')
+    fp.write('width="{}mm" height="{}mm" '.format(box_size.x, box_size.y))
+    fp.write('viewBox="{} {} {} {}">'.format(box.a.x, -box.b.y, box_size.x, box_size.y))
+    fp.write('<style type="text/css">')
+    fp.write("path{")
+    fp.write("stroke:#000;")
+    fp.write("stroke-width:1px;")
+    fp.write("vector-effect:non-scaling-stroke;")
+    fp.write("fill:#BBF23C{};")
+    fp.write("}")
+    fp.write("</style>")
+
+    fp.write('<path d="')
+    point_format = "L" + number + "," + number
+    for polygon in polygons:
+        # Y axis is flipped in SVG, reversing the points keeps the orientation
+        flipped = polygon[::-1] * (1, -1)
+        fp.write(("M" + number + "," + number) % tuple(flipped[0].tolist()))
+        for chunk in _format_chunked(point_format, flipped[1:]):
+            fp.write(chunk)
+        fp.write("Z")
+    fp.write('"/>')
+
+    fp.write("</svg>")
+
+
+def write_dxf(fp, polygons, precision=None):
+    """ Write polygons as closed POLYLINE entities of an ASCII DXF (R12)
+    into a text file object.
+    R12 has no header variable for drawing units, coordinates are written
+    in millimeters. """
+    if precision is None:
+        precision = DEFAULT_PRECISION
+    number = "%.{}f".format(precision)
+
+    fp.write("0\nSECTION\n2\nHEADER\n")
+    fp.write("9\n$ACADVER\n1\nAC1009\n")
+    fp.write("0\nENDSEC\n")
+
+    fp.write("0\nSECTION\n2\nENTITIES\n")
+    point_format = "0\nVERTEX\n8\n0\n10\n" + number + "\n20\n" + number + "\n"
+    for polygon in polygons:
+        # Closed polyline with the dummy point required by R12 readers
+        fp.write("0\nPOLYLINE\n8\n0\n66\n1\n70\n1\n10\n0\n20\n0\n30\n0\n")
+        for chunk in _format_chunked(point_format, polygon):
+            fp.write(chunk)
+        fp.write("0\nSEQEND\n8\n0\n")
+    fp.write("0\nENDSEC\n")
+    fp.write("0\nEOF\n")
+
+
+def render_svg(obj, filename, tolerance=None, precision=None):
+    with util.status_block("generating and exporting outline"):
+        with open(filename, "w") as fp:
+            write_svg(
+                fp,
+                simplified_polygons(obj, tolerance),
+                obj.bounding_box(),
+                precision,
+            )
+
+
+def render_dxf(obj, filename, tolerance=None, precision=None):
+    with util.status_block("generating and exporting outline"):
+        with open(filename, "w") as fp:
+            write_dxf(fp, simplified_polygons(obj, tolerance), precision)
@@ -7,6 +7,9 @@
 #define AMBIENT_OCCLUSION_STEPS 4
 #define LIGHT_MIN_INFLUENCE (1.0f/128.0f)
 
+// Number of floats per pixel in the geometry buffer, must match GEOMETRY_DTYPE
+#define GEOMETRY_SIZE 8
+
 #define LIGHT_DIRECTION normalize((float3)(1, 2, -1))
 #define SECONDARY_LIGHT_DIRECTION normalize((float3)(-1, 1, 0))
 
@@ -139,30 +142,92 @@ static float3 map_color_zebra(float3 point, float ambient, float diffuse, float
     return (float3)color;
 }
 
-__kernel void ray_caster(__constant float* restrict scene,
-                         float4 origin, float4 forward, float4 up, float4 right,
-                         float pixelTolerance, float boxRadius,
-                         float minDistance, float maxDistance, float floorZ,
-                         uint renderOptions,
-                         __global uchar* restrict output,
-                         __global AssertBuffer* assertBuffer)
+// Marches a cone around primary rays of a block of `coneSize` x `coneSize` pixels.
+// `coneTangent` is tangent of the cone half angle.
+// Stores the distance up to which all rays of the block are in empty space
+// and the number of steps taken.
+__kernel void ray_caster_cones(__constant float* restrict scene,
+                               float4 origin, float4 forward, float4 up, float4 right,
+                               float minDistance, float maxDistance,
+                               uint2 imageSize, uint coneSize, float coneTangent,
+                               __global float2* restrict output)
 {
-    size_t x = get_global_id(0);
-    size_t y = get_global_id(1);
-    size_t w = get_global_size(0);
-    size_t h = get_global_size(1);
-
-    float filmx = x - (w - 1) / 2.0f;
-    float filmy = y - (h - 1) / 2.0f;
+    float filmx = get_global_id(0) * coneSize + (coneSize - 1) / 2.0f -
+                  (imageSize.x - 1) / 2.0f;
+    float filmy = get_global_id(1) * coneSize + (coneSize - 1) / 2.0f -
+                  (imageSize.y - 1) / 2.0f;
 
     float3 direction = normalize(as_float3(forward) +
                                  as_float3(right) * filmx -
                                  as_float3(up) * filmy);
 
     float distance = minDistance;
-    float fallbackDistance = minDistance;
+    uint stepCount;
+    for (stepCount = 0; stepCount < PRIMARY_RAY_MAX_STEPS; ++stepCount)
+    {
+        float4 evalResult = evaluate(scene, origin.xyz + distance * direction);
+        float coneRadius = distance * coneTangent;
+
+        // Stop well before the cone touches the surface, the steps would
+        // only get shorter from here.
+        if (evalResult.w < 2 * coneRadius)
+            break;
+
+        // Largest step that keeps the part of the cone between the old and
+        // new distance inside the empty ball around the evaluated point.
+        distance += (evalResult.w - coneRadius) / (1 + coneTangent);
+
+        if (distance > maxDistance)
+        {
+            distance = maxDistance;
+            break;
+        }
+    }
+
+    // Number of evaluations, including the one that ended the loop
+    output[INDEX2_GG] = (float2)(distance, min(stepCount + 1, (uint)PRIMARY_RAY_MAX_STEPS));
+}
+
+// Traces a primary ray through a point of the image (pixel centers are at
+// integer coordinates) and returns its unclamped color.
+// If `coneSize` is non-zero, the ray starts at distance from ray_caster_cones.
+// If `pixelGeometry` is not null, GEOMETRY_SIZE floats are written to it:
+// distance along the ray (infinity for background), number of steps of the
+// primary ray, surface normal and hit position (nan for background).
+static float3 trace_pixel(__constant float* restrict scene,
+                          float4 origin, float4 forward, float4 up, float4 right,
+                          float pixelTolerance, float boxRadius,
+                          float minDistance, float maxDistance, float floorZ,
+                          uint renderOptions,
+                          uint2 imageSize, float2 pixel,
+                          uint coneSize, __global const float2* restrict coneDistances,
+                          __global float* restrict pixelGeometry)
+{
+    float filmx = pixel.x - (imageSize.x - 1) / 2.0f;
+    float filmy = pixel.y - (imageSize.y - 1) / 2.0f;
+
+    float3 direction = normalize(as_float3(forward) +
+                                 as_float3(right) * filmx -
+                                 as_float3(up) * filmy);
+
+    float startDistance = minDistance;
+    float coneSteps = 0; // Share of this pixel in evaluations of the cone pre-pass
+    if (coneSize)
+    {
+        uint coneColumns = (imageSize.x + coneSize - 1) / coneSize;
+        uint coneRows = (imageSize.y + coneSize - 1) / coneSize;
+        // Cones cover rays up to half a pixel from the pixel centers
+        uint x = min((uint)(pixel.x + 0.5f), imageSize.x - 1);
+        uint y = min((uint)(pixel.y + 0.5f), imageSize.y - 1);
+        size_t coneIndex = INDEX2(coneColumns, coneRows, x / coneSize, y / coneSize);
+        startDistance = max(startDistance, coneDistances[coneIndex].x);
+        coneSteps = coneDistances[coneIndex].y / (coneSize * coneSize);
+    }
+
+    float distance = startDistance;
+    float fallbackDistance = startDistance;
     float4 evalResult;
-    bool hit;
+    bool hit = false;
     uint stepCount = 0;
     for (stepCount = 0; stepCount < PRIMARY_RAY_MAX_STEPS; ++stepCount)
     {
@@ -211,7 +276,7 @@ __kernel void ray_caster(__constant float* restrict scene,
         else
             residual = 0;
 
-        float steps = stepCount;
+        float steps = stepCount + coneSteps;
         steps += light_contribution(scene, point, normal, -LIGHT_DIRECTION, -direction,
                                     localEpsilon, maxDistance,
                                     renderOptions).s0;
@@ -249,10 +314,82 @@ __kernel void ray_caster(__constant float* restrict scene,
         color = mix((float3)(0, 0, 0), color, 0.4 + 0.6 * shadow);
     }
 
-    size_t index = INDEX2_GG * 3;
-    output[index + 0] = clamp(color.x, 0.0f, 255.0f);
-    output[index + 1] = clamp(color.y, 0.0f, 255.0f);
-    output[index + 2] = clamp(color.z, 0.0f, 255.0f);
+    if (pixelGeometry)
+    {
+        pixelGeometry[1] = stepCount + coneSteps;
+        if (hit)
+        {
+            float3 point = origin.xyz + direction * distance;
+            pixelGeometry[0] = distance;
+            vstore3(evalResult.xyz, 0, pixelGeometry + 2);
+            vstore3(point, 0, pixelGeometry + 5);
+        }
+        else
+        {
+            pixelGeometry[0] = INFINITY;
+            vstore3((float3)(0, 0, 0), 0, pixelGeometry + 2);
+            vstore3((float3)(NAN, NAN, NAN), 0, pixelGeometry + 5);
+        }
+    }
+
+    return color;
+}
+
+static void store_color(__global uchar* restrict output, float3 color)
+{
+    output[0] = clamp(color.x, 0.0f, 255.0f);
+    output[1] = clamp(color.y, 0.0f, 255.0f);
+    output[2] = clamp(color.z, 0.0f, 255.0f);
+}
+
+// Renders a tile of the image, every `pixelStep`-th pixel in both directions
+// starting at `tileOffset`. Output contains only the rendered pixels.
+// Geometry is written for every pixel unless `geometry` is null.
+__kernel void ray_caster(__constant float* restrict scene,
+                         float4 origin, float4 forward, float4 up, float4 right,
+                         float pixelTolerance, float boxRadius,
+                         float minDistance, float maxDistance, float floorZ,
+                         uint renderOptions,
+                         uint2 imageSize, uint2 tileOffset, uint pixelStep,
+                         uint coneSize, __global const float2* restrict coneDistances,
+                         __global uchar* restrict output,
+                         __global float* restrict geometry,
+                         __global AssertBuffer* assertBuffer)
+{
+    float2 pixel = (float2)(tileOffset.x + get_global_id(0) * pixelStep,
+                            tileOffset.y + get_global_id(1) * pixelStep);
+
+    __global float* pixelGeometry = 0;
+    if (geometry)
+        pixelGeometry = geometry + INDEX2_GG * GEOMETRY_SIZE;
+
+    float3 color = trace_pixel(scene, origin, forward, up, right,
+                               pixelTolerance, boxRadius,
+                               minDistance, maxDistance, floorZ,
+                               renderOptions, imageSize, pixel,
+                               coneSize, coneDistances, pixelGeometry);
+    store_color(output + INDEX2_GG * 3, color);
+}
+
+// Renders a list of samples, each given as two floats of image coordinates.
+__kernel void ray_caster_samples(__constant float* restrict scene,
+                                 float4 origin, float4 forward, float4 up, float4 right,
+                                 float pixelTolerance, float boxRadius,
+                                 float minDistance, float maxDistance, float floorZ,
+                                 uint renderOptions,
+                                 uint2 imageSize,
+                                 uint coneSize, __global const float2* restrict coneDistances,
+                                 __global const float* restrict samples,
+                                 __global uchar* restrict output,
+                                 __global AssertBuffer* assertBuffer)
+{
+    size_t i = get_global_id(0);
+    float3 color = trace_pixel(scene, origin, forward, up, right,
+                               pixelTolerance, boxRadius,
+                               minDistance, maxDistance, floorZ,
+                               renderOptions, imageSize, vload2(i, samples),
+                               coneSize, coneDistances, 0);
+    store_color(output + i * 3, color);
 }
 
 // vim: filetype=c
@@ -1,6 +1,8 @@
+import collections
 import math
 
 import pyopencl
+import pyopencl.cltypes
 import numpy
 import flags
 
@@ -27,12 +29,93 @@ def _zero_if_inf(x):
         return x
 
 
-def render(
-    obj, origin, direction, up, focal_length, size, options=RenderOptions.no_flags
+class TileOrder(flags.Flags):
+    """ Order in which tiles of an image are rendered """
+
+    ordered = ()  # Row by row, starting in the top left corner
+    interleaved = ()  # Spread over the image, partial results cover it evenly
+
+
+# Per pixel geometry written by the ray caster.
+# Depth is the distance from the camera along the ray, steps is the number of
+# steps of the primary ray (counted like in RenderOptions.false_color).
+# Background pixels have infinite depth, zero normal and nan position.
+GEOMETRY_DTYPE = numpy.dtype(
+    [
+        ("depth", numpy.float32),
+        ("steps", numpy.float32),
+        ("normal", numpy.float32, 3),
+        ("position", numpy.float32, 3),
+    ]
+)
+
+
+class Tile(collections.namedtuple("Tile", "x y step pixels geometry")):
+    """ Finished part of a ray cast image.
+    `pixels` is an array of shape (rows, columns, 3), its element [i, j] is the
+    color of the image pixel at (x + j * step, y + i * step).
+    `geometry` is None or an array of shape (rows, columns) and GEOMETRY_DTYPE. """
+
+    __slots__ = ()
+
+
+class RenderResult(collections.namedtuple("RenderResult", "image geometry")):
+    """ Image of shape (height, width, 3) together with its per pixel geometry,
+    array of shape (height, width) and GEOMETRY_DTYPE. """
+
+    __slots__ = ()
+
+
+# Default width and height of tiles in pixels for render_tiles
+DEFAULT_TILE_SIZE = 256
+
+# Default width and height of pixel blocks sharing a cone in the pre-pass
+DEFAULT_CONE_SIZE = 8
+
+# Number of tiles enqueued before waiting for the oldest one to finish
+_TILES_IN_FLIGHT = 2
+
+# Neighboring pixels whose depths differ by more than this fraction of the
+# smaller one are on an edge
+_EDGE_DEPTH_RATIO = 0.02
+
+# Neighboring pixels whose normals form an angle larger than this are on an edge
+_EDGE_NORMAL_COSINE = math.cos(math.radians(20))
+
+
+def _bit_reversed(value, bits):
+    return int("{:0{}b}".format(value, bits)[::-1], 2)
+
+
+def _tile_corners(size, tile_size, tile_order):
+    """ Return list of top left corners of tiles covering image of a given size """
+    corners = [
+        (x, y)
+        for y in range(0, size[1], tile_size)
+        for x in range(0, size[0], tile_size)
+    ]
+    if tile_order == TileOrder.interleaved:
+        # Bit reversed order of indices is roughly evenly spread at any point
+        bits = max(1, (len(corners) - 1).bit_length())
+        order = sorted(range(len(corners)), key=lambda i: _bit_reversed(i, bits))
+        corners = [corners[i] for i in order]
+    return corners
+
+
+_View = collections.namedtuple("_View", "args cone_args events")
+
+
+def _prepare_view(
+    program_buffer, box, origin, direction, up, focal_length, size, options, cone_size
 ):
+    """ Calculate ray_caster kernel arguments for a camera view and enqueue the
+    cone pre-pass. Returns _View with kernel arguments before and after the
+    tile position and list of events that tiles have to wait for. """
 
-    box = obj.bounding_box()
-    obj.check_dimension(required=3)
+    if cone_size is None:
+        cone_size = DEFAULT_CONE_SIZE
+
+    assert cone_size >= 0, "Negative cone size makes no sense"
 
     forward = direction.normalized()
     up = up - forward * up.dot(forward)
@@ -48,45 +131,429 @@ def render(
     max_distance = origin_to_midpoint + box_radius
 
     mf = pyopencl.mem_flags
-    program_buffer = nodes.make_program_buffer(obj)
-    output_buffer = cl_util.Buffer(numpy.uint8, [size[0], size[1], 3], mf.WRITE_ONLY)
-
-    assert_buffer = cl_util.AssertBuffer()
-
-    ev = opencl_manager.k.ray_caster(
-        size,
-        None,
+    camera_args = (
         program_buffer,
         origin.as_float4(),
         forward.as_float4(),
         up.as_float4(),
         right.as_float4(),
+    )
+
+    cone_events = []
+    if cone_size:
+        # Sine of the angle between the cone axis and any ray of the block is
+        # at most half of the block diagonal divided by the focal length
+        cone_sine = cone_size / math.sqrt(2) / focal_length
+        assert cone_sine < 1, "Cone size is too large for the focal length"
+        cone_counts = (_ceil_div(size[0], cone_size), _ceil_div(size[1], cone_size))
+        cone_distances = cl_util.Buffer(
+            pyopencl.cltypes.float2, [cone_counts[0], cone_counts[1]], mf.READ_WRITE
+        )
+        cone_events.append(
+            opencl_manager.k.ray_caster_cones(
+                cone_counts,
+                None,
+                *camera_args,
+                numpy.float32(min_distance),
+                numpy.float32(max_distance),
+                pyopencl.cltypes.make_uint2(*size),
+                numpy.uint32(cone_size),
+                numpy.float32(cone_sine / math.sqrt(1 - cone_sine ** 2)),
+                cone_distances,
+            )
+        )
+    else:
+        # Unused, but the kernel needs a valid buffer
+        cone_distances = cl_util.Buffer(pyopencl.cltypes.float2, 1, mf.READ_ONLY)
+
+    args = (
+        *camera_args,
         numpy.float32(pixel_tolerance),
         numpy.float32(box_radius),
         numpy.float32(min_distance),
         numpy.float32(max_distance),
         numpy.float32(box.a.z - box.size().z / 20),
         numpy.uint32(options),
+        pyopencl.cltypes.make_uint2(*size),
+    )
+    return _View(args, (numpy.uint32(cone_size), cone_distances), cone_events)
+
+
+def _create_tile_buffers(dimensions, geometry):
+    """ Create output buffer and optionally geometry buffer for a tile with given
+    dimensions in rendered pixels. Returns the geometry buffer as None if
+    `geometry` is false. """
+    mf = pyopencl.mem_flags
+    output_buffer = cl_util.Buffer(
+        numpy.uint8, [dimensions[0], dimensions[1], 3], mf.WRITE_ONLY
+    )
+    if geometry:
+        geometry_buffer = cl_util.Buffer(GEOMETRY_DTYPE, dimensions, mf.WRITE_ONLY)
+    else:
+        geometry_buffer = None
+    return output_buffer, geometry_buffer
+
+
+def _enqueue_tile(
+    view, x, y, dimensions, step, output_buffer, geometry_buffer, assert_buffer
+):
+    """ Enqueue rendering of a tile with given dimensions in rendered pixels,
+    returns the event. """
+    return opencl_manager.k.ray_caster(
+        dimensions,
+        None,
+        *view.args,
+        pyopencl.cltypes.make_uint2(x, y),
+        numpy.uint32(step),
+        *view.cone_args,
         output_buffer,
+        geometry_buffer,
         assert_buffer,
+        wait_for=view.events,
     )
 
+
+def _read_mapped(buffer, wait_for):
+    """ Return copy of buffer contents with the first two axes swapped
+    (from the kernel's x, y order to rows and columns).
+    Reads through a mapping, avoiding a separate transfer to host memory. """
+    if buffer is None:
+        return None
+    with buffer.map(pyopencl.map_flags.READ, wait_for=wait_for) as mapped:
+        return mapped.swapaxes(0, 1).copy()
+
+
+def _run_time(events):
+    """ Total run time of finished events in nanoseconds """
+    return sum(event.profile.end - event.profile.start for event in events)
+
+
+def _render_tiles(view, size, tile_size, tile_order, preview_step, geometry):
+    """ Implementation of render_tiles for a prepared view.
+    Yields tuples (tile, kernel run time in nanoseconds), time of the cone
+    pre-pass is included with the first tile. """
+
+    assert tile_size > 0, "Non-positive tile size makes no sense"
+    assert preview_step >= 1, "Preview step must be at least one"
+
+    untimed_events = list(view.events)
+
+    assert_buffer = cl_util.AssertBuffer()
+
+    steps = []
+    step = int(preview_step)
+    while step > 1:
+        steps.append(step)
+        step = (step + 1) // 2
+    steps.append(1)
+
+    corners = _tile_corners(size, tile_size, tile_order)
+
+    def enqueue(x, y, step):
+        tile_dimensions = (
+            _ceil_div(min(tile_size, size[0] - x), step),
+            _ceil_div(min(tile_size, size[1] - y), step),
+        )
+        buffers = _create_tile_buffers(tile_dimensions, geometry)
+        ev = _enqueue_tile(view, x, y, tile_dimensions, step, *buffers, assert_buffer)
+        return x, y, step, buffers, ev
+
+    def finish(x, y, step, buffers, ev):
+        assert_buffer.check(wait_for=[ev])
+        pixels, tile_geometry = (_read_mapped(buffer, [ev]) for buffer in buffers)
+        run_time = _run_time(untimed_events + [ev])
+        del untimed_events[:]
+        return Tile(x, y, step, pixels, tile_geometry), run_time
+
+    in_flight = collections.deque()
+    for step in steps:
+        for x, y in corners:
+            in_flight.append(enqueue(x, y, step))
+            if len(in_flight) >= _TILES_IN_FLIGHT:
+                yield finish(*in_flight.popleft())
+    while in_flight:
+        yield finish(*in_flight.popleft())
+
+
+def _ceil_div(a, b):
+    return -(-a // b)
+
+
+def _edge_pixels(geometry):
+    """ Return boolean array marking pixels on both sides of silhouettes, depth
+    discontinuities and sharp changes of the surface normal. """
+    depth = geometry["depth"]
+    normal = geometry["normal"]
+    hit = numpy.isfinite(depth)
+
+    edges = numpy.zeros(depth.shape, dtype=bool)
+    for first, second in [
+        ((slice(None, -1), slice(None)), (slice(1, None), slice(None))),
+        ((slice(None), slice(None, -1)), (slice(None), slice(1, None))),
+    ]:
+        both_hit = hit[first] & hit[second]
+        smaller_depth = numpy.minimum(depth[first], depth[second])
+        with numpy.errstate(invalid="ignore"):
+            depth_difference = abs(depth[first] - depth[second])
+            depth_change = depth_difference > _EDGE_DEPTH_RATIO * smaller_depth
+        normal_cosine = (normal[first] * normal[second]).sum(axis=-1)
+        discontinuity = (hit[first] != hit[second]) | (
+            both_hit & (depth_change | (normal_cosine < _EDGE_NORMAL_COSINE))
+        )
+        edges[first] |= discontinuity
+        edges[second] |= discontinuity
+
+    return edges
+
+
+def _antialias(view, image, geometry, antialiasing, assert_buffer):
+    """ Replace colors of edge pixels in the image by average of the original
+    sample and `antialiasing` x `antialiasing` stratified jittered samples.
+    Returns kernel run time in nanoseconds. """
+    ys, xs = numpy.nonzero(_edge_pixels(geometry))
+    if not len(xs):
+        return 0
+
+    samples_per_pixel = antialiasing * antialiasing
+    cells = numpy.indices((antialiasing, antialiasing)).reshape(2, -1).T
+    # Fixed seed keeps the output deterministic
+    jitter = numpy.random.RandomState(0).uniform(size=(len(xs), samples_per_pixel, 2))
+    samples = (
+        numpy.column_stack((xs, ys))[:, numpy.newaxis, :]
+        + (cells + jitter) / antialiasing
+        - 0.5
+    )
+    samples = samples.reshape(-1, 2).astype(numpy.float32)
+
+    mf = pyopencl.mem_flags
+    samples_buffer = cl_util.Buffer(numpy.float32, samples.shape, mf.READ_ONLY)
+    output_buffer = cl_util.Buffer(numpy.uint8, [len(samples), 3], mf.WRITE_ONLY)
+    write_ev = samples_buffer.enqueue_write(samples)
+    ev = opencl_manager.k.ray_caster_samples(
+        (len(samples),),
+        None,
+        *view.args,
+        *view.cone_args,
+        samples_buffer,
+        output_buffer,
+        assert_buffer,
+        wait_for=[write_ev] + view.events,
+    )
     assert_buffer.check(wait_for=[ev])
 
-    output_buffer.read(wait_for=[ev])
+    with output_buffer.map(pyopencl.map_flags.READ, wait_for=[ev]) as colors:
+        color_sums = colors.reshape(len(xs), samples_per_pixel, 3).sum(
+            axis=1, dtype=numpy.uint32
+        )
+    color_sums += image[ys, xs]
+    image[ys, xs] = numpy.round(color_sums / (samples_per_pixel + 1))
+
+    return _run_time([ev])
+
+
+def render_tiles(
+    obj,
+    origin,
+    direction,
+    up,
+    focal_length,
+    size,
+    options=RenderOptions.no_flags,
+    tile_size=None,
+    tile_order=TileOrder.ordered,
+    preview_step=1,
+    cone_size=None,
+    geometry=False,
+    antialiasing=0,
+):
+    """ Render the image in square tiles of `tile_size` pixels, each in a separate
+    kernel launch, and yield every Tile as soon as it is finished.
+    Tiles contain per pixel geometry if `geometry` is true.
+
+    If `antialiasing` is non-zero, edge pixels of the finished image are
+    antialiased like in render and one more Tile with the whole image is
+    yielded after the last pass.
+
+    If `preview_step` is larger than one, the image is first rendered with only
+    every `preview_step`-th pixel in both directions, then the step is halved
+    for every following pass over all tiles until it reaches one. The preview
+    passes together take at most a third of the time of the final pass.
+
+    Before the tiles, one cone per block of `cone_size` x `cone_size` pixels is
+    marched through the empty space and rays of the block start tracing where
+    its cone stopped. Cone size of zero disables the pre-pass. """
+
+    if tile_size is None:
+        tile_size = DEFAULT_TILE_SIZE
+
+    obj.check_dimension(required=3)
+    view = _prepare_view(
+        nodes.make_program_buffer(obj),
+        obj.bounding_box(),
+        origin,
+        direction,
+        up,
+        focal_length,
+        size,
+        options,
+        cone_size,
+    )
+
+    assert antialiasing >= 0, "Negative antialiasing makes no sense"
+
+    need_geometry = geometry or antialiasing > 0
+    tiles = _render_tiles(
+        view, size, tile_size, tile_order, preview_step, need_geometry
+    )
+    if not antialiasing:
+        for tile, _ in tiles:
+            yield tile
+        return
+
+    output = numpy.empty((size[1], size[0], 3), dtype=numpy.uint8)
+    geometry_output = numpy.empty((size[1], size[0]), dtype=GEOMETRY_DTYPE)
+    for tile, _ in tiles:
+        if tile.step == 1:
+            height, width, _ = tile.pixels.shape
+            output[tile.y : tile.y + height, tile.x : tile.x + width] = tile.pixels
+            geometry_output[
+                tile.y : tile.y + height, tile.x : tile.x + width
+            ] = tile.geometry
+        if geometry:
+            yield tile
+        else:
+            yield tile._replace(geometry=None)
+
+    _antialias(view, output, geometry_output, antialiasing, cl_util.AssertBuffer())
+    yield Tile(0, 0, 1, output, geometry_output if geometry else None)
+
+
+def render(
+    obj,
+    origin,
+    direction,
+    up,
+    focal_length,
+    size,
+    options=RenderOptions.no_flags,
+    tile_size=None,
+    tile_order=TileOrder.ordered,
+    cone_size=None,
+    geometry=False,
+    antialiasing=0,
+):
+    """ Render the whole image and return it as an array of shape
+    (height, width, 3).
+    By default the image is rendered in a single kernel launch, setting
+    `tile_size` splits it into tiles like in render_tiles.
+
+    If `antialiasing` is non-zero, edge pixels found from discontinuities in
+    depth and normals of the image are traced again with
+    `antialiasing` x `antialiasing` jittered samples and averaged.
+
+    If `geometry` is true, per pixel depth, normal, position and step count
+    are written in the same pass and RenderResult is returned instead.
+
+    With RenderOptions.false_color the first channel contains number of
+    evaluations per pixel, including its share of the cone pre-pass. """
+
+    if tile_size is None:
+        tile_size = max(size)
+
+    assert antialiasing >= 0, "Negative antialiasing makes no sense"
+
+    obj.check_dimension(required=3)
+    view = _prepare_view(
+        nodes.make_program_buffer(obj),
+        obj.bounding_box(),
+        origin,
+        direction,
+        up,
+        focal_length,
+        size,
+        options,
+        cone_size,
+    )
+    need_geometry = geometry or antialiasing > 0
 
-    print("Render took", (ev.profile.end - ev.profile.start) / 1e9)
+    output = numpy.empty((size[1], size[0], 3), dtype=numpy.uint8)
+    if need_geometry:
+        geometry_output = numpy.empty((size[1], size[0]), dtype=GEOMETRY_DTYPE)
+    render_time = 0
+    tiles = _render_tiles(view, size, tile_size, tile_order, 1, need_geometry)
+    for tile, run_time in tiles:
+        height, width, _ = tile.pixels.shape
+        output[tile.y : tile.y + height, tile.x : tile.x + width] = tile.pixels
+        if need_geometry:
+            geometry_output[
+                tile.y : tile.y + height, tile.x : tile.x + width
+            ] = tile.geometry
+        render_time += run_time
+
+    if antialiasing:
+        render_time += _antialias(
+            view, output, geometry_output, antialiasing, cl_util.AssertBuffer()
+        )
+
+    print("Render took", render_time / 1e9)
 
     if options & RenderOptions.false_color:
         for i, name in enumerate(["Steps taken", "Residual * 1000"]):
-            channel = output_buffer[:, :, i]
+            channel = output[:, :, i]
             print(
                 "{}: min: {}, max: {}, mean: {}".format(
                     name, channel.min(), channel.max(), channel.mean()
                 )
             )
 
-    return output_buffer.array.transpose((1, 0, 2))
+    if geometry:
+        return RenderResult(output, geometry_output)
+    else:
+        return output
+
+
+def render_views(
+    obj, cameras, size, options=RenderOptions.no_flags, cone_size=None, geometry=False
+):
+    """ Render the object from each of the cameras and yield the images as
+    arrays of shape (height, width, 3), or as RenderResult if `geometry` is true.
+
+    `cameras` is an iterable of tuples (origin, direction, up, focal_length),
+    as returned by get_camera_params or get_orbit_camera_params.
+    The program buffer is built only once and views are rendered back to back
+    into two alternating output buffers, so that the next view is already
+    rendering while the previous one is read back. """
+
+    obj.check_dimension(required=3)
+
+    program_buffer = nodes.make_program_buffer(obj)
+    box = obj.bounding_box()
+    assert_buffer = cl_util.AssertBuffer()
+    free_buffers = collections.deque(
+        _create_tile_buffers(size, geometry) for _ in range(2)
+    )
+    in_flight = collections.deque()
+
+    def finish(buffers, ev):
+        assert_buffer.check(wait_for=[ev])
+        pixels, view_geometry = (_read_mapped(buffer, [ev]) for buffer in buffers)
+        free_buffers.append(buffers)
+        if geometry:
+            return RenderResult(pixels, view_geometry)
+        else:
+            return pixels
+
+    for camera in cameras:
+        if not free_buffers:
+            yield finish(*in_flight.popleft())
+
+        buffers = free_buffers.popleft()
+        view = _prepare_view(program_buffer, box, *camera, size, options, cone_size)
+        ev = _enqueue_tile(view, 0, 0, size, 1, *buffers, assert_buffer)
+        in_flight.append((buffers, ev))
+
+    while in_flight:
+        yield finish(*in_flight.popleft())
 
 
 def get_camera_params(box, size, view_angle):
@@ -113,3 +580,34 @@ def get_camera_params(box, size, view_angle):
     up = util.Vector(0, 0, 1)
 
     return (origin, direction, up, focal_length)
+
+
+def get_orbit_camera_params(box, size, view_angle, count, elevation=0):
+    """ Return list of `count` camera parameter tuples evenly spaced on a circle
+    around the vertical axis through the middle of the box, looking at the middle
+    from `elevation` degrees above the horizontal plane.
+    The first camera is the same as from get_camera_params (for zero
+    elevation), the following ones orbit counterclockwise when seen from above.
+    Distance from the box is chosen so that the box fits any of the views. """
+
+    assert -90 < elevation < 90, "Orbit camera cannot look straight up or down"
+
+    # Cube around the bounding sphere of the box looks the same from any angle
+    midpoint = box.midpoint()
+    radius = abs(box.size().applyfunc(_zero_if_inf)) / 2
+    half_size = util.Vector.splat(radius)
+    orbit_box = util.BoundingBox(midpoint - half_size, midpoint + half_size)
+
+    origin, _, up, focal_length = get_camera_params(orbit_box, size, view_angle)
+    distance = abs(origin - midpoint)
+
+    ret = []
+    for i in range(count):
+        angle = 2 * math.pi * i / count
+        direction = util.Vector(
+            -math.sin(angle) * math.cos(math.radians(elevation)),
+            math.cos(angle) * math.cos(math.radians(elevation)),
+            -math.sin(math.radians(elevation)),
+        )
+        ret.append((midpoint - direction * distance, direction, up, focal_length))
+    return ret
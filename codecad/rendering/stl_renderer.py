@@ -1,24 +1,61 @@
+import struct
+
 import numpy
-import stl.mesh
 
 from . import mesh
 from .. import util
 
+STL_HEADER = b"Binary STL generated by CodeCad".ljust(80, b" ")
+STL_TRIANGLE_DTYPE = numpy.dtype(
+    [
+        ("normal", "<f4", (3,)),
+        ("vertices", "<f4", (3, 3)),
+        ("attributes", "<u2"),
+    ]
+)
+
+
+def stl_triangles(vertices, indices):
+    """ Convert an indexed block of a mesh to an array of binary STL triangle records. """
+    triangles = numpy.asarray(vertices, dtype=numpy.float32)[numpy.asarray(indices)]
+
+    normals = numpy.cross(
+        triangles[:, 1] - triangles[:, 0], triangles[:, 2] - triangles[:, 0]
+    )
+    lengths = numpy.linalg.norm(normals, axis=1, keepdims=True)
+    numpy.divide(normals, lengths, out=normals, where=lengths > 0)
+
+    records = numpy.zeros(len(triangles), dtype=STL_TRIANGLE_DTYPE)
+    records["normal"] = normals
+    records["vertices"] = triangles
+    return records
+
+
+def write_stl(fp, blocks):
+    """ Write binary STL into a seekable binary file object, from an iterable of
+    (vertices, indices) tuples.
+    Blocks are written as they come, the triangle count in the header is patched
+    at the end. Returns number of written triangles. """
+    start = fp.tell()
+    fp.write(STL_HEADER)
+    fp.write(struct.pack("<I", 0))
+
+    triangle_count = 0
+    for vertices, indices in blocks:
+        records = stl_triangles(vertices, indices)
+        fp.write(records.tobytes())
+        triangle_count += len(records)
+
+    end = fp.tell()
+    fp.seek(start + len(STL_HEADER))
+    fp.write(struct.pack("<I", triangle_count))
+    fp.seek(end)
+
+    return triangle_count
+
 
 def render_stl(obj, filename):
-    with util.status_block("generating mesh"):
-        pieces = list(mesh.triangular_mesh(obj))
-    triangle_count = sum(len(piece[1]) for piece in pieces)
-
-    with util.status_block("exporting {} triangles".format(triangle_count)):
-        stl_mesh = stl.mesh.Mesh(numpy.zeros(triangle_count, dtype=stl.mesh.Mesh.dtype))
-        i = 0
-        for vertices, indices in pieces:
-            for triangle in indices:
-                for j, vertex in enumerate(triangle):
-                    v = vertices[vertex]
-                    stl_mesh.vectors[i, j] = v
-                i += 1
-
-    with util.status_block("saving"):
-        stl_mesh.save(filename)
+    with util.status_block("generating and exporting mesh"):
+        with open(filename, "wb") as fp:
+            triangle_count = write_stl(fp, mesh.triangular_mesh(obj))
+    print("{} triangles".format(triangle_count))
@@ -0,0 +1,252 @@
+""" Watch mode for the edit model -> look at the render design loop.
+
+The model script is executed again every time it is modified and the object
+it passes to commandline_render is rendered progressively into an image file,
+coarse preview passes first. The OpenCL context and the compiled program stay
+alive between reloads, so only the node program of the new object has to be
+built.
+Camera parameters of the first render are kept, so that consecutive images
+show the model from the same view.
+
+Only the script itself is watched, modules it imports are not reloaded. """
+
+import os
+import runpy
+import time
+import traceback
+
+import numpy
+import PIL.Image
+
+from . import ray_caster
+from . import bitmap
+from . import image
+from .. import util
+from .. import rendering
+
+# Seconds between checks of the script modification time
+DEFAULT_POLL_INTERVAL = 0.2
+
+# Pixel step of the first preview pass, see ray_caster.render_tiles
+DEFAULT_PREVIEW_STEP = 8
+
+# Module name of the script reloaded for a global variable, keeps its
+# `if __name__ == "__main__"` block from running again
+_RUN_NAME = "__codecad_watch__"
+
+
+class _Captured(Exception):
+    """ Stops the reloaded script at its commandline_render call """
+
+    def __init__(self, obj):
+        super().__init__()
+        self.obj = obj
+
+
+def _capture(obj):
+    raise _Captured(obj)
+
+
+class Watcher:
+    """ Renders object from model script at `path` into image file `filename`
+    whenever the script changes.
+    The object is taken from global variable `name` of the script, or if `name`
+    is None, the script is executed as main and the object is the one passed
+    to commandline_render.
+    `obj` is the object from the current version of the script, if it was
+    already loaded. It is rendered first without executing the script again.
+    `size`, `view_angle` and `antialiasing` have the same meaning as for
+    image.render_image. """
+
+    def __init__(
+        self,
+        path,
+        filename,
+        name=None,
+        size=(1024, 768),
+        view_angle=None,
+        antialiasing=None,
+        preview_step=None,
+        tile_size=None,
+        obj=None,
+    ):
+        if antialiasing is None:
+            antialiasing = image.DEFAULT_ANTIALIASING
+        if preview_step is None:
+            preview_step = DEFAULT_PREVIEW_STEP
+
+        self.path = path
+        self.filename = filename
+        self.name = name
+        self.size = size
+        self.view_angle = view_angle
+        self.antialiasing = antialiasing
+        self.preview_step = preview_step
+        self.tile_size = tile_size
+
+        # Set by the first render of a 3D object and kept across reloads
+        self.camera_params = None
+
+        self._mtime = None
+        self._initial_obj = None
+        if obj is not None:
+            self._mtime = self._get_mtime()
+            self._initial_obj = _as_shape(obj)
+
+        # Pixels of the last finished render, restored when a render fails
+        self._last_pixels = None
+
+    def _get_mtime(self):
+        try:
+            return os.stat(self.path).st_mtime_ns
+        except FileNotFoundError:
+            # Some editors replace the file on save
+            return self._mtime
+
+    def changed(self):
+        """ Return true if the script was modified since it was last loaded """
+        return self._get_mtime() != self._mtime
+
+    def load(self):
+        """ Execute the model script and return the watched object.
+        Errors in the script are printed and None is returned. """
+        self._mtime = self._get_mtime()
+
+        try:
+            obj = self._run_script()
+        except Exception:
+            traceback.print_exc()
+            return None
+
+        if obj is None:
+            return None
+        return _as_shape(obj)
+
+    def _run_script(self):
+        if self.name is not None:
+            namespace = runpy.run_path(self.path, run_name=_RUN_NAME)
+            if self.name not in namespace:
+                print("Model script does not define {}".format(self.name))
+                return None
+            return namespace[self.name]
+
+        rendering._capture_hook = _capture
+        try:
+            runpy.run_path(self.path, run_name="__main__")
+        except _Captured as captured:
+            return captured.obj
+        finally:
+            rendering._capture_hook = None
+
+        print("Model script did not call commandline_render")
+        return None
+
+    def render(self, obj):
+        """ Render the object into the output file, saving the image after every
+        pass. Returns False if the render was abandoned because the script
+        changed in the meantime. """
+        if obj.dimension() == 2:
+            self._last_pixels = bitmap.render(obj, self.size)
+            self._save(self._last_pixels)
+            return True
+
+        if self.camera_params is None:
+            self.camera_params = ray_caster.get_camera_params(
+                obj.bounding_box(), self.size, self.view_angle
+            )
+
+        pixels = numpy.zeros((self.size[1], self.size[0], 3), dtype=numpy.uint8)
+        tiles = ray_caster.render_tiles(
+            obj,
+            *self.camera_params,
+            self.size,
+            tile_size=self.tile_size,
+            preview_step=self.preview_step,
+            antialiasing=self.antialiasing,
+        )
+        step = None
+        for tile in tiles:
+            if self.changed():
+                return False
+            if step is not None and tile.step != step:
+                self._save(pixels)
+            step = tile.step
+            _paste(pixels, tile)
+
+        self._save(pixels)
+        self._last_pixels = pixels
+        return True
+
+    def _save(self, pixels):
+        """ Replace the output file at once, so that image viewers never
+        load a partially written file """
+        root, ext = os.path.splitext(self.filename)
+        temporary = root + ".tmp" + ext
+        PIL.Image.fromarray(pixels).save(temporary)
+        os.replace(temporary, self.filename)
+
+    def run(self, poll_interval=None, max_reloads=None):
+        """ Load and render the script every time it changes, until
+        `max_reloads` loads were done or forever if it is None. """
+        if poll_interval is None:
+            poll_interval = DEFAULT_POLL_INTERVAL
+
+        if self._initial_obj is not None:
+            obj, self._initial_obj = self._initial_obj, None
+            self._render_reporting_errors(obj)
+
+        reloads = 0
+        while max_reloads is None or reloads < max_reloads:
+            if not self.changed():
+                time.sleep(poll_interval)
+                continue
+
+            reloads += 1
+            with util.status_block("loading {}".format(self.path)):
+                obj = self.load()
+            if obj is None:
+                continue
+
+            self._render_reporting_errors(obj)
+
+    def _render_reporting_errors(self, obj):
+        """ Render the object, errors are printed and the image of the last
+        finished render is restored. """
+        try:
+            with util.status_block("rendering {}".format(self.filename)):
+                finished = self.render(obj)
+        except Exception:
+            traceback.print_exc()
+            if self._last_pixels is not None:
+                self._save(self._last_pixels)
+            return
+
+        if not finished:
+            print("Script changed, render abandoned")
+
+
+def _as_shape(obj):
+    """ Assemblies are rendered as a whole, like by the image renderer """
+    if hasattr(obj, "bom"):
+        return obj.shape()
+    return obj
+
+
+def _paste(image, tile):
+    """ Copy tile into the image, repeating pixels of preview passes """
+    pixels = tile.pixels.repeat(tile.step, axis=0).repeat(tile.step, axis=1)
+    height, width, _ = pixels.shape
+    region = image[tile.y : tile.y + height, tile.x : tile.x + width]
+    region[...] = pixels[: region.shape[0], : region.shape[1]]
+
+
+def watch(path, filename, **kwargs):
+    """ Re-render the model script at `path` into `filename` whenever the
+    script changes, until interrupted.
+    Keyword arguments are passed to Watcher. """
+    watcher = Watcher(path, filename, **kwargs)
+    print("Watching {} for changes, press Ctrl+C to stop".format(path))
+    try:
+        watcher.run()
+    except KeyboardInterrupt:
+        pass
@@ -34,8 +34,8 @@ def regular_polygon2d(n, d=1, r=None, side_length=None, across_flats=None):
     return _s2.RegularPolygon2D(n, d, r, side_length, across_flats)
 
 
-def polygon2d(points):
-    return _polygons2d.Polygon2D(points)
+def polygon2d(points, accelerate=None):
+    return _polygons2d.Polygon2D(points, accelerate)
 
 
 def polygon2d_builder(origin_x, origin_y):
@@ -109,4 +109,15 @@ def intersection(shapes, r=-1):
     )
 
 
+def instances(shape, transformations):
+    """ Union of copies of a shape placed using an iterable of transformations.
+
+    Unlike union of transformed shapes, the shape is evaluated through a single
+    shared sub-program for all copies. """
+    if shape.dimension() == 2:
+        return _s2.Instances2D(shape, transformations)
+    else:
+        return _s3.Instances(shape, transformations)
+
+
 # pylama:ignore=W0611
@@ -1,4 +1,4 @@
-from . import simple2d
+from . import polygons2d
 
 
 def _load_selig(fileobj):
@@ -6,7 +6,7 @@ def _load_selig(fileobj):
     points = [tuple(float(x) for x in l.split()) for l in fileobj]
     if points[0] == points[-1]:
         points = points[:-1]
-    return simple2d.Polygon2D(points)
+    return polygons2d.Polygon2D(points)
 
 
 def load_selig(path, fileobj=None):
@@ -115,6 +115,113 @@ class TransformationMixin:
         )
 
 
+class InstancesMixin:
+    """ Union of copies of a single shape placed using a list of transformations.
+
+    Nodes of the shape are only generated once and evaluated in a loop over the
+    instances, so the program size doesn't depend on number of copies.
+    Instances are traversed using a bounding volume hierarchy and instances whose
+    bounding box is farther than the nearest surface found so far are skipped. """
+
+    def __init__(self, s, transformations):
+        self.check_dimension(s)
+        self.s = s
+        self.transformations = list(transformations)
+        if not self.transformations:
+            raise ValueError("Instances need at least one transformation")
+
+    def instance_bounding_boxes(self):
+        """ Return list of bounding boxes of individual instances """
+        return [self.s.transformed(t).bounding_box() for t in self.transformations]
+
+    def bounding_box(self):
+        return functools.reduce(
+            lambda a, b: a.union(b), self.instance_bounding_boxes()
+        )
+
+    def feature_size(self):
+        return self.s.feature_size() * min(
+            t.quaternion.abs_squared() for t in self.transformations
+        )
+
+    def get_node(self, point, cache):
+        boxes = self.instance_bounding_boxes()
+        if self.dimension() == 2:
+            # 2D shapes ignore Z coordinate of the point
+            boxes = [
+                util.BoundingBox(
+                    util.Vector(b.a.x, b.a.y, -float("inf")),
+                    util.Vector(b.b.x, b.b.y, float("inf")),
+                )
+                for b in boxes
+            ]
+
+        hierarchy = _bounding_volume_hierarchy(boxes)
+
+        params = [len(hierarchy), len(self.transformations)]
+        for box, skip, index in hierarchy:
+            params.extend(_clamp_infinite(x) for x in box.a)
+            params.extend(_clamp_infinite(x) for x in box.b)
+            params.append(skip)
+            params.append(index)
+        for t in self.transformations:
+            params.extend(t.inverse().as_list())
+            params.extend(t.quaternion.as_list())
+
+        local_point = cache.make_node("_instances_to", params, [point])
+        return cache.make_node(
+            "_instances_from", [], [self.s.get_node(local_point, cache)]
+        )
+
+
+# Replacement for infinite bounding box coordinates in instancing parameters,
+# infinities are not safe with fast relaxed math in OpenCL.
+_INSTANCING_INFINITY = 1e30
+
+
+def _clamp_infinite(x):
+    return max(-_INSTANCING_INFINITY, min(x, _INSTANCING_INFINITY))
+
+
+def _bounding_volume_hierarchy(boxes):
+    """ Build a bounding volume hierarchy over a list of boxes by recursive median
+    splits along the longest axis.
+    Returns list of nodes in depth first order, each node is tuple
+    (bounding box, index of the node following its subtree, box index or -1). """
+    midpoints = [
+        (
+            util.Vector(*(_clamp_infinite(x) for x in box.a))
+            + util.Vector(*(_clamp_infinite(x) for x in box.b))
+        )
+        / 2
+        for box in boxes
+    ]
+    nodes = []
+
+    def build(indices):
+        box = functools.reduce(lambda a, b: a.union(b), (boxes[i] for i in indices))
+        node_index = len(nodes)
+
+        if len(indices) == 1:
+            nodes.append((box, node_index + 1, indices[0]))
+            return
+
+        nodes.append(None)  # Placeholder until the skip index is known
+
+        centers = util.BoundingBox.containing(midpoints[i] for i in indices)
+        size = centers.size()
+        axis = max(range(3), key=lambda i: size[i])
+        indices.sort(key=lambda i: midpoints[i][axis])
+        half = len(indices) // 2
+
+        build(indices[:half])
+        build(indices[half:])
+        nodes[node_index] = (box, len(nodes), -1)
+
+    build(list(range(len(boxes))))
+    return nodes
+
+
 class MirrorMixin:
     def __init__(self, s):
         self.check_dimension(s)
@@ -73,4 +73,152 @@ float4 polygon2d_op(__constant float* restrict* restrict params, float4 coords)
     return (float4)(normal.x, normal.y, 0, distance);
 }
 
+// Polygon with a bounding volume hierarchy of its edges.
+//
+// Parameters are:
+// point count, node count,
+// points (x, y),
+// nodes (box corner a, box corner b, second child index or first edge of a leaf,
+//        edge count of a leaf or zero for inner nodes),
+// edges of leaves (index of the edge end point).
+// Nodes are in depth first order, first child of an inner node directly follows it.
+// Edge i goes from point i - 1 to point i.
+//
+// Nearest edge is found by traversing the hierarchy nearer child first and
+// skipping nodes farther than the nearest edge found so far,
+// inside / outside is decided by the pseudo normal of the nearest feature.
+
+#define POLYGON2D_NODE_SIZE 6
+#define POLYGON2D_STACK_SIZE 32
+
+float2 polygon2d_point(__constant float* points, uint pointCount, int i)
+{
+    return vload2((i + pointCount) % pointCount, points);
+}
+
+float polygon2d_box_distance_squared(__constant float* node, float2 query)
+{
+    float2 a = vload2(0, node);
+    float2 b = vload2(1, node);
+    float2 d = fmax(fmax(a - query, query - b), 0);
+    return dot(d, d);
+}
+
+float4 polygon2d_bvh_op(__constant float* restrict* restrict params, float4 coords) {
+    uint pointCount = (*params)[0];
+    uint nodeCount = (*params)[1];
+    __constant float* points = *params + 2;
+    __constant float* nodes = points + 2 * pointCount;
+    __constant float* edges = nodes + POLYGON2D_NODE_SIZE * nodeCount;
+
+    *params = edges + pointCount;
+
+    float2 query = coords.xy;
+
+    float nearestDistanceSquared = INFINITY;
+    int nearestEdge = 0;
+    int nearestVertex = 0; // -1 for the edge start, 1 for the end, 0 for interior
+
+    uint stack[POLYGON2D_STACK_SIZE];
+    uint stackSize = 0;
+    uint index = 0;
+    while (true)
+    {
+        __constant float* node = nodes + POLYGON2D_NODE_SIZE * index;
+        uint edgeCount = node[5];
+        if (edgeCount == 0)
+        {
+            uint near = index + 1;
+            uint far = node[4];
+            float nearDistance = polygon2d_box_distance_squared(
+                nodes + POLYGON2D_NODE_SIZE * near, query);
+            float farDistance = polygon2d_box_distance_squared(
+                nodes + POLYGON2D_NODE_SIZE * far, query);
+            if (farDistance < nearDistance)
+            {
+                uint tmp = near;
+                near = far;
+                far = tmp;
+                float tmpDistance = nearDistance;
+                nearDistance = farDistance;
+                farDistance = tmpDistance;
+            }
+
+            if (farDistance < nearestDistanceSquared)
+                stack[stackSize++] = far;
+            if (nearDistance < nearestDistanceSquared)
+            {
+                index = near;
+                continue;
+            }
+        }
+        else
+        {
+            uint first = node[4];
+            for (uint i = first; i < first + edgeCount; ++i)
+            {
+                int edge = edges[i];
+                float2 a = polygon2d_point(points, pointCount, edge - 1);
+                float2 direction = polygon2d_point(points, pointCount, edge) - a;
+                float2 toQuery = query - a;
+                float t = dot(direction, toQuery) / dot(direction, direction);
+                float2 toCandidate = toQuery - clamp(t, 0.0f, 1.0f) * direction;
+                float distanceSquared = dot(toCandidate, toCandidate);
+
+                if (distanceSquared < nearestDistanceSquared)
+                {
+                    nearestDistanceSquared = distanceSquared;
+                    nearestEdge = edge;
+                    nearestVertex = t < 0 ? -1 : (t > 1 ? 1 : 0);
+                }
+            }
+        }
+
+        // Continue with a node from the stack that can still contain something nearer
+        bool found = false;
+        while (!found && stackSize > 0)
+        {
+            index = stack[--stackSize];
+            found = polygon2d_box_distance_squared(nodes + POLYGON2D_NODE_SIZE * index,
+                                                   query) < nearestDistanceSquared;
+        }
+        if (!found)
+            break;
+    }
+
+    float2 previousPoint = polygon2d_point(points, pointCount, nearestEdge - 1);
+    float2 currentPoint = polygon2d_point(points, pointCount, nearestEdge);
+    float2 direction = currentPoint - previousPoint;
+    float2 segmentNormal = (float2)(-direction.y, direction.x);
+
+    float distance = sqrt(nearestDistanceSquared);
+    float2 normal;
+    if (nearestVertex == 0)
+    {
+        normal = normalize(segmentNormal);
+        if (dot(segmentNormal, query - previousPoint) < 0)
+            distance = -distance;
+    }
+    else
+    {
+        int vertexIndex = nearestVertex < 0 ? nearestEdge - 1 : nearestEdge;
+        float2 vertex = polygon2d_point(points, pointCount, vertexIndex);
+        float2 before = vertex - polygon2d_point(points, pointCount, vertexIndex - 1);
+        float2 after = polygon2d_point(points, pointCount, vertexIndex + 1) - vertex;
+        float2 pseudoNormal = normalize((float2)(-before.y, before.x)) +
+                              normalize((float2)(-after.y, after.x));
+
+        if (dot(pseudoNormal, query - vertex) < 0)
+            distance = -distance;
+
+        if (nearestDistanceSquared > FLT_EPSILON)
+            normal = (query - vertex) / distance;
+        else
+            // If query is too close to the vertex, we can't use it for normal
+            normal = normalize(segmentNormal);
+    }
+
+    return (float4)(normal.x, normal.y, 0, distance);
+}
+
 // vim: filetype=c
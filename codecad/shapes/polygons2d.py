@@ -131,97 +131,246 @@ class Polygon2DBuilder:
         return self
 
 
-class Polygon2D(base.Shape2D):
-    """ 2D simple (without self intersections) polygon.
-    First and last point are implicitly connected. """
-
-    def __init__(self, points):
-        self.points = numpy.asarray(
-            [util.types.wrap_vector_like(p).as_tuple2() for p in points],
-            dtype=numpy.float32,
-            order="c",
-        )
-        if self.points.shape[0] < 3:
-            raise ValueError("Polygon must have at least three vertices")
-
-        area = util.KahanSummation()
-        minimum = util.Vector.splat(float("inf"))
-        maximum = -minimum
-        feature_size = float("inf")
-        previous = util.Vector(*self.points[-1])
-        for i, current in enumerate(self.points):
-            current = util.Vector(*current)
-            direction = current - previous
-            direction_abs_squared = direction.abs_squared()
-            perpendicular_direction = direction.perpendicular2d()
-
-            area += direction.x * (previous.y + current.y) / 2
-
-            minimum = minimum.min(current)
-            maximum = maximum.max(current)
-
-            if direction_abs_squared == 0:
-                raise ValueError("Zero length segments are not allowed in polygon")
+# Polygons with at least this many vertices get the edge hierarchy by default
+ACCELERATION_THRESHOLD = 64
 
-            inner_previous = current
-            for j, inner_current in enumerate(self.points[i + 1 :]):
-                inner_current = util.Vector(*inner_current)
-                inner_direction = inner_current - inner_previous
+# Maximal number of edges in a leaf of the edge hierarchy
+_LEAF_SIZE = 4
 
-                inner_perpendicular_direction = inner_direction.perpendicular2d()
+# Must match POLYGON2D_STACK_SIZE in polygons2d.cl
+_MAX_HIERARCHY_DEPTH = 32
+
+
+def _edge_hierarchy(points):
+    """ Build parameters of polygon2d_bvh node for a polygon given as an array of
+    points (see polygons2d.cl for the layout).
+    The hierarchy is built by median splits of edge midpoints along the longest
+    axis, leaves contain at most _LEAF_SIZE edges. """
+    points = numpy.asarray(points, dtype=numpy.float64)
+    count = len(points)
+
+    # Edge i goes from point i - 1 to point i
+    starts = numpy.roll(points, 1, axis=0)
+    edge_min = numpy.minimum(starts, points)
+    edge_max = numpy.maximum(starts, points)
+    midpoints = (starts + points) / 2
+
+    nodes = []
+    edges = []
+
+    def build(indices, depth):
+        assert depth < _MAX_HIERARCHY_DEPTH
+        node_index = len(nodes)
+        node = [*edge_min[indices].min(axis=0), *edge_max[indices].max(axis=0), 0, 0]
+        nodes.append(node)
+
+        if len(indices) <= _LEAF_SIZE:
+            node[4] = len(edges)
+            node[5] = len(indices)
+            edges.extend(indices.tolist())
+            return
+
+        centers = midpoints[indices]
+        axis = numpy.argmax(centers.max(axis=0) - centers.min(axis=0))
+        half = len(indices) // 2
+        split = numpy.argpartition(centers[:, axis], half)
+
+        build(indices[split[:half]], depth + 1)
+        node[4] = len(nodes)
+        build(indices[split[half:]], depth + 1)
+
+        assert node_index + 1 < node[4]
+
+    build(numpy.arange(count), 0)
+
+    return numpy.concatenate(
+        [[count, len(nodes)], points.ravel(), numpy.ravel(nodes), edges]
+    ).astype(numpy.float32)
+
+
+# Tolerance for detecting parallel and collinear edges
+_PARALLEL_EPSILON = 1e-12
+
+# Relative slack in comparing edge bounding boxes when looking for intersection
+# candidates, covers rounding of the single precision intersection tests
+_BOX_EPSILON = 1e-5
+
+
+def _perpendicular(directions):
+    """ Vectorized util.Vector.perpendicular2d """
+    return numpy.column_stack((directions[:, 1], -directions[:, 0]))
+
+
+def _dot(a, b):
+    return a[:, 0] * b[:, 0] + a[:, 1] * b[:, 1]
+
+
+def _candidate_edge_pairs(starts, directions):
+    """ Return arrays (i, j), i < j of indices of all edges whose bounding boxes
+    overlap, found by sweeping along the X axis. """
+    count = len(starts)
+    starts = starts.astype(numpy.float64)
+    ends = starts + directions
+    slack = _BOX_EPSILON * max(1, abs(starts).max())
+    low = numpy.minimum(starts, ends) - slack
+    high = numpy.maximum(starts, ends) + slack
+
+    order = numpy.argsort(low[:, 0], kind="stable")
+    # Edges overlapping edge order[k] in X are at positions k + 1 ... stops[k] - 1
+    stops = numpy.searchsorted(low[order, 0], high[order, 0], side="right")
+    pair_counts = numpy.maximum(stops - numpy.arange(count) - 1, 0)
+    first = numpy.repeat(numpy.arange(count), pair_counts)
+    second = (
+        first
+        + 1
+        + numpy.arange(len(first))
+        - numpy.repeat(numpy.cumsum(pair_counts) - pair_counts, pair_counts)
+    )
+    first = order[first]
+    second = order[second]
+
+    y_overlap = (low[first, 1] <= high[second, 1]) & (low[second, 1] <= high[first, 1])
+    first = first[y_overlap]
+    second = second[y_overlap]
+    return numpy.minimum(first, second), numpy.maximum(first, second)
+
+
+def _check_edges(starts, directions):
+    """ Raise ValueError if the polygon given by edge starting points and
+    directions is not simple.
+    Checks are the same as comparing every pair of edges in order and reporting
+    the first problem found, but only pairs with overlapping bounding boxes are
+    compared, all at once. """
+    count = len(starts)
+    perpendicular = _perpendicular(directions)
+    errors = []  # Tuples (edge index, other edge index, message)
+
+    zero_length = _dot(directions, directions) == 0
+    if zero_length.any():
+        errors.append(
+            (
+                numpy.argmax(zero_length),
+                -1,
+                "Zero length segments are not allowed in polygon",
+            )
+        )
 
-                direction_cross_product = inner_direction.dot(perpendicular_direction)
-                between_starts = previous - inner_previous
+    # Consecutive segments always intersect, but we must check that they are
+    # not collinear and in opposite direction
+    i = numpy.concatenate(([0], numpy.arange(count - 1)))
+    j = numpy.concatenate(([count - 1], numpy.arange(1, count)))
+    anti_parallel = (
+        abs(_dot(directions[j], perpendicular[i])) < _PARALLEL_EPSILON
+    ) & (_dot(directions[i], directions[j]) < 0)
+    if anti_parallel.any():
+        k = numpy.lexsort((j[anti_parallel], i[anti_parallel]))[0]
+        errors.append(
+            (
+                i[anti_parallel][k],
+                j[anti_parallel][k],
+                "Polygon cannot be self intersecting (anti-parallel consecutive edges)",
+            )
+        )
 
-                feature_size = min(feature_size, abs(between_starts))
+    i, j = _candidate_edge_pairs(starts, directions)
+    non_consecutive = (j - i > 1) & ((i > 0) | (j < count - 1))
+    i = i[non_consecutive]
+    j = j[non_consecutive]
 
-                consecutive = j in (0, len(points) - 2)  # i precedes or follows j
-                parallel = abs(direction_cross_product) < 1e-12
+    cross_product = _dot(directions[j], perpendicular[i])
+    between_starts = starts[i] - starts[j]
+    parallel = abs(cross_product) < _PARALLEL_EPSILON
 
-                if consecutive:
-                    # Consecutive segments always intersect, but we must check that they are
-                    # not collinear and in opposite direction
-                    if parallel and direction.dot(inner_direction) < 0:
-                        raise ValueError(
-                            "Polygon cannot be self intersecting (anti-parallel consecutive edges)"
-                        )
-                else:
-                    if parallel:
-                        if abs(between_starts.dot(perpendicular_direction)) < 1e-12:
-                            # collinear
-                            scaled_direction = direction / direction_abs_squared
-                            t1 = between_starts.dot(scaled_direction)
-                            t2 = t1 + inner_direction.dot(scaled_direction)
+    with numpy.errstate(divide="ignore", invalid="ignore"):
+        collinear = parallel & (
+            abs(_dot(between_starts, perpendicular[i])) < _PARALLEL_EPSILON
+        )
+        scaled_direction = directions[i] / _dot(directions[i], directions[i])[
+            :, numpy.newaxis
+        ]
+        # Start and end of edge j as parameters along edge i
+        t1 = _dot(starts[j] - starts[i], scaled_direction)
+        t2 = t1 + _dot(directions[j], scaled_direction)
+        overlapping = (
+            collinear & (numpy.maximum(t1, t2) >= 0) & (numpy.minimum(t1, t2) <= 1)
+        )
 
-                            t1, t2 = sorted([t1, t2])
+        tmp = between_starts / cross_product[:, numpy.newaxis]
+        t1 = _dot(tmp, _perpendicular(directions[j]))
+        t2 = _dot(tmp, perpendicular[i])
+        crossing = (~parallel) & (0 <= t1) & (t1 <= 1) & (0 <= t2) & (t2 <= 1)
+
+    for mask, message in [
+        (overlapping, "Polygon cannot be self intersecting (colinear segments)"),
+        (crossing, "Polygon cannot be self intersecting"),
+    ]:
+        if mask.any():
+            k = numpy.lexsort((j[mask], i[mask]))[0]
+            errors.append((i[mask][k], j[mask][k], message))
+
+    if errors:
+        raise ValueError(min(errors)[2])
+
+
+def _nearest_vertex_distance(points):
+    """ Return the smallest distance between two vertices of the polygon.
+    Vertices are sorted along the longer axis and compared with increasingly
+    distant neighbors in that order until the gap along the axis alone is
+    larger than the best distance found. """
+    axis = numpy.argmax(points.max(axis=0) - points.min(axis=0))
+    points = points[numpy.argsort(points[:, axis], kind="stable")]
+
+    best = float("inf")
+    for k in range(1, len(points)):
+        differences = points[k:] - points[:-k]
+        if differences[:, axis].min() >= best:
+            break
+        distances_squared = _dot(differences, differences).astype(numpy.float64)
+        best = min(best, numpy.sqrt(distances_squared).min())
+    return float(best)
 
-                            if t2 >= 0 and t1 <= 1:
-                                raise ValueError(
-                                    "Polygon cannot be self intersecting (colinear segments)"
-                                )
 
-                        else:
-                            # parallel
-                            pass
-                    else:
-                        tmp = between_starts / direction_cross_product
+class Polygon2D(base.Shape2D):
+    """ 2D simple (without self intersections) polygon.
+    First and last point are implicitly connected.
 
-                        t1 = tmp.dot(inner_perpendicular_direction)
-                        t2 = tmp.dot(perpendicular_direction)
+    Polygons with many vertices are evaluated using a bounding volume hierarchy
+    of the edges, so that the evaluation cost grows roughly logarithmically with
+    the number of vertices.
+    `accelerate` can be set to True or False to override the default choice
+    based on ACCELERATION_THRESHOLD. """
 
-                        if 0 <= t1 <= 1 and 0 <= t2 <= 1:
-                            raise ValueError("Polygon cannot be self intersecting")
+    def __init__(self, points, accelerate=None):
+        self.points = numpy.asarray(
+            [util.types.wrap_vector_like(p).as_tuple2() for p in points],
+            dtype=numpy.float32,
+            order="c",
+        )
+        if self.points.shape[0] < 3:
+            raise ValueError("Polygon must have at least three vertices")
 
-                inner_previous = inner_current
+        # All checks work with the single precision points,
+        # edge i goes from point i - 1 to point i
+        points = self.points
+        starts = numpy.roll(points, 1, axis=0)
+        directions = points - starts
 
-            previous = current
+        area = math.fsum(directions[:, 0] * (starts[:, 1] + points[:, 1]) / 2)
+        _check_edges(starts, directions)
+        feature_size = _nearest_vertex_distance(points)
 
-        if area.result < 0:
+        if area < 0:
             self.points = numpy.flipud(self.points)
 
+        minimum = util.Vector(*self.points.min(axis=0))
+        maximum = util.Vector(*self.points.max(axis=0))
         self.box = util.BoundingBox(minimum, maximum)
         self._feature_size = feature_size
 
+        if accelerate is None:
+            accelerate = len(self.points) >= ACCELERATION_THRESHOLD
+        self._hierarchy = _edge_hierarchy(self.points) if accelerate else None
+
     def bounding_box(self):
         return self.box
 
@@ -229,6 +378,8 @@ class Polygon2D(base.Shape2D):
         return self._feature_size
 
     def get_node(self, point, cache):
+        if self._hierarchy is not None:
+            return cache.make_node("polygon2d_bvh", self._hierarchy, [point])
         return cache.make_node(
             "polygon2d", util.Concatenate([len(self.points)], self.points.flat), [point]
         )
@@ -165,6 +165,10 @@ class Transformation2D(common.TransformationMixin, base.Shape2D):
             )
 
 
+class Instances2D(common.InstancesMixin, base.Shape2D):
+    pass
+
+
 class Mirror2D(common.MirrorMixin, base.Shape2D):
     pass
 
@@ -80,6 +80,10 @@ class Transformation(common.TransformationMixin, base.Shape3D):
             )
 
 
+class Instances(common.InstancesMixin, base.Shape3D):
+    pass
+
+
 class Mirror(common.MirrorMixin, base.Shape3D):
     pass
 
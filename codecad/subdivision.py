@@ -89,7 +89,7 @@ class _Helper:
         intersecting_indices = self.list.read()
 
         int_intersecting_pos = [
-            util.Vector(i, j, k) * int_box_step + self.int_box_corner
+            util.Vector(int(i), int(j), int(k)) * int_box_step + self.int_box_corner
             for i, j, k, l in intersecting_indices[:intersecting_count]
         ]
 
@@ -1,6 +1,7 @@
 """ Contains shapes for other tests to use. """
 import pytest
 from codecad.shapes import *
+from codecad.util import Transformation
 
 import test_polygons2d
 
@@ -66,10 +67,21 @@ shapes_2d = {
     "regular_polygon3": regular_polygon2d(3),
     "symmetrical_xy": circle(d=2).translated(2, 1.75).symmetrical_x().symmetrical_y(),
     "rotated_pattern_2d": circle(1, 1).translated_x(2).rotated(270, 3),
+    "instances_2d": instances(
+        rectangle(1, 2) + circle(1).translated_y(1),
+        [
+            Transformation.from_degrees((0, 0, 1), 30 * i, 1, (i - 2, (i % 2) * 2, 0))
+            for i in range(5)
+        ],
+    ),
 }
 shapes_2d.update(
     ("polygon2d_" + k, polygon2d(v)) for k, v in test_polygons2d.valid_polygon2d.items()
 )
+shapes_2d.update(
+    ("polygon2d_accelerated_" + k, polygon2d(v, accelerate=True))
+    for k, v in test_polygons2d.valid_polygon2d.items()
+)
 params_2d = [pytest.param(v, id=k) for k, v in sorted(shapes_2d.items())]
 
 shapes_3d = {
@@ -92,5 +104,25 @@ shapes_3d = {
     .symmetrical_y()
     .symmetrical_z(),
     "rotated_pattern_3d": box(1, 1, 1).translated_x(2).rotated((1, -1, 0), 270, 3),
+    "instances_3d": instances(
+        cylinder(d=1, h=3) + sphere(1.5).translated_z(1.5),
+        [
+            Transformation.from_degrees((1, 1, 0), 40 * i, 1, (i % 3, i // 3, i - 4))
+            for i in range(9)
+        ],
+    ),
+    "nested_instances": instances(
+        instances(
+            box(1, 0.5, 0.5),
+            [
+                Transformation.from_degrees((0, 0, 1), 45 * i, 1, (0, 0, 0))
+                for i in range(3)
+            ],
+        ),
+        [
+            Transformation.from_degrees((0, 1, 0), 10 * i, 1, (2 * i - 4, 0, 0))
+            for i in range(5)
+        ],
+    ),
 }
 params_3d = [pytest.param(v, id=k) for k, v in sorted(shapes_3d.items())]
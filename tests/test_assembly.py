@@ -132,3 +132,53 @@ def test_visible_bom():
 
     assert len(list(asm.bom())) == 2
     assert len(list(asm.bom(visible_only=True))) == 1
+
+
+def test_bom_duplicate_names():
+    o = codecad.shapes.sphere()
+    asm = codecad.assembly("test", [o.make_part("x") for i in range(3)])
+
+    assert [item.name for item in asm.bom()] == ["x", "x-2", "x-3"]
+
+
+def test_large_assembly_bom():
+    """ Synthetic assembly with 10k fastener instances in nested subassemblies """
+    screw = codecad.shapes.cylinder(d=3, h=10).make_part("screw")
+    nut = codecad.shapes.sphere(5).make_part("nut")
+
+    row = codecad.assembly(
+        "row",
+        [screw.translated_x(i) for i in range(100)]
+        + [nut.translated_x(i) for i in range(50)],
+    )
+    plate = codecad.assembly("plate", [row.translated_y(i) for i in range(10)])
+    asm = codecad.assembly("asm", [plate.translated_z(i) for i in range(10)])
+
+    instances = list(asm.all_instances())
+    assert len(instances) == 15000
+    assert list(asm.all_instances())[-1] is instances[-1]  # Flattening is cached
+    assert not hasattr(asm.part, "__dict__")
+
+    bom = {item.name: item.count for item in asm.bom()}
+    assert bom == {"screw": 10000, "nut": 5000}
+
+    last = instances[149]
+    assert last.part is nut.part
+    assert last.transform.offset == pytest.approx((49, 0, 0))
+    last = instances[-1]
+    assert last.transform.offset == pytest.approx((49, 9, 9))
+
+
+def test_repeated_parts_instancing():
+    """ Program size of an assembly grows only by the instance table
+    when adding more copies of the same part """
+    screw = (
+        codecad.shapes.cylinder(d=3, h=10) + codecad.shapes.sphere(5).translated_z(5)
+    ).make_part("screw")
+
+    def program_size(n):
+        asm = codecad.assembly("asm", [screw.translated_x(5 * i) for i in range(n)])
+        return len(codecad.nodes.make_program(asm.shape()))
+
+    per_instance = (program_size(200) - program_size(100)) / 100
+    assert per_instance < 30
@@ -363,3 +363,30 @@ def test_indexing_prefix_sum():
         assert offset + n <= len(flags)
         assert not numpy.any(flags[offset : offset + n])
         flags[offset : offset + n] = True
+
+
+@pytest.mark.parametrize("count", [1, 255, 256, 257, 70000])
+def test_indexing_prefix_sum_class(count):
+    max_count = 100000
+    prefix_sum = codecad.cl_util.parallel_sum.IndexingPrefixSum(max_count)
+
+    buffer = codecad.cl_util.Buffer(
+        pyopencl.cltypes.uint, max_count, pyopencl.mem_flags.READ_WRITE
+    )
+
+    counts = numpy.arange(max_count, dtype=buffer.dtype) % 5
+
+    ev = buffer.enqueue_write(counts)
+    ev = prefix_sum.enqueue(buffer, count, wait_for=[ev])
+    buffer.read(wait_for=[ev])
+    total = prefix_sum.total.read(wait_for=[ev])[0]
+
+    counts = counts[:count]
+    offsets = buffer[:count]
+
+    assert total == numpy.sum(counts)
+
+    flags = numpy.zeros(total, dtype=numpy.uint32)
+    for n, offset in zip(counts, offsets):
+        flags[offset : offset + n] += 1
+    assert numpy.all(flags == 1)
@@ -0,0 +1,64 @@
+import pytest
+from pytest import approx
+
+import codecad
+
+
+@pytest.fixture(scope="module")
+def asm():
+    plate = codecad.shapes.box(10).make_part("plate")
+    ball = codecad.shapes.sphere(4).make_part("ball")
+    return codecad.assembly(
+        "asm",
+        [
+            plate,
+            plate.translated_x(9),  # Overlaps the first plate
+            plate.translated_x(-10),  # Touches the first plate
+            ball.translated_x(30),
+            ball.translated_x(35),  # 1 unit gap between the balls
+            ball.translated_x(37).hidden(),  # Overlaps the previous ball, but hidden
+        ],
+    )
+
+
+def _summary(interferences):
+    return sorted((i.first.name, i.second.name, i.volume) for i in interferences)
+
+
+@pytest.mark.parametrize(
+    "clearance, expected",
+    [
+        pytest.param(0, [("plate", "plate", 100)], id="no_clearance"),
+        pytest.param(
+            0.5,
+            [("plate", "plate", 50), ("plate", "plate", 150)],
+            id="small_clearance",
+        ),
+        pytest.param(
+            2,
+            [("ball", "ball", None), ("plate", "plate", 200), ("plate", "plate", 300)],
+            id="large_clearance",
+        ),
+    ],
+)
+def test_interferences(asm, clearance, expected):
+    result = _summary(asm.interferences(0.1, clearance))
+
+    assert len(result) == len(expected)
+    for (first, second, volume), expected_item in zip(result, expected):
+        assert (first, second) == expected_item[:2]
+        assert volume > 0
+        if expected_item[2] is not None:
+            assert volume == approx(expected_item[2], rel=0.05)
+
+
+def test_candidate_pairs_many_parts():
+    """ Broad phase only checks neighbors in a long row of parts """
+    boxes = [
+        codecad.util.BoundingBox(
+            codecad.util.Vector(i, 0, 0), codecad.util.Vector(i + 1.5, 1, 1)
+        )
+        for i in range(1000)
+    ]
+    pairs = set(codecad.interference._candidate_pairs(boxes))
+    assert pairs == {(i, i + 1) for i in range(999)}
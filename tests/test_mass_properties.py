@@ -106,3 +106,39 @@ def test_mass_properties(shape, volume, centroid, inertia_tensor):
 
     if inertia_tensor is not None:
         assert numpy.allclose(result.inertia_tensor, inertia_tensor, rtol=precision)
+
+
+@pytest.mark.parametrize(
+    "shape, area",
+    [
+        pytest.param(codecad.shapes.box(1), 6, id="unit_box"),
+        pytest.param(codecad.shapes.sphere(d=2), 4 * math.pi, id="sphere"),
+        pytest.param(
+            codecad.shapes.cylinder(h=2, r=4),
+            2 * math.pi * 4 ** 2 + 2 * math.pi * 4 * 2,
+            id="cylinder",
+        ),
+        pytest.param(
+            codecad.shapes.circle(d=4).translated_x(3).revolved(),
+            4 * math.pi ** 2 * 3 * 2,
+            id="torus",
+        ),
+        pytest.param(
+            codecad.shapes.sphere(d=2).translated(-15, 0, 0)
+            + codecad.shapes.sphere(d=2).translated(15, 0, 0),
+            8 * math.pi,
+            id="two_spheres",
+        ),
+        pytest.param(
+            codecad.shapes.box(2, 3, 5).rotated((7, 11, 13), 17),
+            2 * (2 * 3 + 2 * 5 + 3 * 5),
+            id="drunk_box",
+        ),
+    ],
+)
+def test_surface_area(shape, area):
+    result = codecad.surface_area(shape, 0.02)
+
+    # Sharp edges cause error proportional to the band width, smooth surfaces
+    # are much more precise.
+    assert result == approx(area, rel=1e-2)
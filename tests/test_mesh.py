@@ -1,19 +1,30 @@
 import functools
+import itertools
+import xml.etree.ElementTree
+import zipfile
 
+import numpy
 import pytest
+import stl.mesh
 import trimesh
 
 import codecad
 import codecad.rendering.mesh
+import codecad.rendering.stl_renderer
+import codecad.rendering.mesh_formats
+import codecad.rendering.dual_contouring
 
 shapes = [codecad.shapes.box(10), codecad.shapes.sphere(10)]
 
 
 @pytest.mark.parametrize("shape", shapes)
 @pytest.mark.parametrize("grid_size", [2, 12, 16])
-def test_watertight(shape, grid_size):
+@pytest.mark.parametrize(
+    "use_mcubes", [pytest.param(False, id="opencl"), pytest.param(True, id="mcubes")]
+)
+def test_watertight(shape, grid_size, use_mcubes):
     blocks = codecad.rendering.mesh.triangular_mesh(
-        shape, subdivision_grid_size=grid_size
+        shape, subdivision_grid_size=grid_size, use_mcubes=use_mcubes
     )
 
     mesh = functools.reduce(
@@ -27,4 +38,213 @@ def test_watertight(shape, grid_size):
     # mesh.show()
 
     assert mesh.is_watertight
+    assert mesh.volume > 0  # Faces are oriented outwards
     # TODO: Check that there are no coplanar faces ... or something
+
+
+@pytest.mark.parametrize(
+    "use_mcubes", [pytest.param(False, id="opencl"), pytest.param(True, id="mcubes")]
+)
+def test_pipelined_order(use_mcubes):
+    shape = codecad.shapes.sphere(10) - codecad.shapes.box(8).translated(5, 5, 5)
+
+    def blocks(blocks_in_flight):
+        return list(
+            codecad.rendering.mesh.triangular_mesh(
+                shape,
+                subdivision_grid_size=4,
+                use_mcubes=use_mcubes,
+                blocks_in_flight=blocks_in_flight,
+            )
+        )
+
+    sequential = blocks(1)
+    pipelined = blocks(4)
+
+    assert len(sequential) == len(pipelined)
+    for (v1, t1), (v2, t2) in zip(sequential, pipelined):
+        assert (v1 == v2).all()
+        assert (t1 == t2).all()
+
+
+@pytest.mark.parametrize("grid_size", [4, 16])
+def test_welded_mesh(grid_size):
+    shape = codecad.shapes.sphere(10) + codecad.shapes.cylinder(d=1, h=24)
+
+    mesh = codecad.rendering.mesh.welded_mesh(shape, subdivision_grid_size=grid_size)
+    assert mesh.is_watertight()
+
+    reference = trimesh.Trimesh(vertices=mesh.vertices, faces=mesh.triangles)
+    assert reference.is_watertight
+    assert len(reference.vertices) == len(mesh.vertices)  # Nothing left to merge
+    assert reference.volume > 0
+
+    # Removing a triangle breaks the watertightness
+    assert not codecad.rendering.mesh.IndexedMesh(
+        mesh.vertices, mesh.triangles[1:]
+    ).is_watertight()
+
+
+def test_stl_export(tmpdir):
+    shape = codecad.shapes.sphere(10) + codecad.shapes.cylinder(d=1, h=24)
+    filename = str(tmpdir.join("out.stl"))
+
+    codecad.rendering.stl_renderer.render_stl(shape, filename)
+
+    blocks = list(codecad.rendering.mesh.triangular_mesh(shape))
+    expected = numpy.concatenate(
+        [vertices[indices] for vertices, indices in blocks]
+    ).reshape(-1, 9)
+
+    loaded = stl.mesh.Mesh.from_file(filename)
+    assert numpy.array_equal(loaded.vectors.reshape(-1, 9), expected)
+
+    records = numpy.fromfile(
+        filename, dtype=codecad.rendering.stl_renderer.STL_TRIANGLE_DTYPE, offset=84
+    )
+    normals = loaded.normals / numpy.linalg.norm(loaded.normals, axis=1, keepdims=True)
+    assert numpy.allclose(records["normal"], normals, atol=1e-5)
+
+
+@pytest.fixture(scope="module")
+def indexed_mesh():
+    shape = codecad.shapes.sphere(10) + codecad.shapes.cylinder(d=1, h=24)
+    return codecad.rendering.mesh.welded_mesh(shape)
+
+
+@pytest.mark.parametrize("file_type", ["ply", "obj"])
+def test_indexed_export(tmpdir, indexed_mesh, file_type):
+    filename = str(tmpdir.join("out." + file_type))
+    writer = getattr(codecad.rendering.mesh_formats, "write_" + file_type)
+    with open(filename, "wb") as fp:
+        writer(fp, indexed_mesh)
+
+    loaded = trimesh.load(filename, process=False)
+    assert numpy.allclose(loaded.vertices, indexed_mesh.vertices)
+    assert numpy.array_equal(loaded.faces, indexed_mesh.triangles)
+
+
+def test_3mf_export(tmpdir, indexed_mesh):
+    filename = str(tmpdir.join("out.3mf"))
+    with open(filename, "wb") as fp:
+        codecad.rendering.mesh_formats.write_3mf(fp, indexed_mesh)
+
+    with zipfile.ZipFile(filename) as package:
+        assert "[Content_Types].xml" in package.namelist()
+        assert "_rels/.rels" in package.namelist()
+        model = xml.etree.ElementTree.fromstring(package.read("3D/3dmodel.model"))
+
+    ns = {"m": "http://schemas.microsoft.com/3dmanufacturing/core/2015/02"}
+    vertices = [
+        [float(v.get(c)) for c in "xyz"]
+        for v in model.iterfind(".//m:vertices/m:vertex", ns)
+    ]
+    triangles = [
+        [int(t.get(c)) for c in ["v1", "v2", "v3"]]
+        for t in model.iterfind(".//m:triangles/m:triangle", ns)
+    ]
+    assert numpy.allclose(vertices, indexed_mesh.vertices)
+    assert numpy.array_equal(triangles, indexed_mesh.triangles)
+
+
+dual_contouring_shapes = [
+    pytest.param(codecad.shapes.sphere(10), id="sphere"),
+    pytest.param(codecad.shapes.box(10), id="box"),
+    pytest.param(
+        codecad.shapes.sphere(8) - codecad.shapes.box(6).translated(3, 3, 3),
+        id="cut_sphere",
+    ),
+    pytest.param(
+        codecad.shapes.sphere(10) + codecad.shapes.cylinder(d=1, h=24),
+        id="sphere_with_rod",
+    ),
+]
+
+
+@pytest.mark.parametrize("shape", dual_contouring_shapes)
+@pytest.mark.parametrize("grid_size", [17, None])
+def test_dual_contouring(shape, grid_size):
+    resolution = 0.2
+
+    uniform = codecad.rendering.dual_contouring.dual_contouring_mesh(
+        shape, resolution, max_level=0, subdivision_grid_size=grid_size
+    )
+    adaptive = codecad.rendering.dual_contouring.dual_contouring_mesh(
+        shape, resolution, subdivision_grid_size=grid_size
+    )
+
+    assert uniform.is_watertight()
+    assert adaptive.is_watertight()
+    assert len(adaptive.triangles) < len(uniform.triangles) / 4
+
+    volume = codecad.mass_properties(shape, resolution / 4).volume
+    for indexed_mesh in [uniform, adaptive]:
+        mesh_volume = trimesh.Trimesh(
+            vertices=indexed_mesh.vertices, faces=indexed_mesh.triangles, process=False
+        ).volume
+        assert mesh_volume == pytest.approx(volume, rel=0.05)
+
+
+def test_dual_contouring_large_block():
+    """ Cell coordinates above 255 within a single block are kept apart """
+    shape = codecad.shapes.box(60, 0.6, 0.6)
+    box_size = (305, 5, 5)
+    extractor = codecad.rendering.dual_contouring._DualContouringExtractor(
+        codecad.nodes.make_program_buffer(shape), box_size, 0.995, 0
+    )
+
+    started = extractor.start_block(
+        box_size, codecad.util.Vector(-30.4, -0.4, -0.4), 0.2
+    )
+    result = extractor.finish_block(started)
+
+    inside = started[0][..., 3] < 0
+    corners = [
+        inside[i : i + 304, j : j + 4, k : k + 4]
+        for i, j, k in itertools.product([0, 1], repeat=3)
+    ]
+    expected = numpy.argwhere(numpy.any(corners, axis=0) & ~numpy.all(corners, axis=0))
+    assert expected[:, 0].max() > 255
+    assert sorted(map(tuple, result.cell_coords.tolist())) == sorted(
+        map(tuple, expected.tolist())
+    )
+
+
+def test_dual_contouring_sharp_features():
+    shape = codecad.shapes.box(10)
+    indexed_mesh = codecad.rendering.dual_contouring.dual_contouring_mesh(
+        shape, resolution=0.7
+    )
+
+    # Coarse grid, but corners of the box are still reproduced exactly
+    for corner in itertools.product([-5, 5], repeat=3):
+        distances = numpy.linalg.norm(indexed_mesh.vertices - corner, axis=1)
+        assert distances.min() == pytest.approx(0, abs=1e-4)
+
+    mesh_volume = trimesh.Trimesh(
+        vertices=indexed_mesh.vertices, faces=indexed_mesh.triangles, process=False
+    ).volume
+    assert mesh_volume == pytest.approx(1000, rel=1e-4)
+
+
+@pytest.mark.parametrize(
+    "use_mcubes", [pytest.param(False, id="opencl"), pytest.param(True, id="mcubes")]
+)
+def test_refine_vertices(use_mcubes):
+    shape = codecad.shapes.sphere(10)
+
+    def max_error(refine_iterations):
+        blocks = codecad.rendering.mesh.triangular_mesh(
+            shape, use_mcubes=use_mcubes, refine_iterations=refine_iterations
+        )
+        vertices = numpy.concatenate([vertices for vertices, _ in blocks])
+        return numpy.abs(numpy.linalg.norm(vertices, axis=1) - 5).max()
+
+    assert max_error(0) > 1e-2
+    assert max_error(2) < 1e-4
+
+
+def test_refine_welded_mesh():
+    shape = codecad.shapes.sphere(10) + codecad.shapes.cylinder(d=1, h=24)
+    indexed_mesh = codecad.rendering.mesh.welded_mesh(shape, refine_iterations=2)
+    assert indexed_mesh.is_watertight()
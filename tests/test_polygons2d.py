@@ -3,7 +3,9 @@ import io
 
 import pytest
 import numpy
+import pyopencl
 
+import codecad
 import codecad.shapes.polygons2d
 
 valid_polygon2d = {
@@ -21,6 +23,16 @@ valid_polygon2d = {
     ],
     "square": [(0, 0), (5, 0), (5, 5), (0, 5)],
     "parallel_same_direction_edges": [(0, 0), (6, -1), (5, 5), (5, 0), (0, 5)],
+    "collinear_opposite_edges": [
+        (0, 0),
+        (10, 0),
+        (10, 10),
+        (-5, 10),
+        (-5, 0),
+        (-8, 0),
+        (-8, -10),
+        (0, -10),
+    ],
 }
 
 invalid_polygon2d = {
@@ -84,6 +96,37 @@ def test_invalid_polygon_construction(points):
         codecad.shapes.polygons2d.Polygon2D(points)
 
 
+@pytest.mark.parametrize(
+    "name, message",
+    [
+        pytest.param("edge_crossing", "self intersecting$", id="crossing"),
+        pytest.param("shared_edge", r"\(colinear segments\)", id="collinear"),
+        pytest.param("shared_edge_part", r"\(anti-parallel", id="anti_parallel"),
+        pytest.param("duplicate_point_at_start", "Zero length", id="zero_length"),
+    ],
+)
+def test_invalid_polygon_message(name, message):
+    with pytest.raises(ValueError, match=message):
+        codecad.shapes.polygons2d.Polygon2D(invalid_polygon2d[name])
+
+
+def test_large_polygon_construction():
+    rng = numpy.random.RandomState(0)
+    angles = numpy.sort(rng.uniform(0, 2 * math.pi, 2000))
+    radii = rng.uniform(1, 1.1, len(angles))
+    points = numpy.column_stack((numpy.cos(angles) * radii, numpy.sin(angles) * radii))
+
+    shape = codecad.shapes.polygons2d.Polygon2D(points)
+
+    single = shape.points
+    distances = numpy.hypot(*(single[:, numpy.newaxis] - single[numpy.newaxis]).T)
+    distances[numpy.diag_indices(len(single))] = float("inf")
+    assert shape.feature_size() == pytest.approx(distances.min(), rel=1e-6)
+
+    with pytest.raises(ValueError):
+        codecad.shapes.polygons2d.Polygon2D(numpy.concatenate([points, [(0.5, 2)]]))
+
+
 @pytest.mark.parametrize(
     "points",
     [pytest.param(v, id=k) for k, v in sorted(valid_polygon2d.items())]
@@ -227,3 +270,71 @@ def test_polygon_builder_print():
 
     assert f.getvalue() == "[(0, 0), (1, 1)]\n"
     assert callable(new_builder.close)
+
+
+def _evaluate(shape, points):
+    """ Evaluate shape at an array of 2D points """
+    points = numpy.column_stack((points, numpy.zeros(len(points)))).astype(numpy.float32)
+    output = numpy.empty((len(points), 4), dtype=numpy.float32)
+    mf = pyopencl.mem_flags
+    points_buffer = pyopencl.Buffer(
+        codecad.cl_util.opencl_manager.context,
+        mf.READ_ONLY | mf.COPY_HOST_PTR,
+        hostbuf=points,
+    )
+    output_buffer = pyopencl.Buffer(
+        codecad.cl_util.opencl_manager.context, mf.WRITE_ONLY, output.nbytes
+    )
+    ev = codecad.cl_util.opencl_manager.k.points_eval(
+        (len(points),),
+        None,
+        codecad.nodes.make_program_buffer(shape),
+        points_buffer,
+        output_buffer,
+    )
+    pyopencl.enqueue_copy(
+        codecad.cl_util.opencl_manager.queue, output, output_buffer, wait_for=[ev]
+    )
+    return output
+
+
+def _star(n, inner=0.5):
+    angles = numpy.linspace(0, 2 * math.pi, 2 * n, endpoint=False)
+    radii = numpy.tile([1, inner], n)
+    return numpy.column_stack((numpy.cos(angles) * radii, numpy.sin(angles) * radii))
+
+
+@pytest.mark.parametrize(
+    "points",
+    [
+        pytest.param(_star(5), id="star5"),
+        pytest.param(_star(200, 0.9), id="star200"),
+        pytest.param(_star(300, 0.99) * (3, 0.2), id="flat_star300"),
+    ]
+    + [pytest.param(v, id=k) for k, v in sorted(valid_polygon2d.items())],
+)
+def test_accelerated_polygon_matches_brute_force(points):
+    accelerated = codecad.shapes.polygon2d(points, accelerate=True)
+    brute_force = codecad.shapes.polygon2d(points, accelerate=False)
+
+    box = brute_force.bounding_box()
+    rng = numpy.random.RandomState(0)
+    query = rng.uniform(
+        (box.a.x - 2, box.a.y - 2), (box.b.x + 2, box.b.y + 2), size=(2000, 2)
+    )
+    query = numpy.concatenate([query, rng.uniform(-1000, 1000, size=(50, 2))])
+
+    expected = _evaluate(brute_force, query)
+    actual = _evaluate(accelerated, query)
+
+    numpy.testing.assert_allclose(actual[:, 3], expected[:, 3], rtol=1e-5, atol=1e-5)
+    # Normals may differ where two features are equally distant
+    normals_match = numpy.all(
+        numpy.isclose(actual[:, :2], expected[:, :2], atol=1e-3), axis=1
+    )
+    assert normals_match.mean() > 0.99
+
+
+def test_polygon_acceleration_default():
+    assert codecad.shapes.polygon2d(_star(5))._hierarchy is None
+    assert codecad.shapes.polygon2d(_star(100))._hierarchy is not None
@@ -0,0 +1,118 @@
+import io
+import math
+import re
+import xml.etree.ElementTree
+
+import numpy
+import pytest
+
+import codecad
+import codecad.rendering.polyline_formats
+
+
+def _max_distance(points, polygon):
+    """ Maximal distance of points from outline of a closed polygon """
+    a = polygon[:, numpy.newaxis, :]
+    direction = numpy.roll(polygon, -1, axis=0)[:, numpy.newaxis, :] - a
+    offset = points[numpy.newaxis, :, :] - a
+    t = numpy.clip(
+        (offset * direction).sum(axis=2) / (direction * direction).sum(axis=2), 0, 1
+    )
+    distances = numpy.linalg.norm(offset - direction * t[:, :, numpy.newaxis], axis=2)
+    return distances.min(axis=0).max()
+
+
+def test_simplify_collinear():
+    side = numpy.linspace(0, 1, 50, endpoint=False)
+    square = numpy.concatenate(
+        [
+            numpy.column_stack((side, numpy.zeros_like(side))),
+            numpy.column_stack((numpy.ones_like(side), side)),
+            numpy.column_stack((1 - side, numpy.ones_like(side))),
+            numpy.column_stack((numpy.zeros_like(side), 1 - side)),
+        ]
+    )
+
+    simplified = codecad.rendering.polyline_formats.simplify(square, 1e-6)
+
+    assert sorted(map(tuple, simplified.tolist())) == [(0, 0), (0, 1), (1, 0), (1, 1)]
+
+
+@pytest.mark.parametrize("tolerance", [0.001, 0.01, 0.1])
+def test_simplify_tolerance(tolerance):
+    angles = numpy.linspace(0, 2 * math.pi, 2000, endpoint=False)
+    circle = numpy.column_stack((numpy.cos(angles), numpy.sin(angles) * 2))
+
+    simplified = codecad.rendering.polyline_formats.simplify(circle, tolerance)
+
+    assert 3 <= len(simplified) < len(circle)
+    assert _max_distance(circle, simplified) <= tolerance
+
+
+def test_svg_export():
+    shape = codecad.shapes.rectangle(2, 4) - codecad.shapes.circle(1)
+    polygons = list(codecad.rendering.polyline_formats.simplified_polygons(shape))
+    fp = io.StringIO()
+    codecad.rendering.polyline_formats.write_svg(
+        fp, polygons, shape.bounding_box(), precision=3
+    )
+
+    root = xml.etree.ElementTree.fromstring(fp.getvalue())
+    (path,) = root.iter("{http://www.w3.org/2000/svg}path")
+    d = path.get("d")
+    assert d.count("M") == d.count("Z") == len(polygons) == 2
+    assert d.count("L") == sum(len(polygon) - 1 for polygon in polygons)
+    assert all(re.fullmatch(r"-?\d+\.\d{3}", n) for n in re.split("[MLZ,]+", d)[1:-1])
+
+
+def test_dxf_export():
+    polygons = [
+        numpy.array([(0, 0), (2, 0), (2, 1.25)]),
+        numpy.array([(5, 5), (6, 5), (6, 6)]),
+    ]
+    fp = io.StringIO()
+    codecad.rendering.polyline_formats.write_dxf(fp, polygons, precision=2)
+
+    lines = fp.getvalue().split("\n")
+    pairs = list(zip(lines[0::2], lines[1::2]))
+    assert pairs[-1] == ("0", "EOF")
+    assert ("1", "AC1009") in pairs
+    # Only R12 header variables
+    assert ("9", "$INSUNITS") not in pairs
+    assert pairs.count(("0", "POLYLINE")) == 2
+    assert pairs.count(("0", "SEQEND")) == 2
+    assert pairs.count(("0", "VERTEX")) == 6
+
+    polyline = pairs.index(("0", "POLYLINE"))
+    assert pairs[polyline + 1 : polyline + 7] == [
+        ("8", "0"),
+        ("66", "1"),
+        ("70", "1"),
+        ("10", "0"),
+        ("20", "0"),
+        ("30", "0"),
+    ]
+
+    x = [float(value) for code, value in pairs[polyline:] if code == "10"]
+    y = [value for code, value in pairs[polyline:] if code == "20"]
+    assert x == [0, 0, 2, 2, 0, 5, 6, 6]
+    assert y[3] == "1.25"
+
+
+def test_dxf_export_readable():
+    ezdxf = pytest.importorskip("ezdxf")
+    shape = codecad.shapes.rectangle(2, 4) - codecad.shapes.circle(1)
+    polygons = list(codecad.rendering.polyline_formats.simplified_polygons(shape))
+    fp = io.StringIO()
+    codecad.rendering.polyline_formats.write_dxf(fp, polygons)
+
+    fp.seek(0)
+    document = ezdxf.read(fp)
+
+    assert document.dxfversion == "AC1009"
+    polylines = document.modelspace().query("POLYLINE")
+    assert len(polylines) == len(polygons) == 2
+    for polyline, polygon in zip(polylines, polygons):
+        assert polyline.is_closed
+        points = [tuple(vertex.dxf.location)[:2] for vertex in polyline.vertices]
+        numpy.testing.assert_allclose(points, polygon, atol=1e-4)
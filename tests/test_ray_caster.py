@@ -0,0 +1,241 @@
+import math
+
+import numpy
+import pytest
+
+import codecad
+import codecad.rendering.image
+from codecad.rendering import ray_caster
+
+_size = (90, 70)
+
+
+@pytest.fixture(scope="module")
+def scene():
+    shape = codecad.shapes.box(2) + codecad.shapes.sphere(1.5).translated_x(1)
+    camera_params = ray_caster.get_camera_params(shape.bounding_box(), _size, None)
+    return shape, camera_params, ray_caster.render(shape, *camera_params, _size)
+
+
+@pytest.mark.parametrize(
+    "tile_size, tile_order",
+    [
+        pytest.param(32, ray_caster.TileOrder.ordered, id="ordered"),
+        pytest.param(16, ray_caster.TileOrder.interleaved, id="interleaved"),
+        pytest.param(200, ray_caster.TileOrder.ordered, id="single_tile"),
+    ],
+)
+def test_tiled_render_matches(scene, tile_size, tile_order):
+    shape, camera_params, expected = scene
+
+    actual = ray_caster.render(
+        shape, *camera_params, _size, tile_size=tile_size, tile_order=tile_order
+    )
+
+    numpy.testing.assert_array_equal(actual, expected)
+
+
+@pytest.mark.parametrize(
+    "tile_order", [ray_caster.TileOrder.ordered, ray_caster.TileOrder.interleaved]
+)
+def test_tile_order_covers_image(tile_order):
+    corners = ray_caster._tile_corners((100, 50), 16, tile_order)
+
+    assert sorted(corners) == sorted(
+        (x, y) for x in range(0, 100, 16) for y in range(0, 50, 16)
+    )
+    if tile_order == ray_caster.TileOrder.ordered:
+        assert corners[:2] == [(0, 0), (16, 0)]
+    else:
+        # The first tiles are not all in the first row
+        assert len({y for x, y in corners[:4]}) > 1
+
+
+def test_progressive_render(scene):
+    shape, camera_params, expected = scene
+
+    tiles = ray_caster.render_tiles(
+        shape, *camera_params, _size, tile_size=32, preview_step=4
+    )
+    tiles = list(tiles)
+
+    assert [tile.step for tile in tiles] == [4] * 9 + [2] * 9 + [1] * 9
+
+    output = numpy.zeros_like(expected)
+    for tile in tiles:
+        step = tile.step
+        pixels = expected[tile.y : tile.y + 32 : step, tile.x : tile.x + 32 : step]
+        numpy.testing.assert_array_equal(tile.pixels, pixels)
+        if tile.step == 1:
+            height, width, _ = tile.pixels.shape
+            output[tile.y : tile.y + height, tile.x : tile.x + width] = tile.pixels
+
+    numpy.testing.assert_array_equal(output, expected)
+
+
+def test_cone_pre_pass(scene):
+    shape, camera_params, expected = scene
+    false_color = ray_caster.RenderOptions.false_color
+
+    without_cones = ray_caster.render(shape, *camera_params, _size, cone_size=0)
+    # Only pixels on edges grazed by the rays may end up on a different side
+    difference = abs(without_cones.astype(numpy.int32) - expected).max(axis=2)
+    assert numpy.mean(difference > 8) < 0.05
+
+    steps = [
+        ray_caster.render(
+            shape, *camera_params, _size, options=false_color, cone_size=cone_size
+        )[:, :, 0].mean()
+        for cone_size in [0, 8]
+    ]
+    assert steps[1] < steps[0]
+
+
+def test_render_views(scene):
+    shape, camera_params, expected = scene
+    cameras = ray_caster.get_orbit_camera_params(shape.bounding_box(), _size, None, 4)
+
+    views = list(ray_caster.render_views(shape, cameras, _size))
+
+    assert len(views) == 4
+    for camera, view in zip(cameras, views):
+        numpy.testing.assert_array_equal(view, ray_caster.render(shape, *camera, _size))
+    # Box and sphere look different from every side
+    for i in range(4):
+        assert not numpy.array_equal(views[i], views[i - 1])
+
+
+@pytest.mark.parametrize("elevation", [0, 30, -60])
+def test_orbit_camera_params(elevation):
+    box = codecad.util.BoundingBox(
+        codecad.util.Vector(-1, 0, 2), codecad.util.Vector(3, 1, 4)
+    )
+    cameras = ray_caster.get_orbit_camera_params(box, _size, None, 8, elevation)
+
+    assert len(cameras) == 8
+    distances = [abs(origin - box.midpoint()) for origin, _, _, _ in cameras]
+    assert distances == pytest.approx([distances[0]] * 8)
+    for origin, direction, up, focal_length in cameras:
+        assert (box.midpoint() - origin).normalized() == pytest.approx(direction)
+        assert direction.z == pytest.approx(-math.sin(math.radians(elevation)))
+        assert focal_length == cameras[0][3]
+
+    if elevation == 0:
+        assert cameras[0][1] == pytest.approx(
+            ray_caster.get_camera_params(box, _size, None)[1]
+        )
+
+
+def test_render_images(tmpdir, scene):
+    shape, camera_params, expected = scene
+    filename = str(tmpdir.join("frame_{:02}.png"))
+
+    cameras = [camera_params] * 3
+    codecad.rendering.image.render_images(shape, filename, cameras, size=_size)
+
+    assert sorted(f.basename for f in tmpdir.listdir()) == [
+        "frame_00.png",
+        "frame_01.png",
+        "frame_02.png",
+    ]
+
+
+def test_geometry_buffer():
+    shape = codecad.shapes.sphere(2)
+    origin, direction, up, focal_length = ray_caster.get_camera_params(
+        shape.bounding_box(), _size, None
+    )
+
+    image, geometry = ray_caster.render(
+        shape, origin, direction, up, focal_length, _size, geometry=True
+    )
+
+    expected = ray_caster.render(shape, origin, direction, up, focal_length, _size)
+    numpy.testing.assert_array_equal(image, expected)
+    assert geometry.shape == (_size[1], _size[0])
+
+    hit = numpy.isfinite(geometry["depth"])
+    assert 0.2 < hit.mean() < 0.8
+    assert hit[_size[1] // 2, _size[0] // 2]
+    assert not hit[0, 0]
+
+    position = geometry["position"][hit]
+    radius = numpy.linalg.norm(position, axis=1)
+    # Rays stop within pixel tolerance of the surface
+    numpy.testing.assert_allclose(radius, 1, atol=0.05)
+    numpy.testing.assert_allclose(
+        geometry["normal"][hit], position / radius[:, numpy.newaxis], atol=0.05
+    )
+    numpy.testing.assert_allclose(
+        geometry["depth"][hit],
+        numpy.linalg.norm(position - origin, axis=1),
+        rtol=1e-4,
+    )
+    assert (geometry["steps"] > 0).all()
+
+    assert numpy.isnan(geometry["position"][~hit]).all()
+    assert (geometry["normal"][~hit] == 0).all()
+
+
+def _assert_geometry_equal(actual, expected):
+    for name in ray_caster.GEOMETRY_DTYPE.names:
+        numpy.testing.assert_array_equal(actual[name], expected[name])
+
+
+def test_geometry_buffer_tiles(scene):
+    shape, camera_params, expected = scene
+    whole = ray_caster.render(shape, *camera_params, _size, geometry=True)
+
+    for tile in ray_caster.render_tiles(
+        shape, *camera_params, _size, tile_size=32, geometry=True
+    ):
+        height, width = tile.geometry.shape
+        _assert_geometry_equal(
+            tile.geometry,
+            whole.geometry[tile.y : tile.y + height, tile.x : tile.x + width],
+        )
+
+    (view,) = ray_caster.render_views(shape, [camera_params], _size, geometry=True)
+    numpy.testing.assert_array_equal(view.image, whole.image)
+    _assert_geometry_equal(view.geometry, whole.geometry)
+
+
+def test_edge_pixels():
+    geometry = numpy.zeros((6, 8), dtype=ray_caster.GEOMETRY_DTYPE)
+    geometry["depth"] = 10
+    geometry["depth"][:, 6:] = float("inf")  # Background
+    geometry["depth"][4:, :6] = 5  # Closer object
+    geometry["normal"] = (0, 0, 1)
+    geometry["normal"][:, :2] = (0, 1, 0)  # Crease
+    geometry["normal"][:, 2] = (0, 0.1, 1) / numpy.linalg.norm((0, 0.1, 1))
+
+    edges = ray_caster._edge_pixels(geometry)
+
+    expected = numpy.zeros((6, 8), dtype=bool)
+    expected[:, 5:7] = True
+    expected[3:5, :6] = True
+    expected[:, 1:3] = True
+    numpy.testing.assert_array_equal(edges, expected)
+
+
+def test_antialiasing(scene):
+    shape, camera_params, plain = scene
+    big_size = (_size[0] * 4, _size[1] * 4)
+    big = ray_caster.render(
+        shape,
+        *ray_caster.get_camera_params(shape.bounding_box(), big_size, None),
+        big_size,
+    )
+    supersampled = big.reshape(_size[1], 4, _size[0], 4, 3).mean(axis=(1, 3))
+    _, geometry = ray_caster.render(shape, *camera_params, _size, geometry=True)
+
+    antialiased = ray_caster.render(shape, *camera_params, _size, antialiasing=3)
+
+    changed = (antialiased != plain).any(axis=2)
+    assert changed.any()
+    assert not (changed & ~ray_caster._edge_pixels(geometry)).any()
+
+    def error(image):
+        return numpy.mean(((image - supersampled) / 255) ** 2)
+
+    assert error(antialiased) < 0.75 * error(plain)
@@ -0,0 +1,221 @@
+import os
+import sys
+
+import numpy
+import PIL.Image
+import pytest
+
+import codecad
+import codecad.rendering.watch
+from codecad.rendering import ray_caster
+
+
+@pytest.fixture
+def parts_asm():
+    return codecad.assembly(
+        "asm",
+        [
+            codecad.shapes.sphere(2).make_part("sphere"),
+            codecad.shapes.box(2).make_part("box").translated_x(3),
+            codecad.shapes.cylinder(d=2, h=2).make_part("cylinder").translated_x(6),
+        ],
+    )
+
+
+def _commandline_render(monkeypatch, obj, *args):
+    monkeypatch.setattr(sys, "argv", ["render"] + list(args))
+    codecad.commandline_render(obj)
+
+
+def test_render_parts_jobs(monkeypatch, tmpdir, parts_asm):
+    serial = str(tmpdir.join("serial_{}.stl"))
+    parallel = str(tmpdir.join("parallel_{}.stl"))
+    _commandline_render(monkeypatch, parts_asm, "-o", serial, "--parts")
+    _commandline_render(monkeypatch, parts_asm, "-o", parallel, "--parts", "-j", "2")
+
+    for name in ["sphere", "box", "cylinder"]:
+        with open(serial.format(name), "rb") as fp:
+            expected = fp.read()
+        with open(parallel.format(name), "rb") as fp:
+            assert fp.read() == expected
+        assert len(expected) > 84
+
+
+def test_shape_hash():
+    a = codecad.shapes.box(1, 2, 3).rotated_x(30)
+    b = codecad.shapes.box(1, 2, 3).rotated_x(30)
+    c = codecad.shapes.box(1, 2, 3).rotated_x(31)
+
+    assert codecad.nodes.get_shape_hash(a) == codecad.nodes.get_shape_hash(b)
+    assert codecad.nodes.get_shape_hash(a) != codecad.nodes.get_shape_hash(c)
+
+
+def test_render_cache(monkeypatch, tmpdir, parts_asm):
+    cache_dir = str(tmpdir.join("cache"))
+    output = str(tmpdir.join("part_{}.stl"))
+
+    _commandline_render(
+        monkeypatch, parts_asm, "-o", output, "--parts", "--cache", cache_dir
+    )
+    assert len(os.listdir(cache_dir)) == 3
+
+    with open(output.format("box"), "rb") as fp:
+        expected = fp.read()
+    os.remove(output.format("box"))
+
+    rendered = []
+    monkeypatch.setattr(
+        codecad.rendering,
+        "_render_one",
+        lambda renderer, shape, output, **kwargs: rendered.append(output),
+    )
+    _commandline_render(
+        monkeypatch, parts_asm, "-o", output, "--parts", "--cache", cache_dir
+    )
+    assert rendered == []
+    with open(output.format("box"), "rb") as fp:
+        assert fp.read() == expected
+
+
+def test_render_cache_eviction(tmpdir):
+    cache = codecad.rendering.cache.RenderCache(str(tmpdir.join("cache")), 250)
+    source = str(tmpdir.join("source"))
+
+    for i in range(5):
+        with open(source, "wb") as fp:
+            fp.write(bytes(100))
+        cache.put("key{}".format(i), source)
+        os.utime(cache._path("key{}".format(i)), (i, i))
+
+    assert cache.evictions == 3
+    assert cache.size() <= 250
+    assert not cache.get("key2", source)
+    assert cache.get("key4", source)
+    assert (cache.hits, cache.misses) == (1, 1)
+
+
+def _write_model(path, code, mtime):
+    with open(path, "w") as fp:
+        fp.write("import codecad\n")
+        fp.write(code)
+    # Explicit modification time, file system timestamps may be too coarse
+    os.utime(path, (mtime, mtime))
+
+
+def test_watch(tmpdir):
+    script = str(tmpdir.join("model.py"))
+    output = str(tmpdir.join("output.png"))
+    size = (60, 40)
+    watcher = codecad.rendering.watch.Watcher(
+        script,
+        output,
+        name="o",
+        size=size,
+        antialiasing=0,
+        tile_size=16,
+        preview_step=4,
+    )
+
+    _write_model(script, "o = codecad.shapes.sphere(2)\n", 1000)
+    watcher.run(poll_interval=0, max_reloads=1)
+
+    assert not watcher.changed()
+    camera_params = watcher.camera_params
+    sphere = codecad.shapes.sphere(2)
+    numpy.testing.assert_array_equal(
+        numpy.asarray(PIL.Image.open(output)),
+        ray_caster.render(sphere, *camera_params, size),
+    )
+
+    # Broken script keeps the old image
+    _write_model(script, "o = codecad.shapes.sphere(\n", 1001)
+    assert watcher.changed()
+    watcher.run(poll_interval=0, max_reloads=1)
+    assert sorted(f.basename for f in tmpdir.listdir()) == ["model.py", "output.png"]
+
+    # Bigger shape is rendered with the same camera
+    _write_model(script, "o = codecad.shapes.box(3)\n", 1002)
+    watcher.run(poll_interval=0, max_reloads=1)
+
+    assert watcher.camera_params is camera_params
+    numpy.testing.assert_array_equal(
+        numpy.asarray(PIL.Image.open(output)),
+        ray_caster.render(codecad.shapes.box(3), *camera_params, size),
+    )
+
+
+def test_watch_main_script(tmpdir):
+    """ Object passed to commandline_render is rendered, with antialiasing """
+    script = str(tmpdir.join("model.py"))
+    output = str(tmpdir.join("output.png"))
+    size = (60, 40)
+    code = (
+        'if __name__ == "__main__":\n'
+        "    codecad.commandline_render(codecad.shapes.sphere(2))\n"
+        '    raise RuntimeError("Not reached")\n'
+    )
+    _write_model(script, code, 1000)
+
+    watcher = codecad.rendering.watch.Watcher(
+        script, output, size=size, antialiasing=2, tile_size=16
+    )
+    watcher.run(poll_interval=0, max_reloads=1)
+
+    assert codecad.rendering._capture_hook is None
+    numpy.testing.assert_array_equal(
+        numpy.asarray(PIL.Image.open(output)),
+        ray_caster.render(
+            codecad.shapes.sphere(2), *watcher.camera_params, size, antialiasing=2
+        ),
+    )
+
+
+def test_commandline_watch(monkeypatch, tmpdir):
+    """ Image renderer arguments are accepted by the watch mode """
+    watchers = []
+    monkeypatch.setattr(
+        codecad.rendering.watch.Watcher, "run", lambda self: watchers.append(self)
+    )
+    monkeypatch.setattr(sys.modules["__main__"], "__file__", "model.py")
+    monkeypatch.setattr(sys, "argv", ["render", "--watch", "-o", "out.png"])
+
+    sphere = codecad.shapes.sphere(1)
+    codecad.commandline_render(sphere, size=(30, 20), view_angle=45, antialiasing=0)
+
+    (watcher,) = watchers
+    assert (watcher.path, watcher.filename) == ("model.py", "out.png")
+    assert watcher._initial_obj is sphere
+    assert (watcher.size, watcher.view_angle, watcher.antialiasing) == ((30, 20), 45, 0)
+
+
+def test_watch_initial_object(monkeypatch, tmpdir):
+    """ Initial object is rendered without running the script, failed renders
+    keep the previous image """
+    script = str(tmpdir.join("model.py"))
+    output = str(tmpdir.join("output.png"))
+    size = (60, 40)
+    _write_model(script, 'raise RuntimeError("Script executed")\n', 1000)
+
+    watcher = codecad.rendering.watch.Watcher(
+        script, output, size=size, antialiasing=0, obj=codecad.shapes.sphere(2)
+    )
+    watcher.run(poll_interval=0, max_reloads=0)
+    expected = numpy.asarray(PIL.Image.open(output))
+
+    assert not watcher.changed()
+    sphere = codecad.shapes.sphere(2)
+    numpy.testing.assert_array_equal(
+        expected, ray_caster.render(sphere, *watcher.camera_params, size)
+    )
+
+    def failing_render_tiles(*args, **kwargs):
+        yield from original_render_tiles(*args, **kwargs)
+        raise RuntimeError("Render failed")
+
+    original_render_tiles = ray_caster.render_tiles
+    monkeypatch.setattr(ray_caster, "render_tiles", failing_render_tiles)
+    _write_model(script, "o = codecad.shapes.box(3)\n", 1001)
+    watcher.name = "o"
+    watcher.run(poll_interval=0, max_reloads=1)
+
+    numpy.testing.assert_array_equal(numpy.asarray(PIL.Image.open(output)), expected)
@@ -0,0 +1,108 @@
+import math
+
+import numpy
+import pytest
+from pytest import approx
+
+import codecad
+import codecad.rendering.polygon2d
+
+
+def _area(polygons):
+    """ Total signed area of polygons using the shoelace formula """
+    area = 0
+    for polygon in polygons:
+        x, y = polygon.T
+        area += numpy.dot(x, numpy.roll(y, -1)) - numpy.dot(numpy.roll(x, -1), y)
+    return area / 2
+
+
+@pytest.mark.parametrize(
+    "grid_size, max_layers",
+    [
+        pytest.param(None, None, id="single_block"),
+        pytest.param(8, None, id="multiple_blocks"),
+        pytest.param(8, 2, id="multiple_batches"),
+    ],
+)
+def test_sphere_slices(grid_size, max_layers):
+    r = 4
+    z_values = [-5, -3.5, -1, 0, 0.5, 2, 3, 6]
+    layers = list(
+        codecad.rendering.polygon2d.slices(
+            codecad.shapes.sphere(r=r),
+            z_values,
+            0.1,
+            subdivision_grid_size=grid_size,
+            max_layers=max_layers,
+        )
+    )
+
+    assert len(layers) == len(z_values)
+    for z, polygons in zip(z_values, layers):
+        if abs(z) >= r:
+            assert polygons == []
+        else:
+            assert len(polygons) == 1
+            assert abs(_area(polygons)) == approx(math.pi * (r ** 2 - z ** 2), rel=0.02)
+
+
+def test_slices_match_polygon():
+    """ Slice of a prism has the same outline as its base """
+    base = codecad.shapes.circle(d=4) - codecad.shapes.rectangle(1, 6)
+    expected = list(codecad.rendering.polygon2d.polygon(base, subdivision_grid_size=4))
+
+    (polygons,) = codecad.rendering.polygon2d.slices(
+        base.extruded(4), [1], subdivision_grid_size=4
+    )
+
+    assert len(expected) == 2
+    assert len(polygons) == 2
+    assert _area(polygons) == approx(_area(expected), rel=0.02)
+    assert _area(expected) == approx(8.61, rel=0.05)  # Circle minus the strip
+
+
+def test_slices_streaming(monkeypatch):
+    """ Bottom layer is yielded before blocks of the top layer are processed """
+    added = []
+    add_block = codecad.rendering.polygon2d._ChainAssembler.add_block
+    monkeypatch.setattr(
+        codecad.rendering.polygon2d._ChainAssembler,
+        "add_block",
+        lambda self, *args: added.append(args) or add_block(self, *args),
+    )
+    # Layers intersect disjoint columns of blocks
+    bottom_box = codecad.shapes.box(4, 4, 2).translated_z(-4)
+    top_sphere = codecad.shapes.sphere(2).translated(8, 0, 4)
+
+    layers = codecad.rendering.polygon2d.slices(
+        bottom_box + top_sphere, [-4, 4], 0.1, subdivision_grid_size=8
+    )
+    bottom = next(layers)
+    added_before_top = len(added)
+    top = next(layers)
+
+    assert len(bottom) == len(top) == 1
+    assert 0 < added_before_top < len(added)
+
+
+def test_slices_dimension():
+    with pytest.raises(TypeError):
+        list(codecad.rendering.polygon2d.slices(codecad.shapes.circle(1), [0]))
+
+
+def test_follow_links():
+    """ One closed loop, one open chain and an empty cell """
+    vertices = numpy.zeros(6, dtype=[("x", numpy.float32), ("y", numpy.float32)])
+    vertices["x"] = numpy.arange(6)
+    overflow = 0xC0300000
+    links = numpy.array([2, 3, overflow | 7, 5, 0xFFFFFFFF, 1], dtype=numpy.uint32)
+
+    closed, open_chains = codecad.rendering.polygon2d._follow_links(vertices, links)
+
+    assert len(closed) == 1
+    assert closed[0][:, 0].tolist() == [1, 3, 5]
+    assert list(open_chains) == [0]
+    points, spec = open_chains[0]
+    assert points[:, 0].tolist() == [0, 2]
+    assert spec == overflow